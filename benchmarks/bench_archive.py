@@ -0,0 +1,124 @@
+"""
+比較舊版 (單一 process、zipfile deflate) 與 archive_codec.write_archive (平行壓縮 + 素材直接存) 打包遊戲的速度與大小
+
+用法 (在專案根目錄):
+    python benchmarks/bench_archive.py
+    python benchmarks/bench_archive.py --synthetic-mb 100 --codecs deflate-1 deflate-6 --workers 4
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "server"))
+from archive_codec import write_archive, get_executor  # noqa: E402
+
+SAMPLE_GAMES_DIR = os.path.join(ROOT, "developer", "games")
+
+WORDS = [b"player", b"score", b"room", b"lobby", b"render", b"sprite", b"update", b"def", b"return", b"self"]
+
+
+# --- 舊版實作 (改版前 zip_game_folder_to_player 的寫法) ---
+
+def old_write_archive(output_zip_name, entries):
+    with zipfile.ZipFile(output_zip_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for file_path, arcname in entries:
+            zipf.write(file_path, arcname)
+
+
+def list_entries(folder_path):
+    entries = []
+    for root, dirs, files in os.walk(folder_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            entries.append((file_path, os.path.relpath(file_path, folder_path)))
+    return entries
+
+
+def make_synthetic_tree(dest, total_mb):
+    """
+    假的大型遊戲: 約一半是程式 / 關卡資料 (好壓縮)，一半是圖片音效 (已壓縮過，用亂數代替)
+    每個檔案 1 ~ 16 MB，固定亂數種子，每次產生的內容都一樣
+    """
+    rng = random.Random(0)
+    total = total_mb * 1024 * 1024
+    written = 0
+    index = 0
+    while written < total:
+        size = min(rng.randint(1, 16) * 1024 * 1024, total - written)
+        kind = index % 4
+        if kind == 0:
+            path = os.path.join(dest, "client", "levels", f"level{index}.json")
+            data = b" ".join(rng.choice(WORDS) for _ in range(size // 6 + 1))[:size]
+        elif kind == 1:
+            path = os.path.join(dest, "client", "data", f"blob{index}.bin")
+            # 半隨機的二進位資料 (重複的小片段)，壓縮率介於文字與亂數之間
+            chunk = rng.randbytes(4096)
+            data = (chunk * (size // 4096 + 1))[:size]
+        elif kind == 2:
+            path = os.path.join(dest, "client", "assets", f"tex{index}.png")
+            data = rng.randbytes(size)
+        else:
+            path = os.path.join(dest, "client", "assets", f"music{index}.ogg")
+            data = rng.randbytes(size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        written += size
+        index += 1
+
+
+def run(write, entries, tmp_dir):
+    """回傳 (秒數, 壓縮檔大小)"""
+    output = os.path.join(tmp_dir, "bench.zip")
+    start = time.perf_counter()
+    write(output, entries)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(output)
+    os.remove(output)
+    return elapsed, size
+
+
+def human(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / 1024:.1f} KB"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--synthetic-mb', type=int, default=500, help='合成遊戲的大小 (MB)，0 表示不測')
+    parser.add_argument('--codecs', nargs='+', default=["deflate-1", "deflate-6", "deflate-9", "lzma", "store"])
+    parser.add_argument('--workers', type=int, default=None, help='壓縮 process 數 (預設 CPU 核心數)')
+    args = parser.parse_args()
+
+    executor = get_executor(args.workers)
+    tmp_dir = tempfile.mkdtemp(prefix="bench_archive_")
+    try:
+        trees = [(name, os.path.join(SAMPLE_GAMES_DIR, name)) for name in sorted(os.listdir(SAMPLE_GAMES_DIR))
+                 if os.path.isdir(os.path.join(SAMPLE_GAMES_DIR, name))]
+        if args.synthetic_mb:
+            synthetic = os.path.join(tmp_dir, "synthetic")
+            make_synthetic_tree(synthetic, args.synthetic_mb)
+            trees.append((f"synthetic-{args.synthetic_mb}MB", synthetic))
+
+        print(f"workers: {executor._max_workers}")
+        print(f"{'game':>18} {'codec':>10} {'seconds':>9} {'size':>10} {'speedup':>9}")
+        for name, folder in trees:
+            entries = list_entries(folder)
+            raw = sum(os.path.getsize(path) for path, _ in entries)
+            base_time, base_size = run(old_write_archive, entries, tmp_dir)
+            print(f"{name:>18} {'raw':>10} {'':>9} {human(raw):>10}")
+            print(f"{name:>18} {'old':>10} {base_time:>9.2f} {human(base_size):>10} {1:>8.2f}x")
+            for codec in args.codecs:
+                elapsed, size = run(lambda out, ents: write_archive(out, ents, codec=codec, executor=executor),
+                                    entries, tmp_dir)
+                print(f"{name:>18} {codec:>10} {elapsed:>9.2f} {human(size):>10} {base_time / elapsed:>8.2f}x")
+    finally:
+        shutil.rmtree(tmp_dir)
+        executor.shutdown()
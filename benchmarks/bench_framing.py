@@ -0,0 +1,87 @@
+"""
+比較舊版 (bytes 串接) 與 framing.py (recv_into + scatter-gather) 收送封包的速度
+
+用法 (在專案根目錄):
+    python benchmarks/bench_framing.py
+    python benchmarks/bench_framing.py --sizes 1024 1048576 --repeat 20
+"""
+import argparse
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from framing import send_frame, recv_frame  # noqa: E402
+
+
+# --- 舊版實作 (改版前 utils.py 的寫法) ---
+
+def old_send_frame(sock, payload):
+    sock.sendall(struct.pack('!I', len(payload)) + payload)
+
+def old_recvall(sock, n):
+    data = b''
+    while len(data) < n:
+        packet = sock.recv(n - len(data))
+        if not packet:
+            return None
+        data += packet
+    return data
+
+def old_recv_frame(sock):
+    header = old_recvall(sock, 4)
+    if not header:
+        return None
+    return old_recvall(sock, struct.unpack('!I', header)[0])
+
+
+def run(send, recv, size, repeat):
+    """回傳每秒可以傳多少 MB (單向，sender 與 receiver 各一條執行緒)"""
+    a, b = socket.socketpair()
+    # 調小 socket buffer，讓大封包一定會被切成很多段 recv，接近真實網路的情況
+    for s in (a, b):
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 256 * 1024)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 256 * 1024)
+    payload = os.urandom(size)
+
+    def sender():
+        for _ in range(repeat):
+            send(a, payload)
+
+    t = threading.Thread(target=sender)
+    start = time.perf_counter()
+    t.start()
+    for _ in range(repeat):
+        body = recv(b)
+        assert body is not None and len(body) == size
+    t.join()
+    elapsed = time.perf_counter() - start
+    a.close()
+    b.close()
+    return size * repeat / elapsed / (1024 * 1024)
+
+
+def human(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):g} MB"
+    if size >= 1024:
+        return f"{size / 1024:g} KB"
+    return f"{size} B"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1024, 64 * 1024, 1024 * 1024, 10 * 1024 * 1024], help='封包大小 (bytes)')
+    parser.add_argument('--repeat', type=int, default=0, help='每種大小收送幾次 (預設依大小自動決定)')
+    args = parser.parse_args()
+
+    print(f"{'size':>10} {'old MB/s':>12} {'new MB/s':>12} {'speedup':>9}")
+    for size in args.sizes:
+        repeat = args.repeat or max(3, min(2000, (64 * 1024 * 1024) // size))
+        old = run(old_send_frame, old_recv_frame, size, repeat)
+        new = run(send_frame, recv_frame, size, repeat)
+        print(f"{human(size):>10} {old:>12.1f} {new:>12.1f} {new / old:>8.2f}x")
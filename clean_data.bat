@@ -4,6 +4,8 @@ pause
 
 echo Cleaning Server Data...
 del /Q server\server_data\*.json
+del /Q server\server_data\journal.log server\server_data\journal.log.old
+del /Q server\server_data\platform.db*
 
 echo Cleaning Uploaded Games...
 rmdir /S /Q server\games
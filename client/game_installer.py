@@ -0,0 +1,289 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+
+from utils import send_json, recv_json
+from framing import recv_file_body, format_rate
+
+# 下載 / 安裝遊戲 (商城下載、建立房間、加入房間共用)
+# 沒下載完的壓縮檔留在 {games_root}/_downloads/{digest}.partial，以 Server 給的 sha256 當 key
+# 斷線重連後再下載同一個版本，只跟 Server 要缺少的尾巴；收完先驗證 sha256 才解壓縮
+# 暫存資料夾都放在各玩家自己的 games_root 底下: 同一台電腦 (同一個工作目錄) 可能同時開好幾個 Client，
+# install_lock 只管得到同一個 process (遊戲 ID 不能用 _ 開頭，不會撞名)
+
+PARTIAL_DIR = "_downloads"
+TEMP_EXTRACT_FOLDER = "_extract"
+# 差異更新換版本時，舊版本先改名成 <version>.old (見 _apply_delta)
+BACKUP_SUFFIX = ".old"
+
+# 同一個 Client 的暫存資料夾是共用的，同一時間只能有一個安裝在跑 (主選單與背景預先下載)；刪除已安裝的遊戲也要拿這個鎖
+install_lock = threading.Lock()
+_local = threading.local()
+
+
+class DownloadError(Exception):
+    """Server 拒絕或檔案有問題 (連線中斷不屬於這類，會直接丟出 ConnectionError)"""
+    pass
+
+
+@contextmanager
+def quiet():
+    """在這個執行緒內不顯示下載進度 (背景下載時不要洗掉主選單的畫面)"""
+    _local.quiet = True
+    try:
+        yield
+    finally:
+        _local.quiet = False
+
+def _log(msg):
+    if not getattr(_local, 'quiet', False):
+        print(msg)
+
+
+def _partial_path(games_root, digest):
+    return os.path.join(games_root, PARTIAL_DIR, f"{digest}.partial")
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _receive_archive(sock, partial_path):
+    """
+    接收 send_file 的 Header + 內容，接在 partial_path 後面
+    Server 從 header['offset'] 開始送，這之後的舊內容一律截掉
+    """
+    header = recv_json(sock)
+    if header is None:
+        raise ConnectionResetError("Connection lost before file header")
+    if header.get('status') != 'ok':
+        raise DownloadError(header.get('msg', 'File transfer failed'))
+
+    filesize = header['size']
+    offset = header.get('offset', 0)
+    count = filesize - offset
+    if offset:
+        _log(f"[Download] Resuming at {offset}/{filesize} bytes...")
+    else:
+        _log(f"[Download] Receiving {header['filename']} ({filesize} bytes)...")
+
+    start = time.perf_counter()
+    with open(partial_path, 'r+b' if os.path.exists(partial_path) else 'wb') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        received = recv_file_body(sock, f, count)
+    elapsed = time.perf_counter() - start
+
+    if received < count:
+        # 收到的部分留著，下次從 offset + received 接著下載
+        raise ConnectionResetError(f"Connection lost after {offset + received}/{filesize} bytes")
+    _log(f"[Download] Received {count} bytes ({elapsed:.2f}s, {format_rate(count, elapsed)})")
+
+
+def _install_archive(zip_path, games_root):
+    """解壓縮並部署到 games_root/{game_id}/{version}/，回傳 (game_id, version)"""
+    extract_dir = os.path.join(games_root, TEMP_EXTRACT_FOLDER)
+    if os.path.exists(extract_dir):
+        shutil.rmtree(extract_dir)
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            zf.extractall(extract_dir)
+
+        # 讀取 Manifest 並驗證
+        manifest_path = os.path.join(extract_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            raise DownloadError("Manifest not found in zip!")
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        game_id = manifest.get('game_id')
+        version = manifest.get('version')
+        if not game_id or not version:
+            raise DownloadError("Invalid manifest: missing game_id or version")
+
+        # 若已經有該遊戲資料夾，刪掉舊版本更新成新的版本
+        selected_game_dir = os.path.join(games_root, game_id)
+        if os.path.exists(selected_game_dir):
+            shutil.rmtree(selected_game_dir)
+        final_dir = os.path.join(games_root, game_id, version)
+        os.makedirs(os.path.dirname(final_dir), exist_ok=True)
+        shutil.move(extract_dir, final_dir)
+        return game_id, version
+    finally:
+        if os.path.exists(extract_dir):
+            shutil.rmtree(extract_dir)
+
+
+def _fetch_archive(sock, request, games_root):
+    """
+    送出 download_game / download_delta，照 Server 的 send_archive 流程收檔並驗證 sha256
+    回傳 (Server 的回覆, 收好的壓縮檔路徑)
+    """
+    send_json(sock, request)
+    res = recv_json(sock)
+    if res is None:
+        raise ConnectionResetError("Connection lost")
+    if res.get('status') != 'ok':
+        raise DownloadError(res.get('msg', 'Unknown error'))
+
+    file_size = res['file_size']
+    digest = res.get('digest')
+    os.makedirs(os.path.join(games_root, PARTIAL_DIR), exist_ok=True)
+    partial_path = _partial_path(games_root, digest or "unknown")
+    resume_from = 0
+    if digest and os.path.exists(partial_path):
+        resume_from = min(os.path.getsize(partial_path), file_size)
+    _log(f"開始下載遊戲 {request['game_id']}，檔案大小: {file_size} bytes")
+
+    # 告訴 server: "準備好了，請傳檔案" (從 resume_from 開始)
+    send_json(sock, {"status": "ready_to_receive", "resume_from": resume_from})
+    _receive_archive(sock, partial_path)
+
+    # 先確認內容跟 Server 說的一樣才解壓縮
+    if digest and _file_sha256(partial_path) != digest:
+        _reject(sock, partial_path, "Downloaded file is corrupted (sha256 mismatch), please retry")
+    return res, partial_path
+
+def _reject(sock, partial_path, msg):
+    """壞掉的檔案不能留著續傳，刪掉 (下次從頭下載) 並告訴 Server 失敗"""
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    send_json(sock, {"status": "error", "msg": msg})
+    raise DownloadError(msg)
+
+def _finish(sock, partial_path, install_func):
+    try:
+        game_id, version = install_func()
+    except (DownloadError, zipfile.BadZipFile, json.JSONDecodeError, OSError) as e:
+        # OSError: 寫檔 / 改名失敗 (例如 Windows 上遊戲還開著)
+        _reject(sock, partial_path, str(e))
+    os.remove(partial_path)
+    _log(f"已成功下載進我的遊戲庫了！")
+    send_json(sock, {
+        "status": "ok",
+        "msg": f"Game '{game_id}' (v{version}) uploaded successfully!"
+    })
+    return game_id, version
+
+
+def download_and_install(sock, game_id, games_root):
+    """
+    下載某遊戲的最新版 (完整壓縮檔) 並安裝，成功回傳 (game_id, version)
+    Server 拒絕、驗證失敗時丟出 DownloadError；連線中斷時丟出 ConnectionError (已收到的部分會保留)
+    """
+    res, partial_path = _fetch_archive(sock, {"cmd": "download_game", "game_id": game_id}, games_root)
+    return _finish(sock, partial_path, lambda: _install_archive(partial_path, games_root))
+
+
+# --- 差異更新 ---
+
+def installed_version(games_root, game_id):
+    """本機安裝的版本 (沒安裝回傳 None)；一個遊戲只會有一個版本，換版本時留下的備份不算"""
+    game_dir = os.path.join(games_root, game_id)
+    if game_id.startswith('_') or not os.path.isdir(game_dir): # _ 開頭的是暫存資料夾
+        return None
+    versions = [name for name in os.listdir(game_dir) if not name.endswith(BACKUP_SUFFIX)]
+    return versions[0] if versions else None
+
+def _installed_version_dir(games_root, game_id):
+    version = installed_version(games_root, game_id)
+    return os.path.join(games_root, game_id, version) if version else None
+
+def _local_files(version_dir):
+    """本機已安裝的檔案 {相對路徑: sha256}，範圍跟 Server 打包給玩家的一樣 (manifest.json + client/)"""
+    paths = [os.path.join(version_dir, 'manifest.json')]
+    for root, dirs, names in os.walk(os.path.join(version_dir, 'client')):
+        paths.extend(os.path.join(root, name) for name in names)
+    return {os.path.relpath(path, version_dir).replace(os.sep, '/'): _file_sha256(path)
+            for path in paths if os.path.isfile(path)}
+
+def _safe_join(base, rel):
+    path = os.path.normpath(os.path.join(base, *rel.split('/')))
+    if os.path.commonpath([os.path.abspath(base), os.path.abspath(path)]) != os.path.abspath(base):
+        raise DownloadError(f"Invalid path in update: {rel}")
+    return path
+
+def _apply_delta(zip_path, games_root, game_id, old_dir, res):
+    """
+    在暫存資料夾組出新版本，檢查完才換上去，中途失敗不會動到原本安裝好的遊戲
+    沒變的檔案用 hardlink 帶過去 (不複製內容)；新檔案一律先刪掉連結再寫，不會改到舊版本的檔案
+    """
+    version = res['version']
+    files = res['files']
+    staging = os.path.join(games_root, PARTIAL_DIR, f"{game_id}-{version}.staging")
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    try:
+        for root, dirs, names in os.walk(old_dir):
+            for name in names:
+                src = os.path.join(root, name)
+                dst = os.path.join(staging, os.path.relpath(src, old_dir))
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copy2(src, dst) # 檔案系統不支援 hardlink
+
+        for rel in res['deleted']:
+            path = _safe_join(staging, rel)
+            if os.path.isfile(path):
+                os.remove(path)
+
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            for member in zf.infolist():
+                path = _safe_join(staging, member.filename)
+                if os.path.isfile(path):
+                    os.remove(path)
+                zf.extract(member, staging)
+
+        # 組出來的檔案要跟 Server 的清單完全一樣
+        for rel, info in files.items():
+            path = _safe_join(staging, rel)
+            if not os.path.isfile(path) or os.path.getsize(path) != info['size']:
+                raise DownloadError(f"Update verification failed: {rel}")
+        for rel in res['changed']:
+            if _file_sha256(_safe_join(staging, rel)) != files[rel]['sha256']:
+                raise DownloadError(f"Update verification failed: {rel}")
+
+        # 換上新版本: 先搬走舊的再改名 (同一個檔案系統內的 rename)
+        final_dir = os.path.join(games_root, game_id, version)
+        backup = old_dir + BACKUP_SUFFIX
+        if os.path.exists(backup):
+            shutil.rmtree(backup) # 上次沒刪乾淨的備份
+        os.rename(old_dir, backup)
+        try:
+            os.rename(staging, final_dir)
+        except OSError:
+            os.rename(backup, old_dir) # 換不上去就把舊版本放回去
+            raise
+        # 刪不掉 (例如檔案還開著) 就留著，不影響新版本；下次更新時再刪
+        shutil.rmtree(backup, ignore_errors=True)
+        return game_id, version
+    finally:
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+
+
+def install_latest(sock, game_id, games_root):
+    """
+    安裝 / 更新到最新版: 本機已經有舊版就只下載差異，否則 (或差異更新失敗時) 下載完整壓縮檔
+    回傳 (game_id, version)，錯誤處理同 download_and_install
+    """
+    with install_lock:
+        old_dir = _installed_version_dir(games_root, game_id)
+        if old_dir:
+            try:
+                have = _local_files(old_dir)
+                res, partial_path = _fetch_archive(sock, {"cmd": "download_delta", "game_id": game_id, "have": have}, games_root)
+                _log(f"[Update] {len(res['changed'])}/{len(res['files'])} files changed, {len(res['deleted'])} removed")
+                return _finish(sock, partial_path, lambda: _apply_delta(partial_path, games_root, game_id, old_dir, res))
+            except DownloadError as e:
+                _log(f"[Update] 差異更新失敗 ({e})，改為下載完整遊戲...")
+        return download_and_install(sock, game_id, games_root)
@@ -0,0 +1,77 @@
+import json
+import socket
+import struct
+import threading
+import time
+
+# 多房間模式的本機轉接: 遊戲 Client 不必知道 room_token
+# 在 127.0.0.1 開一個 Port 給遊戲 Client 連，同時連上 Server 的 host 並先送出 room_token，之後雙向原封不動轉送
+
+# host 剛啟動時可能還沒開始 listen，連線失敗就在這段時間內重試
+CONNECT_RETRY_SECONDS = 5
+# 遊戲 Client 多久內要連上來
+ACCEPT_TIMEOUT = 30
+RELAY_CHUNK_SIZE = 64 * 1024
+
+
+def start_relay(host, port, room_token):
+    """回傳本機 Port，遊戲 Client 改連 127.0.0.1:這個 Port"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    threading.Thread(target=_serve, args=(listener, host, port, room_token), daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def _connect_upstream(host, port):
+    deadline = time.monotonic() + CONNECT_RETRY_SECONDS
+    while True:
+        try:
+            return socket.create_connection((host, port))
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _pipe(src, dst):
+    try:
+        while True:
+            data = src.recv(RELAY_CHUNK_SIZE)
+            if not data:
+                break
+            dst.sendall(data)
+    except OSError:
+        pass
+    finally:
+        # 告訴另一邊這個方向沒有資料了，另一個方向照常轉送到對方關閉
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def _serve(listener, host, port, room_token):
+    upstream = None
+    try:
+        upstream = _connect_upstream(host, port)
+        body = json.dumps({"room_token": room_token}).encode('utf-8')
+        upstream.sendall(struct.pack('!I', len(body)) + body)
+
+        listener.settimeout(ACCEPT_TIMEOUT)
+        local, _ = listener.accept()
+        local.settimeout(None)
+    except OSError as e:
+        print(f"[Relay] 無法連線至遊戲 Server: {e}")
+        if upstream:
+            upstream.close()
+        return
+    finally:
+        listener.close()
+
+    t = threading.Thread(target=_pipe, args=(upstream, local), daemon=True)
+    t.start()
+    _pipe(local, upstream)
+    t.join()
+    local.close()
+    upstream.close()
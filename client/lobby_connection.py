@@ -0,0 +1,126 @@
+import json
+import selectors
+import socket
+import threading
+from collections import deque
+
+from framing import HEADER, MAX_FRAME_SIZE, FrameTooLargeError
+from utils import send_json
+
+# 大廳連線: 包住 socket，讓房間監聽執行緒可以用 selector 等訊息，不用 timeout 輪詢
+# - 收到的 bytes 先放進自己的緩衝區，湊滿一整個封包才解析，封包不會因為等待中斷而被切斷
+# - 要停止監聽時 wake() 透過 socketpair 叫醒 select，不必等 timeout
+# - request() 送出指令後只拿「回覆」(沒有 cmd 的訊息)，中途收到的廣播先排隊，之後依序交給 recv_message()
+# 對外也提供 sendall / recv / recv_into，大廳選單的 send_json / recv_json / 下載遊戲照舊把它當 socket 用
+# (同一時間只能有一個執行緒在讀: 房間模式是監聽執行緒，其他時候是主執行緒)
+
+RECV_SIZE = 64 * 1024
+
+
+class LobbyConnection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.disconnected = False
+        self._buf = bytearray()
+        self._events = deque()
+        self._send_lock = threading.Lock() # 主執行緒與監聽執行緒都會送指令
+        self._woken = False
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(sock, selectors.EVENT_READ)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+
+    # --- socket 介面 ---
+
+    def sendall(self, data):
+        with self._send_lock:
+            self.sock.sendall(data)
+
+    def recv(self, n):
+        if self._buf:
+            data = bytes(self._buf[:n])
+            del self._buf[:n]
+            return data
+        return self.sock.recv(n)
+
+    def recv_into(self, view, n=0):
+        n = n or len(view)
+        if self._buf:
+            n = min(n, len(self._buf))
+            view[:n] = self._buf[:n]
+            del self._buf[:n]
+            return n
+        return self.sock.recv_into(view, n)
+
+    def close(self):
+        self._selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+        self.sock.close()
+
+    # --- 房間模式 ---
+
+    def wake(self):
+        """讓正在 recv_message() / request() 等待的執行緒馬上回傳 None (可以從其他執行緒呼叫)"""
+        self._woken = True
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass # 緩衝區滿了代表已經有還沒處理的喚醒
+
+    def _pop_frame(self):
+        """緩衝區裡有完整的封包就取出解析，不完整就留著等後面的 bytes"""
+        if len(self._buf) < HEADER.size:
+            return None
+        length = HEADER.unpack_from(self._buf)[0]
+        if length > MAX_FRAME_SIZE:
+            raise FrameTooLargeError(f"Frame of {length} bytes exceeds limit of {MAX_FRAME_SIZE} bytes")
+        end = HEADER.size + length
+        if len(self._buf) < end:
+            return None
+        body = bytes(self._buf[HEADER.size:end])
+        del self._buf[:end]
+        return json.loads(body.decode('utf-8'))
+
+    def _next_frame(self):
+        """等下一個完整的封包；Server 斷線 (disconnected = True) 或被 wake() 叫醒時回傳 None"""
+        while True:
+            msg = self._pop_frame()
+            if msg is not None:
+                return msg
+            if self._woken:
+                self._woken = False
+                return None
+            for key, _ in self._selector.select():
+                if key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(64):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                try:
+                    chunk = self.sock.recv(RECV_SIZE)
+                except ConnectionResetError:
+                    chunk = b''
+                if not chunk:
+                    self.disconnected = True
+                    return None
+                self._buf += chunk
+
+    def recv_message(self):
+        """下一則訊息 (廣播或回覆，依收到的順序)，None 的意思同 _next_frame"""
+        if self._events:
+            return self._events.popleft()
+        return self._next_frame()
+
+    def request(self, req):
+        """送出指令並回傳它的回覆；等待期間收到的廣播留給之後的 recv_message()"""
+        send_json(self, req)
+        while True:
+            msg = self._next_frame()
+            if msg is None or 'cmd' not in msg:
+                return msg
+            self._events.append(msg)
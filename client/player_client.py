@@ -1,16 +1,17 @@
-import shutil
 import socket
 import os
 import sys
 import time
-import zipfile
-import json
 import threading
 import subprocess
 import argparse
 # 假設 network.py 放在同層級的 utils 資料夾
 # 如果放在同層，直接 from network import ...
-from utils import send_json, recv_json, recv_file, paged_cli_menu
+from utils import send_json, recv_json, paged_cli_menu
+from game_installer import install_latest, installed_version, DownloadError
+from prefetcher import Prefetcher
+from lobby_connection import LobbyConnection
+from game_relay import start_relay
 from config import LOBBY_PORT
 
 
@@ -20,18 +21,33 @@ SERVER_IP = '140.113.17.11'
 GAMES_ROOT_DIR = "games"  # 下載後遊戲存放根目錄
 in_game = threading.Event()
 game_process = None
+# 商城目錄快取: Server 回傳 not_modified 時直接沿用
+catalog_cache = {"version": None, "games": []}
+session_token = None # 登入時 Server 發的，背景預先下載的連線用它接上同一個帳號
+prefetcher = None
 # --- 功能函式 ---
+def mark_game_used(game_id):
+    """記錄最近使用時間 (預先下載的空間不夠時，先刪最久沒用的遊戲)"""
+    if prefetcher:
+        prefetcher.touch(game_id)
+
+def game_running():
+    return game_process is not None and game_process.poll() is None
+
 def room_listener(sock):
     """
     房間專用的監聽執行緒
+    sock 是 LobbyConnection: 沒有訊息時停在 select 上，要結束時由 sock.wake() 叫醒
     """
-    global stop_room_listener
+    global stop_room_listener, game_process
     print("[System] 已進入房間監聽模式...")
     #先收一次player_joined得到歡迎訊息
-    msg = recv_json(sock)
+    msg = sock.recv_message()
     if not msg:
-        print("[System] Server 斷線")
-        os._exit(0)
+        if sock.disconnected:
+            print("[System] Server 斷線")
+            os._exit(0)
+        return
     cmd = msg.get('cmd')
     status = msg.get('status')
     if cmd == 'player_joined':
@@ -40,8 +56,7 @@ def room_listener(sock):
 
     is_host = False
     state = "waiting"
-    send_json(sock, {"cmd": "get_host"})
-    res = recv_json(sock)
+    res = sock.request({"cmd": "get_host"})
     if res and res['status'] == 'ok':
         is_host = res['host']
     
@@ -58,16 +73,12 @@ def room_listener(sock):
 
     while not stop_room_listener:
         try:
-            # 設定 timeout，讓執行緒有機會檢查 stop_room_listener 變數
-            sock.settimeout(0.5) 
-            try:
-                msg = recv_json(sock)
-            except socket.timeout:
-                continue # 沒收到東西，繼續迴圈檢查 stop flag
-            
+            msg = sock.recv_message()
             if not msg:
-                print("[System] Server 斷線")
-                os._exit(0)
+                if sock.disconnected:
+                    print("[System] Server 斷線")
+                    os._exit(0)
+                break # 主執行緒要求停止 (wake)
 
             cmd = msg.get('cmd')
             status = msg.get('status')
@@ -99,11 +110,16 @@ def room_listener(sock):
                 game_id = parts[1]
                 version = parts[2]
                 game_path = os.path.join(GAMES_ROOT_DIR, game_id, version)
+                mark_game_used(game_id)
                 client_exe = msg.get('client_exe', '')
                 current_room_id = msg.get('room_id', '')
                 full_exe_path = os.path.abspath(os.path.join(game_path, client_exe))
                 try:
-                    cmd_list = ["python", full_exe_path,"--ip", str(msg['ip']), "--port", str(msg['port'])] + client_args.split() if full_exe_path.endswith('.py') else [full_exe_path, "--ip", msg['ip'], "--port", str(msg['port'])] + client_args.split()
+                    game_ip, game_port = msg['ip'], msg['port']
+                    if msg.get('room_token'):
+                        # 多房間模式: 遊戲 Client 改連本機的轉接 Port，由轉接幫它送 room_token
+                        game_ip, game_port = '127.0.0.1', start_relay(msg['ip'], msg['port'], msg['room_token'])
+                    cmd_list = ["python", full_exe_path,"--ip", str(game_ip), "--port", str(game_port)] + client_args.split() if full_exe_path.endswith('.py') else [full_exe_path, "--ip", game_ip, "--port", str(game_port)] + client_args.split()
                     game_process = subprocess.Popen(cmd_list, cwd=os.path.abspath(game_path))
                 except Exception as e:
                     game_process = None
@@ -136,8 +152,7 @@ def room_listener(sock):
                 break
             elif cmd == 'host_changed':
                 print(f"\n>>> [通知] {msg['msg']}")
-                send_json(sock, {"cmd": "get_host"})
-                res = recv_json(sock)
+                res = sock.request({"cmd": "get_host"})
                 if res and res['status'] == 'ok':
                     is_host = res['host']
             elif cmd == 'game_ended':
@@ -146,6 +161,8 @@ def room_listener(sock):
                     game_process = None
                 in_game.clear()
                 print(f"\n>>> [通知] 遊戲結束！")
+                if msg.get('msg'):
+                    print(f">>> [通知] {msg['msg']}")
                 state = "waiting"
             elif cmd == 'player_ready':
                 print(f"\n>>> [通知] 你已經準備，請等待其他人準備和房主開始遊戲")
@@ -206,6 +223,7 @@ def login(sock):
     """
     處理登入流程
     """
+    global session_token
     while True:
         print("\n=== 玩家登入 ===")
         username = input("帳號: ").strip()
@@ -221,6 +239,7 @@ def login(sock):
         
         res = recv_json(sock)
         if res and res['status'] == 'ok':
+            session_token = res.get('session_token')
             print(f"登入成功！{res['msg']}")
             return username
         else:
@@ -230,6 +249,20 @@ def login(sock):
                 return None
 
             
+def fetch_games(sock):
+    """
+    取得商城遊戲列表 (精簡版)，帶上快取的版本號，沒有變動就沿用快取
+    回傳: 遊戲列表，失敗回傳 None
+    """
+    send_json(sock, {"cmd": "list_games", "if_none_match": catalog_cache["version"]})
+    res = recv_json(sock)
+    if not res or res.get('status') != 'ok':
+        return None
+    if not res.get('not_modified'):
+        catalog_cache["version"] = res.get('version')
+        catalog_cache["games"] = res['games']
+    return catalog_cache["games"]
+
 def list_all_games(sock):
     """
     列出商城中的遊戲 (Optional but useful)
@@ -237,10 +270,8 @@ def list_all_games(sock):
     while True:
         while True:
             try:
-                send_json(sock, {"cmd": "list_games"})
-                res = recv_json(sock)
-                if res and res['status'] == 'ok':
-                    games = res['games']
+                games = fetch_games(sock)
+                if games is not None:
                     if not games:
                         print("目前沒有可遊玩的遊戲。")
                         return
@@ -274,7 +305,13 @@ def list_all_games(sock):
 
         if choice.lower() == 'q':
             return
-        selected_game = games[int(choice)-1]
+        # 目錄只有精簡欄位，詳細資訊另外查
+        send_json(sock, {"cmd": "get_game_info", "game_id": games[int(choice)-1]['game_id']})
+        res = recv_json(sock)
+        if not res or res.get('status') != 'ok':
+            print(res.get('msg', '遊戲資訊載入失敗。') if res else '遊戲資訊載入失敗。')
+            continue
+        selected_game = res['game']
         print(f"\n===({selected_game['game_id']}的詳細資訊) ===")
         print("遊戲名稱:", selected_game['game_id'])
         print("作者:", selected_game['uploader'])
@@ -297,21 +334,40 @@ def list_all_games(sock):
             print("評分: 尚未提供評分")
         else:
             print("評分:", selected_game.get('average_rating', 0))
-        if selected_game.get('reviews') == []:
-            print("玩家評論: 尚未有玩家評論")
-        else:
-            #選最新的5則評論顯示
-            print("玩家評論:")
-            reviews = selected_game.get('reviews', [])
-            reviews_sorted = sorted(reviews, key=lambda r: r['time'], reverse=True)
-            latest_five_reviews = reviews_sorted[:5]
-            for review in latest_five_reviews:
-                print(f"  - {review['user']} 評分: {review['score']} 評論: {review['comment']}")
+        show_reviews(sock, selected_game['game_id'])
 
         choice = input("是否返回商城遊戲列表?(若否，則返回商城大廳) (y/n): ")
         if choice.lower() != 'y':
             break
 
+def show_reviews(sock, game_id, page_size=5):
+    """
+    向 Server 分頁取得評論 (由新到舊)，每次顯示 page_size 則
+    """
+    cursor = None
+    first_page = True
+    while True:
+        send_json(sock, {"cmd": "list_reviews", "game_id": game_id, "cursor": cursor, "limit": page_size})
+        res = recv_json(sock)
+        if not res or res.get('status') != 'ok':
+            print("評論載入失敗。")
+            return
+        reviews = res['reviews']
+        if first_page:
+            if not reviews:
+                print("玩家評論: 尚未有玩家評論")
+                return
+            print("玩家評論:")
+            first_page = False
+        for review in reviews:
+            print(f"  - {review['user']} 評分: {review['score']} 評論: {review['comment']}")
+
+        cursor = res.get('next_cursor')
+        if cursor is None:
+            return
+        if input("是否查看更多評論? (y/n): ").lower() != 'y':
+            return
+
 def market_menu(sock):
     """
     玩家商城主選單
@@ -335,13 +391,12 @@ def check_game_update(sock, game_id, mode='download'):
     檢查遊戲更新
     """
     #先判斷是否有此遊戲了
-    find_game_dir = os.path.join(GAMES_ROOT_DIR, game_id)
-    if os.path.exists(find_game_dir):
-        version = os.listdir(find_game_dir)
+    version = installed_version(GAMES_ROOT_DIR, game_id)
+    if version:
         send_json(sock, {
             "cmd": "compare_version",
             "game_id": game_id,
-            "current_version": version[0]  # 假設只有一個版本
+            "current_version": version
         })
 
         res = recv_json(sock)
@@ -392,14 +447,8 @@ def download_game(sock):
     """
     下載遊戲
     """
-    temp_zip = "temp_upload.zip"
-    temp_extract_folder = "temp_extract"
-
-
-    send_json(sock, {"cmd": "list_games"})
-    res = recv_json(sock)
-    if res and res['status'] == 'ok':
-        games = res['games']
+    games = fetch_games(sock)
+    if games is not None:
         print(f"\n=== 商城遊戲列表 ({len(games)}) ===")
         print(f"{'名稱':<20} {'作者':<20} {'版本':<10} {'評分'}")
         print("-" * 60)
@@ -426,110 +475,17 @@ def download_game(sock):
     if not check_game_update(sock, game_id, mode='download'):
         return
 
-    #下載成最新檔案
-    req = {
-        "cmd": "download_game",
-        "game_id": game_id
-    }
+    #下載成最新檔案 (斷線時已收到的部分會留著，下次接著下載)
     while True:
         try:
-            send_json(sock, req)
-
-            res = recv_json(sock)
-            if res and res['status'] == 'ok':
-                file_size = res['file_size']
-                print(f"開始下載遊戲 {game_id}，檔案大小: {file_size} bytes")
-
-                # 1. 告訴 server: "準備好了，請傳檔案"
-                # server 端應該在收到這個訊號後呼叫 send_file
-                send_json(sock, {"status": "ready_to_receive"})
-
-                # 2. 接收檔案 (存到暫存區)
-                saved_path = recv_file(sock, save_dir=".")
-                if not saved_path:
-                    raise Exception("File transfer failed")
-                    
-                # 重新命名以便識別 (recv_file 可能存成 client 傳來的檔名)
-                if os.path.exists(temp_zip):
-                    os.remove(temp_zip)
-                os.rename(saved_path, temp_zip)
-
-                # 3. 解壓縮
-                if os.path.exists(temp_extract_folder):
-                    shutil.rmtree(temp_extract_folder)
-                    
-                with zipfile.ZipFile(temp_zip, 'r') as zf:
-                    zf.extractall(temp_extract_folder)
-
-                # 4. 讀取 Manifest 並驗證
-                manifest_path = os.path.join(temp_extract_folder, "manifest.json")
-                if not os.path.exists(manifest_path):
-                    raise Exception("Manifest not found in zip!")
-
-                with open(manifest_path, 'r', encoding='utf-8') as f:
-                    manifest = json.load(f)
-
-                # 取得關鍵資訊
-                game_id = manifest.get('game_id')
-                version = manifest.get('version')
-                    
-                if not game_id or not version:
-                    raise Exception("Invalid manifest: missing game_id or version")
-
-                # 5. 部署到最終目錄: games/{game_id}/{version}/
-                # 使用 os.path.join 確保跨平台相容
-                if not os.path.exists(GAMES_ROOT_DIR):
-                    os.makedirs(GAMES_ROOT_DIR)
-
-                #檢查是否經有該遊戲資料夾 若有刪掉舊版本 更新成新的版本
-                selected_game_dir = os.path.join(GAMES_ROOT_DIR, game_id)
-                if os.path.exists(selected_game_dir):
-                    shutil.rmtree(selected_game_dir)
-
-                final_dir = os.path.join(GAMES_ROOT_DIR, game_id, version)
-
-                    
-                # 移動資料夾
-                # 注意: shutil.move 的目標上層目錄必須存在
-                os.makedirs(os.path.dirname(final_dir), exist_ok=True)
-                shutil.move(temp_extract_folder, final_dir)
-
-                print(f"已成功下載進我的遊戲庫了！")
-
-
-                # 6. 回傳成功訊息
-                send_json(sock, {
-                    "status": "ok", 
-                    "msg": f"Game '{game_id}' (v{version}) uploaded successfully!"
-                })
-                break
-            else:
-                print(f"下載失敗: {res.get('msg', 'Unknown error')}")
-                choice = input("是否重試? (y/n): ")
-                if choice.lower() != 'y':
-                    return
-                else:
-                    continue
-        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError, OSError):
-            raise
-        except Exception as e:
-            error_msg = str(e)
-            print(f"下載失敗: {error_msg}")
-            send_json(sock, {"status": "error", "msg": error_msg})
+            install_latest(sock, game_id, GAMES_ROOT_DIR)
+            mark_game_used(game_id)
+            break
+        except DownloadError as e:
+            print(f"下載失敗: {e}")
             choice = input("是否重試? (y/n): ")
             if choice.lower() != 'y':
                 return
-            else:
-                continue
-                
-        finally:
-            # 8. 清理垃圾 (無論成功失敗都要做)
-            if os.path.exists(temp_zip):
-                os.remove(temp_zip)
-            if os.path.exists(temp_extract_folder):
-                shutil.rmtree(temp_extract_folder)
-            
-        
 
 def create_room_flow(sock):
     """
@@ -538,10 +494,8 @@ def create_room_flow(sock):
     global stop_room_listener
     stop_room_listener = False
 
-    send_json(sock, {"cmd": "list_games"})
-    res = recv_json(sock)
-    if res and res['status'] == 'ok':
-        games = res['games']
+    games = fetch_games(sock)
+    if games is not None:
         print(f"\n=== 商城遊戲列表 ({len(games)}) ===")
         print(f"{'名稱':<20} {'作者':<20} {'版本':<10} {'評分'}")
         print("-" * 60)
@@ -567,101 +521,15 @@ def create_room_flow(sock):
 
     flag, status = check_game_update(sock, game_id, mode='play')
 
-    temp_zip = "temp_upload.zip"
-    temp_extract_folder = "temp_extract"
-
     if not flag:
         return
     if flag and status == 'download':
         #下載成最新檔案
-        req = {
-            "cmd": "download_game",
-            "game_id": game_id
-        }
-        send_json(sock, req)
-
-        res = recv_json(sock)
-        if res and res['status'] == 'ok':
-            file_size = res['file_size']
-            print(f"開始下載遊戲 {game_id}，檔案大小: {file_size} bytes")
-
-            try:
-                # 1. 告訴 server: "準備好了，請傳檔案"
-                # server 端應該在收到這個訊號後呼叫 send_file
-                send_json(sock, {"status": "ready_to_receive"})
-
-                # 2. 接收檔案 (存到暫存區)
-                saved_path = recv_file(sock, save_dir=".")
-                if not saved_path:
-                    raise Exception("File transfer failed")
-                    
-                # 重新命名以便識別 (recv_file 可能存成 client 傳來的檔名)
-                if os.path.exists(temp_zip):
-                    os.remove(temp_zip)
-                os.rename(saved_path, temp_zip)
-
-                # 3. 解壓縮
-                if os.path.exists(temp_extract_folder):
-                    shutil.rmtree(temp_extract_folder)
-                    
-                with zipfile.ZipFile(temp_zip, 'r') as zf:
-                    zf.extractall(temp_extract_folder)
-
-                # 4. 讀取 Manifest 並驗證
-                manifest_path = os.path.join(temp_extract_folder, "manifest.json")
-                if not os.path.exists(manifest_path):
-                    raise Exception("Manifest not found in zip!")
-
-                with open(manifest_path, 'r', encoding='utf-8') as f:
-                    manifest = json.load(f)
-
-                # 取得關鍵資訊
-                game_id = manifest.get('game_id')
-                version = manifest.get('version')
-                    
-                if not game_id or not version:
-                    raise Exception("Invalid manifest: missing game_id or version")
-
-                # 5. 部署到最終目錄: games/{game_id}/{version}/
-                # 使用 os.path.join 確保跨平台相容
-                if not os.path.exists(GAMES_ROOT_DIR):
-                    os.makedirs(GAMES_ROOT_DIR)
-
-                #檢查是否經有該遊戲資料夾 若有刪掉舊版本 更新成新的版本
-                selected_game_dir = os.path.join(GAMES_ROOT_DIR, game_id)
-                if os.path.exists(selected_game_dir):
-                    shutil.rmtree(selected_game_dir)
-
-                final_dir = os.path.join(GAMES_ROOT_DIR, game_id, version)
-
-                    
-                # 移動資料夾
-                # 注意: shutil.move 的目標上層目錄必須存在
-                os.makedirs(os.path.dirname(final_dir), exist_ok=True)
-                shutil.move(temp_extract_folder, final_dir)
-
-                print(f"已成功下載進我的遊戲庫了！")
-
-
-                # 6. 回傳成功訊息
-                send_json(sock, {
-                    "status": "ok", 
-                    "msg": f"Game '{game_id}' (v{version}) uploaded successfully!"
-                })
-
-            except Exception as e:
-                error_msg = str(e)
-                print(f"下載失敗: {error_msg}")
-                send_json(sock, {"status": "error", "msg": error_msg})
-                return
-            finally:
-                # 8. 清理垃圾 (無論成功失敗都要做)
-                if os.path.exists(temp_zip):
-                    os.remove(temp_zip)
-                if os.path.exists(temp_extract_folder):
-                    shutil.rmtree(temp_extract_folder) 
-        else:
-            print(f"下載失敗: {res.get('msg', 'Unknown error')}")
+        try:
+            install_latest(sock, game_id, GAMES_ROOT_DIR)
+            mark_game_used(game_id)
+        except DownloadError as e:
+            print(f"下載失敗: {e}")
             return
     
     #確認已經有了最新版本
@@ -710,8 +578,7 @@ def create_room_flow(sock):
                 send_json(sock, {"cmd": "start_game", "room_id": room_id})
                 print(">>> 請求已發送...")
                 # 進入等待遊戲結束的狀態
-                while not in_game.is_set():
-                    time.sleep(1)
+                in_game.wait()
 
             elif choice == '2':
                 print(">>> 正在離開房間...")
@@ -729,11 +596,10 @@ def create_room_flow(sock):
     except KeyboardInterrupt:
         send_json(sock, {"cmd": "leave_room", "room_id": room_id})
         stop_room_listener = True
+        sock.wake()
         t.join()
         sys.exit(0)
     
-    # 恢復 socket 為阻塞模式 (給大廳用)
-    sock.settimeout(None) 
     print("已返回大廳選單。")
 
 def join_room_flow(sock):
@@ -743,10 +609,8 @@ def join_room_flow(sock):
     global stop_room_listener
     stop_room_listener = False
 
-    send_json(sock, {"cmd": "list_games"})
-    res = recv_json(sock)
-    if res and res['status'] == 'ok':
-        games = res['games']
+    games = fetch_games(sock)
+    if games is not None:
         print(f"\n=== 商城遊戲列表 ({len(games)}) ===")
         print(f"{'名稱':<20} {'作者':<20} {'版本':<10} {'評分'}")
         print("-" * 60)
@@ -772,101 +636,15 @@ def join_room_flow(sock):
 
     flag, status = check_game_update(sock, game_id, mode='play')
 
-    temp_zip = "temp_upload.zip"
-    temp_extract_folder = "temp_extract"
-
     if not flag:
         return
     if flag and status == 'download':
         #下載成最新檔案
-        req = {
-            "cmd": "download_game",
-            "game_id": game_id
-        }
-        send_json(sock, req)
-
-        res = recv_json(sock)
-        if res and res['status'] == 'ok':
-            file_size = res['file_size']
-            print(f"開始下載遊戲 {game_id}，檔案大小: {file_size} bytes")
-
-            try:
-                # 1. 告訴 server: "準備好了，請傳檔案"
-                # server 端應該在收到這個訊號後呼叫 send_file
-                send_json(sock, {"status": "ready_to_receive"})
-
-                # 2. 接收檔案 (存到暫存區)
-                saved_path = recv_file(sock, save_dir=".")
-                if not saved_path:
-                    raise Exception("File transfer failed")
-                    
-                # 重新命名以便識別 (recv_file 可能存成 client 傳來的檔名)
-                if os.path.exists(temp_zip):
-                    os.remove(temp_zip)
-                os.rename(saved_path, temp_zip)
-
-                # 3. 解壓縮
-                if os.path.exists(temp_extract_folder):
-                    shutil.rmtree(temp_extract_folder)
-                    
-                with zipfile.ZipFile(temp_zip, 'r') as zf:
-                    zf.extractall(temp_extract_folder)
-
-                # 4. 讀取 Manifest 並驗證
-                manifest_path = os.path.join(temp_extract_folder, "manifest.json")
-                if not os.path.exists(manifest_path):
-                    raise Exception("Manifest not found in zip!")
-
-                with open(manifest_path, 'r', encoding='utf-8') as f:
-                    manifest = json.load(f)
-
-                # 取得關鍵資訊
-                game_id = manifest.get('game_id')
-                version = manifest.get('version')
-                    
-                if not game_id or not version:
-                    raise Exception("Invalid manifest: missing game_id or version")
-
-                # 5. 部署到最終目錄: games/{game_id}/{version}/
-                # 使用 os.path.join 確保跨平台相容
-                if not os.path.exists(GAMES_ROOT_DIR):
-                    os.makedirs(GAMES_ROOT_DIR)
-
-                #檢查是否經有該遊戲資料夾 若有刪掉舊版本 更新成新的版本
-                selected_game_dir = os.path.join(GAMES_ROOT_DIR, game_id)
-                if os.path.exists(selected_game_dir):
-                    shutil.rmtree(selected_game_dir)
-
-                final_dir = os.path.join(GAMES_ROOT_DIR, game_id, version)
-
-                    
-                # 移動資料夾
-                # 注意: shutil.move 的目標上層目錄必須存在
-                os.makedirs(os.path.dirname(final_dir), exist_ok=True)
-                shutil.move(temp_extract_folder, final_dir)
-
-                print(f"已成功下載進我的遊戲庫了！")
-
-
-                # 6. 回傳成功訊息
-                send_json(sock, {
-                    "status": "ok", 
-                    "msg": f"Game '{game_id}' (v{version}) uploaded successfully!"
-                })
-
-            except Exception as e:
-                error_msg = str(e)
-                print(f"下載失敗: {error_msg}")
-                send_json(sock, {"status": "error", "msg": error_msg})
-                return
-            finally:
-                # 8. 清理垃圾 (無論成功失敗都要做)
-                if os.path.exists(temp_zip):
-                    os.remove(temp_zip)
-                if os.path.exists(temp_extract_folder):
-                    shutil.rmtree(temp_extract_folder) 
-        else:
-            print(f"下載失敗: {res.get('msg', 'Unknown error')}")
+        try:
+            install_latest(sock, game_id, GAMES_ROOT_DIR)
+            mark_game_used(game_id)
+        except DownloadError as e:
+            print(f"下載失敗: {e}")
             return
     
     #確認已經有了最新版本 顯示可以加入的房間列表
@@ -933,8 +711,7 @@ def join_room_flow(sock):
                 # 結果會由 room_listener 印出來
                 send_json(sock, {"cmd": "start_game", "room_id": room_id})
                 print(">>> 請求已發送...")
-                while not in_game.is_set():
-                    time.sleep(0.5)
+                in_game.wait()
 
             elif choice == '2':
                 print(">>> 正在離開房間...")
@@ -951,11 +728,10 @@ def join_room_flow(sock):
     except KeyboardInterrupt:
         send_json(sock, {"cmd": "leave_room", "room_id": room_id})
         stop_room_listener = True
+        sock.wake()
         t.join()
         sys.exit(0)
     
-    # 恢復 socket 為阻塞模式 (給大廳用)
-    sock.settimeout(None) 
     print("已返回大廳選單。")
 
 def review_game(sock):
@@ -1054,9 +830,11 @@ def main():
     parser.add_argument('--user', type=str, default='Player1', help="模擬的使用者名稱 (決定下載路徑)")
     # parser.add_argument('--ip', type=str, default='127.0.0.1')
     # parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--prefetch-budget-mb', type=int, default=2048,
+                        help="背景預先下載遊戲可以用的空間 (MB)，0 表示不預先下載")
     args = parser.parse_args()
 
-    global GAMES_ROOT_DIR
+    global GAMES_ROOT_DIR, prefetcher
     GAMES_ROOT_DIR = os.path.join("games", args.user)
     if not os.path.exists(GAMES_ROOT_DIR):
         os.makedirs(GAMES_ROOT_DIR)
@@ -1065,9 +843,8 @@ def main():
 
     sock = None
     try:
-        # 1. 建立連線
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((SERVER_IP, LOBBY_PORT))
+        # 1. 建立連線 (房間模式的監聽執行緒需要 LobbyConnection，大廳選單把它當一般 socket 用)
+        sock = LobbyConnection(socket.create_connection((SERVER_IP, LOBBY_PORT)))
         print(f"[System] 已連線至 Player Server ({SERVER_IP}:{LOBBY_PORT})")
 
         # 2. 先登入才能進主選單
@@ -1096,6 +873,12 @@ def main():
             sock.close()
             return
 
+        # 背景更新玩過的 / 熱門的遊戲，建房間時就不用等下載
+        if args.prefetch_budget_mb > 0 and session_token:
+            prefetcher = Prefetcher((SERVER_IP, LOBBY_PORT), session_token, GAMES_ROOT_DIR,
+                                    args.prefetch_budget_mb * 1024 * 1024, is_busy=game_running)
+            prefetcher.start()
+
         # 3. 主選單迴圈
         options = [
             "進入商城 (Enter Marketplace)",
@@ -1129,6 +912,8 @@ def main():
     except Exception as e:
         print(f"\n[Error] 發生未預期的錯誤: {e}\n程式即將關閉。")
     finally:
+        if prefetcher:
+            prefetcher.stop()
         if sock:
             try:
                 sock.close()
@@ -0,0 +1,188 @@
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+from collections import Counter
+
+from utils import send_json, recv_json
+from game_installer import install_latest, install_lock, installed_version, quiet, DownloadError
+
+# 背景預先下載: 趁玩家在逛選單的時候，把「玩過的遊戲」和「現在房間最多的遊戲」先更新到最新版
+# 這樣建立 / 加入房間時大多已經是最新版，不用當場等下載
+# 用另一條連線 (attach_session 接上主連線的帳號)，不會跟主選單搶同一個 socket
+# 每一輪才連線、做完就關掉，不會一直佔著 Server 的連線名額
+# 總大小超過上限時，先刪最久沒用到的遊戲 (最近使用時間記在 {games_root}/_lru.json，建房 / 加入 / 下載都算使用)
+
+PREFETCH_INTERVAL = 60 # 秒
+POPULAR_LIMIT = 3 # 房間列表裡人數最多的前幾個遊戲
+LRU_FILE = "_lru.json"
+
+
+def _dir_size(path):
+    total = 0
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class Prefetcher:
+    def __init__(self, server_addr, session_token, games_root, budget_bytes, is_busy=None):
+        """
+        budget_bytes: games_root 底下遊戲總大小的上限
+        is_busy: 回傳 True 時不下載也不刪檔 (例如遊戲正在執行)
+        """
+        self.server_addr = server_addr
+        self.session_token = session_token
+        self.games_root = games_root
+        self.budget_bytes = budget_bytes
+        self.is_busy = is_busy or (lambda: False)
+        self._lru_path = os.path.join(games_root, LRU_FILE)
+        self._lru_lock = threading.Lock()
+        self._lru = self._load_lru()
+        # 因為空間不夠被刪掉的 (game_id, version)，同一個版本不再預先下載
+        self._no_room = set()
+        self._stop = threading.Event()
+        self._sock = None
+        self._thread = None
+
+    # --- 最近使用時間 ---
+
+    def _load_lru(self):
+        try:
+            with open(self._lru_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _save_lru(self):
+        tmp_path = self._lru_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._lru, f)
+        os.replace(tmp_path, self._lru_path)
+
+    def touch(self, game_id):
+        """玩家用到某個遊戲 (下載、開始遊玩) 時呼叫"""
+        with self._lru_lock:
+            self._lru[game_id] = time.time()
+            self._save_lru()
+
+    # --- 背景執行緒 ---
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sock:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+
+    def _request(self, req):
+        send_json(self._sock, req)
+        res = recv_json(self._sock)
+        if res is None:
+            raise ConnectionResetError("Connection lost")
+        return res
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if not self._prefetch_round():
+                    return # Server 不支援或登入已經失效，少了預先下載也能正常玩
+            except (OSError, ValueError):
+                pass # 背景功能，連線斷了就等下一輪，不打擾玩家
+            self._stop.wait(PREFETCH_INTERVAL)
+
+    def _prefetch_round(self):
+        """連線、做一輪預先下載後關閉連線；回傳 False 表示之後不用再試了"""
+        try:
+            self._sock = socket.create_connection(self.server_addr)
+            res = self._request({"cmd": "attach_session", "session_token": self.session_token})
+            if res.get('status') != 'ok':
+                return res.get('code') == 'server_busy' # 太忙就下一輪再試
+            self._prefetch_once()
+            return True
+        finally:
+            if self._sock:
+                self._sock.close()
+                self._sock = None
+
+    def _installed(self):
+        """{game_id: 已安裝的版本}"""
+        installed = {}
+        if not os.path.isdir(self.games_root):
+            return installed
+        for game_id in os.listdir(self.games_root):
+            version = installed_version(self.games_root, game_id)
+            if version:
+                installed[game_id] = version
+        return installed
+
+    def _candidates(self):
+        """要預先下載的遊戲，重要的在前面: 玩過的 (最近用過的優先)，再來是熱門房間的遊戲"""
+        played = self._request({"cmd": "played_game_list"}).get('played_games', [])
+        rooms = self._request({"cmd": "list_rooms"}).get('rooms', [])
+        with self._lru_lock:
+            played_ids = sorted((g['game_id'] for g in played), key=lambda gid: -self._lru.get(gid, 0))
+        popular = Counter()
+        for room in rooms:
+            popular[room['game_id']] += room['cur_players']
+        ordered = played_ids + [gid for gid, _ in popular.most_common(POPULAR_LIMIT)]
+        return list(dict.fromkeys(ordered)) # 去掉重複，保留順序
+
+    def _prefetch_once(self):
+        res = self._request({"cmd": "list_games"})
+        latest = {g['game_id']: g['version'] for g in res.get('games', []) if g.get('status') != 'unavailable'}
+        candidates = [gid for gid in self._candidates() if gid in latest]
+        for game_id in candidates:
+            if self._stop.is_set() or self.is_busy():
+                return
+            installed = self._installed()
+            if installed.get(game_id) == latest[game_id] or (game_id, latest[game_id]) in self._no_room:
+                continue
+            # 已經滿了就只更新裝好的遊戲，不再裝新的
+            if game_id not in installed and self._usage() >= self.budget_bytes:
+                continue
+            try:
+                with quiet():
+                    install_latest(self._sock, game_id, self.games_root)
+            except DownloadError:
+                continue
+            with self._lru_lock:
+                # 只是預先下載、還沒真的用過的遊戲，空間不夠時最先被刪
+                self._lru.setdefault(game_id, 0)
+                self._save_lru()
+        self._evict(latest)
+
+    def _usage(self):
+        return sum(_dir_size(os.path.join(self.games_root, gid)) for gid in self._installed())
+
+    def _evict(self, latest):
+        """超過上限時，從最久沒用到的遊戲開始刪"""
+        if self.is_busy():
+            return
+        with install_lock:
+            installed = self._installed()
+            sizes = {gid: _dir_size(os.path.join(self.games_root, gid)) for gid in installed}
+            usage = sum(sizes.values())
+            with self._lru_lock:
+                order = sorted(installed, key=lambda gid: self._lru.get(gid, 0))
+            for game_id in order:
+                if usage <= self.budget_bytes:
+                    break
+                shutil.rmtree(os.path.join(self.games_root, game_id))
+                usage -= sizes[game_id]
+                # 記下來，下一輪不會又把它載回來 (再擠掉別的遊戲)
+                self._no_room.add((game_id, latest.get(game_id)))
+                with self._lru_lock:
+                    self._lru.pop(game_id, None)
+                    self._save_lru()
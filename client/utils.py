@@ -1,23 +1,18 @@
 import json
+import time
 import os
-import struct
 import math
+from framing import send_frame, recv_frame, recv_exact, FrameTooLargeError
+from framing import recv_file_body, format_rate
 def send_json(sock, data_dict):
     """
     將 Python Dict 轉為 JSON -> 加上長度 Header -> 發送
     """
     # 1. 序列化: Dict -> JSON String -> Bytes
-    json_str = json.dumps(data_dict)
-    msg_bytes = json_str.encode('utf-8')
-    
-    # 2. 計算長度: 取得 bytes 的長度
-    msg_len = len(msg_bytes)
-    
-    # 3. 打包 Header: '!I' 代表 Network byte order (Big-endian), Unsigned Int (4 bytes)
-    header = struct.pack('!I', msg_len)
-    
-    # 4. 發送: Header + Body
-    sock.sendall(header + msg_bytes)
+    msg_bytes = json.dumps(data_dict).encode('utf-8')
+
+    # 2. 發送: Header + Body (封包格式見 framing.py)
+    send_frame(sock, msg_bytes)
 
 
 def recv_json(sock):
@@ -25,24 +20,18 @@ def recv_json(sock):
     接收 4 bytes Header -> 讀取對應長度 Body -> 解析 JSON 回傳 Dict
     若連線中斷則回傳 None
     """
-    # 1. 先讀取 4 bytes (Header)
-    header = recvall(sock, 4)
-    if not header:
-        return None # 連線已關閉
-        
-    # 2. 解包 Header 取得內容長度
-    msg_len = struct.unpack('!I', header)[0]
-    
-    # 3. 根據長度讀取完整的 Body
-    body_bytes = recvall(sock, msg_len)
-    if not body_bytes:
-        return None # 讀取 Body 途中發生錯誤或斷線
-        
-    # 4. 反序列化: Bytes -> JSON String -> Dict
     try:
-        json_str = body_bytes.decode('utf-8')
-        return json.loads(json_str)
-    except json.JSONDecodeError:
+        body_bytes = recv_frame(sock)
+    except FrameTooLargeError as e:
+        print(f"[Error] {e}")
+        return None
+    if body_bytes is None:
+        return None # 連線已關閉或讀取途中斷線
+
+    # 反序列化: Bytes -> JSON String -> Dict
+    try:
+        return json.loads(body_bytes.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError):
         print("[Error] Received invalid JSON")
         return None
 
@@ -51,16 +40,7 @@ def recvall(sock, n):
     輔助函式: 確保一定讀滿 n 個 bytes 才會 return
     解決 TCP 斷包問題 (例如一次只收到半個 JSON 的情況)
     """
-    data = b''
-    while len(data) < n:
-        try:
-            packet = sock.recv(n - len(data))
-            if not packet:
-                return None # 對方關閉了連線
-            data += packet
-        except ConnectionResetError:
-            return None
-    return data
+    return recv_exact(sock, n)
 
 def recv_file(sock, save_dir):
     """
@@ -82,23 +62,17 @@ def recv_file(sock, save_dir):
 
     print(f"[Download] Receiving {filename} ({filesize} bytes)...")
 
-    # 2. 接收檔案內容
-    received_size = 0
+    # 2. 接收檔案內容 (直接收進大緩衝區再寫檔)
+    start = time.perf_counter()
     with open(save_path, 'wb') as f:
-        while received_size < filesize:
-            # 計算還剩多少沒收
-            remaining = filesize - received_size
-            # 這次最多收 4096 或 剩下的量
-            chunk_size = 4096 if remaining > 4096 else remaining
-            
-            chunk = sock.recv(chunk_size)
-            if not chunk:
-                break # 斷線保護
-            
-            f.write(chunk)
-            received_size += len(chunk)
+        received_size = recv_file_body(sock, f, filesize)
+    elapsed = time.perf_counter() - start
+
+    if received_size < filesize:
+        print(f"[Error] Connection lost after {received_size}/{filesize} bytes")
+        return None
 
-    print(f"[Download] Saved to {save_path}")
+    print(f"[Download] Saved to {save_path} ({elapsed:.2f}s, {format_rate(filesize, elapsed)})")
     return save_path
 
 def paged_cli_menu(options, page_size=3):
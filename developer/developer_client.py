@@ -7,7 +7,7 @@ import json
 
 # 假設 network.py 放在同層級的 utils 資料夾
 # 如果放在同層，直接 from network import ...
-from utils import send_json, recv_json, send_file, zip_game_folder,paged_dev_menu
+from utils import send_json, recv_json, prepare_game_folder, send_game_folder, local_file_hashes, paged_dev_menu
 from config import DEV_PORT
 from template.create_game_template import create_game_template
 
@@ -114,16 +114,16 @@ def upload_game_workflow(sock, username):
         return
 
     game_folder_path = os.path.join(games_path, selected_game)
-    # 1. 本地檢查與壓縮
-    zip_path = zip_game_folder(game_folder_path, username=username, update=False)
-    if not zip_path:
+    # 1. 本地檢查 (設定 manifest.json)
+    manifest = prepare_game_folder(game_folder_path, username=username, update=False)
+    if manifest is None:
         return # 檢查失敗，中止
 
     while True:
         try:
             # 2. 發送上傳請求
             print("[Upload] 正在請求上傳...")
-            send_json(sock, {"cmd": "upload_game"})
+            send_json(sock, {"cmd": "upload_game_stream", "manifest": manifest})
 
             # 3. 等待 Server 說 "Ready" (Handshake)
             # 這對應我們在 dev_service 寫的邏輯
@@ -136,9 +136,9 @@ def upload_game_workflow(sock, username):
                 else:
                     continue
 
-            # 4. 開始傳檔
+            # 4. 開始傳檔 (不壓縮，一個一個檔案直接送，Server 邊收邊寫)
             print("[Upload] 開始傳輸檔案...")
-            send_file(sock, zip_path)
+            send_game_folder(sock, game_folder_path)
 
             # 5. 等待最終確認
             final_res = recv_json(sock)
@@ -163,10 +163,28 @@ def upload_game_workflow(sock, username):
                 return
             else:
                 continue
-        finally:
-            # 清除暫存檔
-            if os.path.exists(zip_path):
-                os.remove(zip_path)
+
+def build_update_request(sock, manifest, game_folder_path):
+    """
+    先問 Server 目前版本每個檔案的雜湊，只上傳新增 / 改過的檔案
+    回傳 (上傳指令, 要送的檔案)；Server 沒有檔案清單時改成完整上傳 (要送的檔案 = None 代表全部)
+    """
+    send_json(sock, {"cmd": "get_file_manifest", "game_id": manifest['game_id']})
+    res = recv_json(sock)
+    if not res or res.get('status') != 'ok':
+        print(f"[Upload] 無法差異上傳 ({res.get('msg') if res else 'no response'})，改為上傳完整遊戲")
+        return {"cmd": "upload_game_stream", "manifest": manifest}, None
+
+    remote = res['files']
+    local = local_file_hashes(game_folder_path)
+    keep = {rel: digest for rel, digest in local.items()
+            if rel != 'manifest.json' and rel in remote and remote[rel]['sha256'] == digest}
+    # manifest.json 每次都要送 (版本號一定不同)
+    changed = {rel for rel in local if rel not in keep}
+    removed = len([rel for rel in remote if rel not in local])
+    print(f"[Upload] 差異上傳: {len(changed)} 個檔案要上傳，{len(keep)} 個沿用 v{res['version']}，{removed} 個刪除")
+    req = {"cmd": "upload_game_delta", "manifest": manifest, "base_version": res['version'], "keep": keep}
+    return req, changed
 
 def update_game_workflow(sock, username):
     """
@@ -242,16 +260,17 @@ def update_game_workflow(sock, username):
 
     game_folder_path = os.path.join(games_path, selected_game)
 
-    # 1. 本地檢查與壓縮
-    zip_path = zip_game_folder(game_folder_path, username=username, update=True)
-    if not zip_path:
+    # 1. 本地檢查 (設定 manifest.json)
+    manifest = prepare_game_folder(game_folder_path, username=username, update=True)
+    if manifest is None:
         return # 檢查失敗，中止
     
     while True:
         try:
-            # 2. 發送上傳請求
+            # 2. 發送上傳請求 (只傳跟目前版本不一樣的檔案)
             print("[Upload] 正在請求上傳...")
-            send_json(sock, {"cmd": "upload_game"})
+            req, changed = build_update_request(sock, manifest, game_folder_path)
+            send_json(sock, req)
 
             # 3. 等待 Server 說 "Ready" (Handshake)
             # 這對應我們在 dev_service 寫的邏輯
@@ -264,9 +283,9 @@ def update_game_workflow(sock, username):
                 else:
                     continue
 
-            # 4. 開始傳檔
+            # 4. 開始傳檔 (不壓縮，一個一個檔案直接送，Server 邊收邊寫)
             print("[Upload] 開始傳輸檔案...")
-            send_file(sock, zip_path)
+            send_game_folder(sock, game_folder_path, only=changed)
 
             # 5. 等待最終確認
             final_res = recv_json(sock)
@@ -291,10 +310,6 @@ def update_game_workflow(sock, username):
                 return
             else:
                 continue
-        finally:
-            # 清除暫存檔
-            if os.path.exists(zip_path):
-                os.remove(zip_path)
             
 def list_my_games(sock):
     """
@@ -0,0 +1,146 @@
+import os
+import struct
+
+# 長度前綴的封包格式: 4 bytes Big-endian 長度 + 內容
+# server / client / developer 各放一份相同的檔案 (三邊是分開部署的)
+
+HEADER = struct.Struct('!I')
+
+# 單一封包的大小上限，超過視為對方亂傳或資料壞掉，直接斷線，避免一次配置好幾 GB 的記憶體
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# 小封包直接把 header 接在內容前面一次送出 (複製成本可忽略，還能少一次 system call)
+SMALL_FRAME_SIZE = 64 * 1024
+
+
+class FrameTooLargeError(ValueError):
+    pass
+
+
+def recv_exact(sock, n):
+    """
+    確保一定讀滿 n 個 bytes 才會 return，對方關閉連線則回傳 None
+    收不完的時候先配置好整塊 bytearray，再用 recv_into 直接寫進去，不會重複複製已收到的資料
+    """
+    buf = None
+    received = 0
+    if n <= SMALL_FRAME_SIZE:
+        # 小封包大多一次 recv 就收完，直接回傳，不必另外配置緩衝區
+        try:
+            first = sock.recv(n)
+        except ConnectionResetError:
+            return None
+        if len(first) == n:
+            return first
+        if not first:
+            return None # 對方關閉了連線
+        buf = bytearray(n)
+        buf[:len(first)] = first
+        received = len(first)
+
+    if buf is None:
+        buf = bytearray(n)
+    view = memoryview(buf)
+    while received < n:
+        try:
+            count = sock.recv_into(view[received:], n - received)
+        except ConnectionResetError:
+            return None
+        if count == 0:
+            return None # 對方關閉了連線
+        received += count
+    return buf
+
+
+def recv_frame(sock, max_size=MAX_FRAME_SIZE):
+    """讀一個封包的內容 (bytearray)，斷線回傳 None，超過上限丟出 FrameTooLargeError"""
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    length = HEADER.unpack(header)[0]
+    if length > max_size:
+        raise FrameTooLargeError(f"Frame of {length} bytes exceeds limit of {max_size} bytes")
+    return recv_exact(sock, length)
+
+
+def _sendmsg_all(sock, buffers):
+    # sendmsg 不保證一次送完，沒送完的部分從中斷的位置繼續
+    views = [memoryview(b).cast('B') for b in buffers]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views and sent:
+            views[0] = views[0][sent:]
+
+
+def send_frame(sock, payload, max_size=MAX_FRAME_SIZE):
+    """送出一個封包；大封包用 scatter-gather 一起送出 header 與內容，不必先接成一整塊"""
+    if len(payload) > max_size:
+        raise FrameTooLargeError(f"Frame of {len(payload)} bytes exceeds limit of {max_size} bytes")
+    header = HEADER.pack(len(payload))
+    if len(payload) <= SMALL_FRAME_SIZE:
+        sock.sendall(header + payload)
+    elif hasattr(sock, 'sendmsg'):
+        _sendmsg_all(sock, [header, payload])
+    else:
+        # Windows 沒有 sendmsg，分兩次送 (內容很大，多一次 system call 無所謂)
+        sock.sendall(header)
+        sock.sendall(payload)
+
+
+# --- 檔案內容 (send_file / recv_file 在 JSON header 之後傳的原始 bytes) ---
+
+# 沒辦法用 sendfile 時，一次讀寫的大小
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+
+
+def send_file_body(sock, f, count):
+    """
+    把檔案 f (從目前位置開始) 的 count bytes 送出去
+    有 os.sendfile 的平台 (Linux) 交給 kernel 直接從檔案送到 socket，資料不經過 Python
+    其他情況 (Windows、asyncio 的連線) 用大塊緩衝區讀寫
+    """
+    if count == 0:
+        return
+    if hasattr(os, 'sendfile') and hasattr(sock, 'sendfile'):
+        sock.sendfile(f, f.tell(), count)
+        return
+    buf = bytearray(min(TRANSFER_CHUNK_SIZE, count))
+    view = memoryview(buf)
+    remaining = count
+    while remaining > 0:
+        n = f.readinto(view[:min(len(buf), remaining)])
+        if not n:
+            raise EOFError("File is shorter than expected")
+        sock.sendall(view[:n])
+        remaining -= n
+
+
+def recv_file_body(sock, f, count, hasher=None):
+    """
+    收 count bytes 寫進檔案 f，回傳實際收到的 bytes 數 (對方斷線時會少於 count)
+    用 recv_into 直接收進重複使用的大緩衝區，不會每次配置新的 bytes
+    有給 hasher (例如 hashlib.sha256()) 就順便邊收邊算雜湊，不必事後再讀一次檔案
+    """
+    buf = bytearray(min(TRANSFER_CHUNK_SIZE, max(count, 1)))
+    view = memoryview(buf)
+    received = 0
+    while received < count:
+        try:
+            n = sock.recv_into(view, min(len(buf), count - received))
+        except ConnectionResetError:
+            break
+        if n == 0:
+            break # 斷線保護
+        f.write(view[:n])
+        if hasher is not None:
+            hasher.update(view[:n])
+        received += n
+    return received
+
+
+def format_rate(nbytes, seconds):
+    """傳輸速度的顯示字串，例如 '12.3 MB/s'"""
+    return f"{nbytes / max(seconds, 1e-6) / (1024 * 1024):.1f} MB/s"
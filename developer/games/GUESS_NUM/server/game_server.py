@@ -4,6 +4,10 @@ import json
 import argparse
 import random
 import time
+from lobby_control import LobbyControl
+
+# 跟平台 Lobby 的控制通道 (單房間模式才會接上，見 lobby_control.py)
+control = LobbyControl()
 
 # ... (send_json, recv_json 函式保持不變) ...
 def send_json(sock, data):
@@ -16,82 +20,141 @@ def recv_json(sock):
         if not header: return None
         length = int.from_bytes(header, byteorder='big')
         body = sock.recv(length)
+        control.touch()
         return json.loads(body.decode('utf-8'))
     except:
         return None
 
-target_number = 0
-players = []     # 儲存連線 [(conn, addr, pid), ...]
-game_over = False
-lock = threading.Lock()
+class Match:
+    """一場比賽的狀態 (多房間模式下同一個 process 會同時有很多場)"""
+    def __init__(self, total):
+        self.total = total
+        self.target_number = random.randint(1, 100)
+        self.players = []     # 儲存連線 [(conn, addr, pid), ...]
+        self.game_over = False
+        self.lock = threading.Lock()
+        self.results = "Draw"
+        self.winner = None
+        self.moves = 0
+
+        # === 新增：記錄現在輪到誰 (儲存的是 players 列表的 index) ===
+        self.current_turn_index = 0
+
+    def broadcast(self, data):
+        for p in self.players:
+            try:
+                send_json(p[0], data)
+            except: pass
+
+    def add_player(self, conn, addr):
+        pid = len(self.players) + 1
+        # 將 pid 也存入 tuple: (conn, addr, pid)
+        self.players.append((conn, addr, pid))
 
-# === 新增：記錄現在輪到誰 (儲存的是 players 列表的 index) ===
-current_turn_index = 0 
+        send_json(conn, {"cmd": "init", "player_id": pid})
+        print(f"Player {pid} joined.")
+
+        self.broadcast({
+            "cmd": "waiting_status",
+            "current": len(self.players),
+            "total": self.total
+        })
 
-def broadcast(data):
-    for p in players:
+    def handle_client(self, conn, pid):
+        players = self.players
         try:
-            send_json(p[0], data)
-        except: pass
+            while not self.game_over:
+                msg = recv_json(conn)
+                if not msg: break
 
-def handle_client(conn, pid):
-    global game_over, current_turn_index
-    global results
-    try:
-        while not game_over:
-            msg = recv_json(conn)
-            if not msg: break
-            
-            if msg['cmd'] == 'guess':
-                # === 關鍵修改 1：檢查是否輪到這個人 ===
-                # 我們用 players[current_turn_index] 來判斷現在是誰的回合
-                # pid 是從 1 開始，列表 index 是從 0 開始，所以要對應一下
-                
-                expected_pid = players[current_turn_index][2]
-                
-                if pid != expected_pid:
-                    # 如果不是他的回合，傳送錯誤訊息 (或是直接忽略)
-                    send_json(conn, {"cmd": "error", "msg": "還沒輪到你！"})
-                    continue
-
-                guess = int(msg['number'])
-                result = ""
-                winner = None
-                
-                with lock:
-                    if game_over: break
-                    
-                    if guess == target_number:
-                        result = "Correct"
-                        winner = pid
-                        game_over = True
-                        results = f"Player {winner} Wins"
-                    elif guess < target_number:
-                        result = "Too Small"
-                        # === 關鍵修改 2：猜錯了，換下一位 ===
-                        current_turn_index = (current_turn_index + 1) % len(players)
-                    else:
-                        result = "Too Big"
-                        # === 關鍵修改 2：猜錯了，換下一位 ===
-                        current_turn_index = (current_turn_index + 1) % len(players)
-                    
-                    # 取得下一位玩家的 ID
-                    next_pid = players[current_turn_index][2]
-
-                    # 廣播結果，並且告訴大家 "下一個是誰 (next_turn)"
-                    broadcast({
-                        "cmd": "guess_result",
-                        "player_id": pid,
-                        "guess": guess,
-                        "result": result,
-                        "winner": winner,
-                        "next_turn": next_pid  # <--- 告訴 Client 更新 UI
-                    })
-                    
-    except Exception as e:
-        print(f"Error {pid}: {e}")
-    finally:
-        conn.close()
+                if msg['cmd'] == 'guess':
+                    # === 關鍵修改 1：檢查是否輪到這個人 ===
+                    # 我們用 players[current_turn_index] 來判斷現在是誰的回合
+                    # pid 是從 1 開始，列表 index 是從 0 開始，所以要對應一下
+
+                    expected_pid = players[self.current_turn_index][2]
+
+                    if pid != expected_pid:
+                        # 如果不是他的回合，傳送錯誤訊息 (或是直接忽略)
+                        send_json(conn, {"cmd": "error", "msg": "還沒輪到你！"})
+                        continue
+
+                    guess = int(msg['number'])
+                    result = ""
+                    winner = None
+
+                    with self.lock:
+                        if self.game_over: break
+                        self.moves += 1
+
+                        if guess == self.target_number:
+                            result = "Correct"
+                            winner = pid
+                            self.game_over = True
+                            self.winner = winner
+                            self.results = f"Player {winner} Wins"
+                        elif guess < self.target_number:
+                            result = "Too Small"
+                            # === 關鍵修改 2：猜錯了，換下一位 ===
+                            self.current_turn_index = (self.current_turn_index + 1) % len(players)
+                        else:
+                            result = "Too Big"
+                            # === 關鍵修改 2：猜錯了，換下一位 ===
+                            self.current_turn_index = (self.current_turn_index + 1) % len(players)
+
+                        # 取得下一位玩家的 ID
+                        next_pid = players[self.current_turn_index][2]
+
+                        # 廣播結果，並且告訴大家 "下一個是誰 (next_turn)"
+                        self.broadcast({
+                            "cmd": "guess_result",
+                            "player_id": pid,
+                            "guess": guess,
+                            "result": result,
+                            "winner": winner,
+                            "next_turn": next_pid  # <--- 告訴 Client 更新 UI
+                        })
+
+        except Exception as e:
+            print(f"Error {pid}: {e}")
+        finally:
+            conn.close()
+
+    def play(self):
+        """人數到齊後開始，回傳要回報給 Lobby 的結果"""
+        print("Game Start!")
+
+        # 遊戲開始時，告訴大家現在是 Player 1 (index 0) 的回合
+        first_player_pid = self.players[0][2]
+        self.broadcast({
+            "cmd": "start",
+            "turn": first_player_pid
+        })
+
+        threads = []
+        for p in self.players:
+            conn = p[0]
+            pid = p[2]
+            t = threading.Thread(target=self.handle_client, args=(conn, pid))
+            t.start()
+            threads.append(t)
+
+        for t in threads:
+            t.join()
+        return self.results
+
+    def player_results(self):
+        """各玩家的結果 {"1": "Win", "2": "Lose", ...} (給控制通道的 result 用)"""
+        if self.winner is None:
+            return {str(p[2]): "Draw" for p in self.players}
+        return {str(p[2]): "Win" if p[2] == self.winner else "Lose" for p in self.players}
+
+def run_room(clients, players):
+    """多房間模式 (manifest.json 的 multi_room) 的進入點: clients 是已經連上的所有玩家"""
+    match = Match(players)
+    for conn in clients:
+        match.add_player(conn, conn.getpeername())
+    return match.play()
 
 def main():
     parser = argparse.ArgumentParser()
@@ -103,50 +166,25 @@ def main():
     
     # 接收 Lobby 傳來的額外參數 (避免 Crash)
     args, unknown = parser.parse_known_args()
-    global results
-    global target_number
-    target_number = random.randint(1, 100)
-    print(f"[GuessServer] Target is {target_number}, waiting for {args.players} players...")
+    match = Match(args.players)
+    print(f"[GuessServer] Target is {match.target_number}, waiting for {args.players} players...")
     
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(('0.0.0.0', args.port))
-    server.listen(5)
+    server = control.listener(args.port, 5)
+    use_control = control.start()
     
     # 等待足夠人數
-    while len(players) < args.players:
+    while len(match.players) < args.players:
         conn, addr = server.accept()
-        pid = len(players) + 1 
-        # 將 pid 也存入 tuple: (conn, addr, pid)
-        players.append((conn, addr, pid))
-        
-        send_json(conn, {"cmd": "init", "player_id": pid})
-        print(f"Player {pid} joined.")
-        
-        broadcast({
-            "cmd": "waiting_status", 
-            "current": len(players), 
-            "total": args.players
-        })
+        match.add_player(conn, addr)
 
-    print("Game Start!")
-    
-    # 遊戲開始時，告訴大家現在是 Player 1 (index 0) 的回合
-    first_player_pid = players[0][2]
-    broadcast({
-        "cmd": "start", 
-        "turn": first_player_pid
-    })
-    
-    threads = []
-    for p in players:
-        conn = p[0]
-        pid = p[2]
-        t = threading.Thread(target=handle_client, args=(conn, pid))
-        t.start()
-        threads.append(t)
-        
-    for t in threads:
-        t.join()
+    results = match.play()
+    if use_control:
+        # 平台有給控制通道: 直接回報，不用再連回 Lobby
+        control.telemetry(moves=match.moves)
+        control.result(results, match.player_results())
+        server.close()
+        print("[Game Server] Closed.")
+        return
     #要做回傳結束給lobby_server的動作
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
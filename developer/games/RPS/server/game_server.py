@@ -3,6 +3,10 @@ import argparse
 import threading
 import json
 import time
+from lobby_control import LobbyControl
+
+# 跟平台 Lobby 的控制通道 (單房間模式才會接上，見 lobby_control.py)
+control = LobbyControl()
 
 # 簡單的通訊協定 (Length-Prefix)，避免黏包
 def send_json(sock, data):
@@ -15,13 +19,15 @@ def recv_json(sock):
         if not header: return None
         length = int.from_bytes(header, byteorder='big')
         body = sock.recv(length)
+        control.touch()
         return json.loads(body.decode('utf-8'))
     except:
         return None
 
 def handle_game(p1_sock, p2_sock):
-    """處理一局遊戲邏輯"""
-    global results
+    """處理一局遊戲邏輯，回傳 (要回報給 Lobby 的結果, 各玩家的結果)"""
+    results = "Draw"
+    result_p1 = result_p2 = "Draw"
     try:
         # 1. 通知雙方遊戲開始
         start_msg = {"event": "start", "msg": "遊戲開始！請出拳 (R/P/S)"}
@@ -45,9 +51,6 @@ def handle_game(p1_sock, p2_sock):
         m2 = moves.get("p2")
 
         # 3. 判定勝負
-        result_p1 = "Draw"
-        result_p2 = "Draw"
-
         if m1 and m2:
             if m1 == m2:
                 pass # Draw
@@ -89,6 +92,13 @@ def handle_game(p1_sock, p2_sock):
         time.sleep(1) # 等一下確保訊息傳送
         p1_sock.close()
         p2_sock.close()
+    return results, {"1": result_p1, "2": result_p2}
+
+def run_room(clients, players):
+    """多房間模式 (manifest.json 的 multi_room) 的進入點: clients 是已經連上的兩位玩家"""
+    for i, conn in enumerate(clients):
+        send_json(conn, {"event": "info", "msg": f"You are Player {i + 1}"})
+    return handle_game(clients[0], clients[1])[0]
 
 def main():
     # 接收平台傳來的參數
@@ -101,13 +111,10 @@ def main():
 
     args = parser.parse_args()
 
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    # 綁定 0.0.0.0 讓外部 Client 可以連入
-    server.bind(('0.0.0.0', args.port))
-    server.listen(2)
+    server = control.listener(args.port, 2)
     
     print(f"[Game Server] Listening on port {args.port}...")
-    global results
+    use_control = control.start()
     clients = []
     # 等待兩人加入
     while len(clients) < 2:
@@ -118,7 +125,13 @@ def main():
         send_json(conn, {"event": "info", "msg": f"You are Player {len(clients)}"})
 
     print("[Game Server] Both players connected. Starting game...")
-    handle_game(clients[0], clients[1])
+    results, player_results = handle_game(clients[0], clients[1])
+    if use_control:
+        # 平台有給控制通道: 直接回報，不用再連回 Lobby
+        control.result(results, player_results)
+        server.close()
+        print("[Game Server] Closed.")
+        return
     #要做回傳結束給lobby_server的動作
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
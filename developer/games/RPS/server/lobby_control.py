@@ -0,0 +1,68 @@
+import json
+import os
+import socket
+import threading
+import time
+
+# 跟平台 Lobby 之間的控制通道
+# 平台啟動遊戲 Server 時會用環境變數 GAME_CONTROL_FD 給一個已經連好的 socket，格式一樣是 4 bytes 長度 + JSON
+# 沒有控制通道 (自己手動執行、舊版平台) 時 start() 回傳 False，遊戲照舊連回 Lobby 送 end_game
+# 平台也會用環境變數 GAME_LISTEN_FD 給一個已經 bind + listen 好 --port 的 socket (見 listener())
+# 多房間模式 (run_room) 由 host 回報，不用這個檔案
+
+# 多久送一次 heartbeat (秒)
+HEARTBEAT_INTERVAL = 5
+
+
+class LobbyControl:
+    def __init__(self):
+        self.sock = None
+        self.lock = threading.Lock()
+        self.last_input = time.monotonic()
+
+    def start(self):
+        """接上控制通道，告訴 Lobby 可以讓玩家連線了，並開始送 heartbeat；沒有控制通道回傳 False"""
+        fd = os.environ.get("GAME_CONTROL_FD")
+        if not fd:
+            return False
+        self.sock = socket.socket(fileno=int(fd))
+        self.send({"type": "ready"})
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+        return True
+
+    def listener(self, port, backlog):
+        """遊戲要 accept 玩家的 socket: 平台給了就直接用，否則自己 bind + listen"""
+        fd = os.environ.get("GAME_LISTEN_FD")
+        if fd:
+            return socket.socket(fileno=int(fd))
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # 綁定 0.0.0.0 讓外部 Client 可以連入
+        server.bind(('0.0.0.0', port))
+        server.listen(backlog)
+        return server
+
+    def send(self, msg):
+        if self.sock is None:
+            return
+        data = json.dumps(msg).encode('utf-8')
+        with self.lock:
+            try:
+                self.sock.sendall(len(data).to_bytes(4, byteorder='big') + data)
+            except OSError:
+                pass # Lobby 關掉了
+
+    def touch(self):
+        """收到玩家的訊息時呼叫 (Lobby 用 heartbeat 的 idle 判斷比賽是不是沒人在玩了)"""
+        self.last_input = time.monotonic()
+
+    def telemetry(self, **data):
+        self.send({"type": "telemetry", "data": data})
+
+    def result(self, result, players=None):
+        """比賽結束: result 跟 end_game 的一樣，players 是各玩家的結果 {"1": "Win", ...}"""
+        self.send({"type": "result", "result": result, "players": players})
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            self.send({"type": "heartbeat", "idle": round(time.monotonic() - self.last_input, 1)})
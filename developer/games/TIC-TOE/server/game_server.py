@@ -3,6 +3,10 @@ import threading
 import json
 import argparse
 import time
+from lobby_control import LobbyControl
+
+# 跟平台 Lobby 的控制通道 (單房間模式才會接上，見 lobby_control.py)
+control = LobbyControl()
 
 def send_json(sock, data):
     msg = json.dumps(data).encode('utf-8')
@@ -14,74 +18,118 @@ def recv_json(sock):
         if not header: return None
         length = int.from_bytes(header, byteorder='big')
         body = sock.recv(length)
+        control.touch()
         return json.loads(body.decode('utf-8'))
     except:
         return None
 
-# 遊戲狀態
-board = [""] * 9
-players = [] # [(conn, addr), ...]
-current_turn = 0 # 0 for Player 1 (X), 1 for Player 2 (O)
-game_over = False
-
-def check_winner():
-    wins = [(0,1,2), (3,4,5), (6,7,8), (0,3,6), (1,4,7), (2,5,8), (0,4,8), (2,4,6)]
-    for a, b, c in wins:
-        if board[a] and board[a] == board[b] == board[c]:
-            return board[a]
-    if "" not in board:
-        return "Draw"
-    return None
-
-def broadcast(data):
-    for p in players:
+class Match:
+    """一場比賽的狀態 (多房間模式下同一個 process 會同時有很多場)"""
+    def __init__(self):
+        self.board = [""] * 9
+        self.players = [] # [(conn, addr), ...]
+        self.current_turn = 0 # 0 for Player 1 (X), 1 for Player 2 (O)
+        self.game_over = False
+        self.results = "Draw"
+        self.moves = 0
+
+    def check_winner(self):
+        board = self.board
+        wins = [(0,1,2), (3,4,5), (6,7,8), (0,3,6), (1,4,7), (2,5,8), (0,4,8), (2,4,6)]
+        for a, b, c in wins:
+            if board[a] and board[a] == board[b] == board[c]:
+                return board[a]
+        if "" not in board:
+            return "Draw"
+        return None
+
+    def broadcast(self, data):
+        for p in self.players:
+            try:
+                send_json(p[0], data)
+            except:
+                pass
+
+    def add_player(self, conn, addr):
+        pid = len(self.players)
+        self.players.append((conn, addr))
+
+        # 告訴玩家他是誰
+        send_json(conn, {
+            "cmd": "init",
+            "player_id": pid,
+            "symbol": "X" if pid == 0 else "O"
+        })
+        print(f"Player {pid} connected.")
+
+    def handle_client(self, conn, player_id):
         try:
-            send_json(p[0], data)
-        except:
-            pass
+            while not self.game_over:
+                msg = recv_json(conn)
+                if not msg: break
 
-def handle_client(conn, player_id):
-    global current_turn, game_over, results
-    try:
-        while not game_over:
-            msg = recv_json(conn)
-            if not msg: break
-            
-            if msg['cmd'] == 'move':
-                idx = msg['index']
-                # 檢查是否合法的移動
-                if board[idx] == "" and player_id == current_turn and not game_over:
-                    # 更新盤面
-                    symbol = "X" if player_id == 0 else "O"
-                    board[idx] = symbol
-                    
-                    # 檢查勝負
-                    winner = check_winner()
-                    
-                    # 換手
-                    current_turn = 1 - current_turn
-                    
-                    # 廣播新狀態
-                    update_msg = {
-                        "cmd": "update",
-                        "board": board,
-                        "turn": current_turn,
-                        "winner": winner
-                    }
-                    broadcast(update_msg)
-                    
-                    if winner:
-                        if winner == "Draw":
-                            results = "Draw"
-                        elif winner == "X":
-                            results = "Player 1 Wins"
-                        else:
-                            results = "Player 2 Wins"
-                        game_over = True
-    except Exception as e:
-        print(f"Player {player_id} error: {e}")
-    finally:
-        conn.close()
+                if msg['cmd'] == 'move':
+                    idx = msg['index']
+                    # 檢查是否合法的移動
+                    if self.board[idx] == "" and player_id == self.current_turn and not self.game_over:
+                        # 更新盤面
+                        symbol = "X" if player_id == 0 else "O"
+                        self.board[idx] = symbol
+                        self.moves += 1
+
+                        # 檢查勝負
+                        winner = self.check_winner()
+
+                        # 換手
+                        self.current_turn = 1 - self.current_turn
+
+                        # 廣播新狀態
+                        update_msg = {
+                            "cmd": "update",
+                            "board": self.board,
+                            "turn": self.current_turn,
+                            "winner": winner
+                        }
+                        self.broadcast(update_msg)
+
+                        if winner:
+                            if winner == "Draw":
+                                self.results = "Draw"
+                            elif winner == "X":
+                                self.results = "Player 1 Wins"
+                            else:
+                                self.results = "Player 2 Wins"
+                            self.game_over = True
+        except Exception as e:
+            print(f"Player {player_id} error: {e}")
+        finally:
+            conn.close()
+
+    def play(self):
+        """兩位玩家都到齊後開始，回傳要回報給 Lobby 的結果"""
+        self.broadcast({"cmd": "start", "turn": 0})
+
+        # 啟動執行緒處理兩位玩家
+        t1 = threading.Thread(target=self.handle_client, args=(self.players[0][0], 0))
+        t2 = threading.Thread(target=self.handle_client, args=(self.players[1][0], 1))
+        t1.start(); t2.start()
+        t1.join(); t2.join()
+        return self.results
+
+    def player_results(self):
+        """各玩家的結果 {"1": "Win", "2": "Lose"} (給控制通道的 result 用)"""
+        if self.results == "Player 1 Wins":
+            return {"1": "Win", "2": "Lose"}
+        if self.results == "Player 2 Wins":
+            return {"1": "Lose", "2": "Win"}
+        return {"1": "Draw", "2": "Draw"}
+
+def run_room(clients, players):
+    """多房間模式 (manifest.json 的 multi_room) 的進入點: clients 是已經連上的兩位玩家"""
+    match = Match()
+    for conn in clients:
+        match.add_player(conn, conn.getpeername())
+    return match.play()
 
 def main():
     parser = argparse.ArgumentParser()
@@ -92,34 +140,25 @@ def main():
     parser.add_argument('--players', type=int, required=True, help='Number of Players')
     args = parser.parse_args()
 
-    global results
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(('0.0.0.0', args.port))
-    server.listen(2)
+    server = control.listener(args.port, 2)
     print(f"[TicTacToe Server] Listening on {args.port}")
+    use_control = control.start()
 
     # 等待兩位玩家
-    while len(players) < 2:
+    match = Match()
+    while len(match.players) < 2:
         conn, addr = server.accept()
-        pid = len(players)
-        players.append((conn, addr))
-        
-        # 告訴玩家他是誰
-        send_json(conn, {
-            "cmd": "init",
-            "player_id": pid,
-            "symbol": "X" if pid == 0 else "O"
-        })
-        print(f"Player {pid} connected.")
+        match.add_player(conn, addr)
 
     # 開始遊戲
-    broadcast({"cmd": "start", "turn": 0})
-    
-    # 啟動執行緒處理兩位玩家
-    t1 = threading.Thread(target=handle_client, args=(players[0][0], 0))
-    t2 = threading.Thread(target=handle_client, args=(players[1][0], 1))
-    t1.start(); t2.start()
-    t1.join(); t2.join()
+    results = match.play()
+    if use_control:
+        # 平台有給控制通道: 直接回報，不用再連回 Lobby
+        control.telemetry(moves=match.moves)
+        control.result(results, match.player_results())
+        server.close()
+        print("[Game Server] Closed.")
+        return
 
     #要做回傳結束給lobby_server的動作
     try:
@@ -1,24 +1,19 @@
 import json
+import time
 import os
-import struct
-import zipfile
+import hashlib
 import math
+from framing import send_frame, recv_frame, recv_exact, FrameTooLargeError
+from framing import send_file_body, format_rate
 def send_json(sock, data_dict):
     """
     將 Python Dict 轉為 JSON -> 加上長度 Header -> 發送
     """
     # 1. 序列化: Dict -> JSON String -> Bytes
-    json_str = json.dumps(data_dict)
-    msg_bytes = json_str.encode('utf-8')
-    
-    # 2. 計算長度: 取得 bytes 的長度
-    msg_len = len(msg_bytes)
-    
-    # 3. 打包 Header: '!I' 代表 Network byte order (Big-endian), Unsigned Int (4 bytes)
-    header = struct.pack('!I', msg_len)
-    
-    # 4. 發送: Header + Body
-    sock.sendall(header + msg_bytes)
+    msg_bytes = json.dumps(data_dict).encode('utf-8')
+
+    # 2. 發送: Header + Body (封包格式見 framing.py)
+    send_frame(sock, msg_bytes)
 
 
 def recv_json(sock):
@@ -26,24 +21,18 @@ def recv_json(sock):
     接收 4 bytes Header -> 讀取對應長度 Body -> 解析 JSON 回傳 Dict
     若連線中斷則回傳 None
     """
-    # 1. 先讀取 4 bytes (Header)
-    header = recvall(sock, 4)
-    if not header:
-        return None # 連線已關閉
-        
-    # 2. 解包 Header 取得內容長度
-    msg_len = struct.unpack('!I', header)[0]
-    
-    # 3. 根據長度讀取完整的 Body
-    body_bytes = recvall(sock, msg_len)
-    if not body_bytes:
-        return None # 讀取 Body 途中發生錯誤或斷線
-        
-    # 4. 反序列化: Bytes -> JSON String -> Dict
     try:
-        json_str = body_bytes.decode('utf-8')
-        return json.loads(json_str)
-    except json.JSONDecodeError:
+        body_bytes = recv_frame(sock)
+    except FrameTooLargeError as e:
+        print(f"[Error] {e}")
+        return None
+    if body_bytes is None:
+        return None # 連線已關閉或讀取途中斷線
+
+    # 反序列化: Bytes -> JSON String -> Dict
+    try:
+        return json.loads(body_bytes.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError):
         print("[Error] Received invalid JSON")
         return None
 
@@ -52,17 +41,7 @@ def recvall(sock, n):
     輔助函式: 確保一定讀滿 n 個 bytes 才會 return
     解決 TCP 斷包問題 (例如一次只收到半個 JSON 的情況)
     """
-    data = b''
-    while len(data) < n:
-        try:
-            packet = sock.recv(n - len(data))
-            if not packet:
-                return None # 對方關閉了連線
-            data += packet
-        except ConnectionResetError:
-            return None
-    return data
-
+    return recv_exact(sock, n)
 
 def send_file(sock, filepath):
     """
@@ -89,16 +68,13 @@ def send_file(sock, filepath):
     }
     send_json(sock, header)
 
-    # 2. 再傳檔案內容 (分塊讀取，避免記憶體爆炸)
+    # 2. 再傳檔案內容 (能用 sendfile 就不經過 Python，否則大塊分段讀取，避免記憶體爆炸)
+    start = time.perf_counter()
     with open(filepath, 'rb') as f:
-        while True:
-            # 每次讀 4096 bytes 傳送
-            chunk = f.read(4096)
-            if not chunk:
-                break
-            sock.sendall(chunk)
-    
-    print(f"[System] Sent file: {filename} ({filesize} bytes)")
+        send_file_body(sock, f, filesize)
+    elapsed = time.perf_counter() - start
+
+    print(f"[System] Sent file: {filename} ({filesize} bytes, {elapsed:.2f}s, {format_rate(filesize, elapsed)})")
     
 def validate_game_folder(folder_path):
     print(f"[Check] 正在檢查遊戲資料夾: {folder_path} ...")
@@ -145,10 +121,10 @@ def validate_game_folder(folder_path):
     return True
 
 
-def zip_game_folder(folder_path, output_zip_name="temp_game.zip", username = "developer", update = False):
+def prepare_game_folder(folder_path, username="developer", update=False):
     """
-    將指定資料夾的內容壓縮成 zip 檔
-    回傳: 壓縮後的 zip 檔案路徑，如果失敗則回傳 None
+    上傳前的本地處理: 設定 manifest.json 並檢查資料夾
+    回傳: manifest 內容 (Dict)，失敗則回傳 None
     """
     # 1. 基本檢查
     if not os.path.exists(folder_path):
@@ -165,30 +141,57 @@ def zip_game_folder(folder_path, output_zip_name="temp_game.zip", username = "de
     if not validate_game_folder(folder_path):
         return None
 
-    # 3. 開始壓縮
-    print(f"[System] Zipping game files from '{folder_path}'...")
-    
-    try:
-        with zipfile.ZipFile(output_zip_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # os.walk 會遞迴遍歷所有子資料夾
-            for root, dirs, files in os.walk(folder_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    
-                    # 計算在 zip 內的相對路徑 (重要！)
-                    # 例如把 /home/user/snake/server/main.py 變成 server/main.py
-                    # 這樣解壓縮時才不會有一堆多餘的層級
-                    arcname = os.path.relpath(file_path, folder_path)
-                    
-                    zipf.write(file_path, arcname)
-                    
-        print(f"[System] Successfully packed into {output_zip_name}")
-        return output_zip_name
+    with open(os.path.join(folder_path, 'manifest.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _list_game_files(folder_path):
+    """資料夾內所有檔案的相對路徑 ('/' 分隔)，manifest.json 排第一個"""
+    rel_paths = []
+    for root, dirs, files in os.walk(folder_path):
+        for file in files:
+            rel = os.path.relpath(os.path.join(root, file), folder_path).replace(os.sep, '/')
+            if rel != 'manifest.json':
+                rel_paths.append(rel)
+    return ['manifest.json'] + sorted(rel_paths)
+
+
+def local_file_hashes(folder_path):
+    """差異上傳用: {相對路徑: sha256}"""
+    hashes = {}
+    for rel in _list_game_files(folder_path):
+        digest = hashlib.sha256()
+        with open(os.path.join(folder_path, *rel.split('/')), 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        hashes[rel] = digest.hexdigest()
+    return hashes
+
+
+def send_game_folder(sock, folder_path, only=None):
+    """
+    串流上傳 (upload_game_stream / upload_game_delta): 不壓縮，直接一個一個檔案送出，Server 邊收邊寫檔
+    每個檔案先送 {"path", "size"} 再送內容 (能用 sendfile 就用)；manifest.json 最先送
+    最後送 {"end": True, "files": 檔案數}
+    only: 差異上傳時只送這些檔案 (相對路徑)
+    """
+    rel_paths = _list_game_files(folder_path)
+    if only is not None:
+        rel_paths = [rel for rel in rel_paths if rel in only]
+
+    total = 0
+    start = time.perf_counter()
+    for rel in rel_paths:
+        with open(os.path.join(folder_path, *rel.split('/')), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            send_json(sock, {"path": rel, "size": size})
+            send_file_body(sock, f, size)
+        total += size
+    send_json(sock, {"end": True, "files": len(rel_paths)})
+    elapsed = time.perf_counter() - start
+
+    print(f"[System] Sent {len(rel_paths)} files ({total} bytes, {elapsed:.2f}s, {format_rate(total, elapsed)})")
 
-    except Exception as e:
-        print(f"[Error] Failed to zip files: {e}")
-        return None
-    
 def manifest_initial_setting(folder_path, username="developer"):
     """
     回傳一個基本的 manifest.json 範本內容 (Dict)
@@ -206,7 +209,9 @@ def manifest_initial_setting(folder_path, username="developer"):
             "type": "",
             "author": "遊戲開發者名稱",
             "client_args": "",
-            "server_args": ""
+            "server_args": "",
+            "multi_room": False,
+            "control_channel": False
         }
 
         template['author'] = username
@@ -297,6 +302,15 @@ def manifest_initial_setting(folder_path, username="developer"):
         else:
             template['client_args'] = ""
             print("[Info] 未輸入參數，使用預設空值。")
+
+        # 多房間模式: Server 執行檔是 .py 且提供 run_room(clients, players) 時，平台可以把多個房間放在同一個 process
+        multi_room = input("Server 是否提供 run_room() 支援多房間模式? (y/N): ").strip().lower()
+        template['multi_room'] = multi_room == 'y'
+
+        # 控制通道: Server 透過環境變數 GAME_CONTROL_FD 回報 ready / heartbeat / 結果 (可參考範例遊戲的 lobby_control.py)
+        #           並直接使用 GAME_LISTEN_FD 傳來已經 listen 好的 socket，不自己 bind --port
+        control_channel = input("Server 是否使用平台的控制通道回報狀態? (y/N): ").strip().lower()
+        template['control_channel'] = control_channel == 'y'
         #重新輸出遊戲簡介確認是否要重新填寫
         print("\n=== 遊戲簡介確認 ===")
         for key, value in template.items():
@@ -448,6 +462,14 @@ def manifest_update_setting(folder_path, username="developer"):
         else:
             template['client_args'] = ""
             print("[Info] 未輸入參數，使用預設空值。")
+
+        multi_room = input(f"Server 是否提供 run_room() 支援多房間模式? (y/N，目前: {'y' if template.get('multi_room') else 'N'}): ").strip().lower()
+        if multi_room:
+            template['multi_room'] = multi_room == 'y'
+
+        control_channel = input(f"Server 是否使用平台的控制通道回報狀態? (y/N，目前: {'y' if template.get('control_channel') else 'N'}): ").strip().lower()
+        if control_channel:
+            template['control_channel'] = control_channel == 'y'
             
         #重新輸出遊戲簡介確認是否要重新填寫
         print("\n=== 遊戲簡介確認 ===")
@@ -0,0 +1,71 @@
+import threading
+
+from config import BUSY_RETRY_AFTER_MS
+
+# 各服務 (Lobby / Developer) 的連線統計與上限控制，thread 與 asyncio 兩種連線模型共用
+
+class ListenerStats:
+    def __init__(self, service_name, max_connections):
+        self.service_name = service_name
+        self.max_connections = max_connections
+        self.accepted = 0   # 成功接受的連線總數
+        self.rejected = 0   # 因為滿載被拒絕的連線總數
+        self.active = 0     # 目前連線中
+        self._lock = threading.Lock()
+
+    def try_admit(self):
+        """有空位就佔一個位置並回傳 True，否則記一次拒絕並回傳 False"""
+        with self._lock:
+            if self.active >= self.max_connections:
+                self.rejected += 1
+                return False
+            self.accepted += 1
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "active": self.active,
+                "max": self.max_connections
+            }
+
+
+# service_name -> ListenerStats
+listener_stats = {}
+
+def register_listener(service_name, max_connections):
+    stats = ListenerStats(service_name, max_connections)
+    listener_stats[service_name] = stats
+    return stats
+
+def busy_reply():
+    """回給被拒絕連線的錯誤訊息，Client 可以照 retry_after_ms 等一下再重連"""
+    return {
+        "status": "error",
+        "code": "server_busy",
+        "msg": "Server busy, please retry later",
+        "retry_after_ms": BUSY_RETRY_AFTER_MS
+    }
+
+def log_listener_stats():
+    for name, stats in listener_stats.items():
+        s = stats.snapshot()
+        print(f"[Stats] {name}: active={s['active']}/{s['max']} accepted={s['accepted']} rejected={s['rejected']}")
+
+def start_stats_logger(interval, extra_loggers=()):
+    """每 interval 秒印一次統計 (背景執行緒)，extra_loggers 是其他要一起印的統計函式"""
+    def loop():
+        while not stop_event.wait(interval):
+            log_listener_stats()
+            for log in extra_loggers:
+                log()
+    stop_event = threading.Event()
+    threading.Thread(target=loop, daemon=True).start()
+    return stop_event
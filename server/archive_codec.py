@@ -0,0 +1,144 @@
+import json
+import os
+import struct
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+# 遊戲壓縮檔的打包: 大檔案丟到多個 process 同時壓縮，再依序寫進同一個 zip
+# server / developer 各放一份相同的檔案 (三邊是分開部署的；client 只需要解壓縮，zipfile 本身就支援)
+#
+# codec: "store"、"deflate-1" ~ "deflate-9" 或 "lzma"，寫在 zip 的 comment 裡 ({"codec": ...})
+# 本來就壓縮過的素材 (png、ogg、zip...) 一律直接存，再壓一次只是浪費 CPU
+
+DEFAULT_CODEC = "deflate-6"
+
+STORED_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.webp',
+    '.ogg', '.mp3', '.m4a', '.opus', '.mp4', '.webm',
+    '.zip', '.gz', '.bz2', '.xz', '.7z', '.rar', '.woff2',
+}
+
+# 比這小的檔案直接在目前的 process 壓縮 (送到其他 process 的成本比壓縮本身還高)
+PARALLEL_MIN_SIZE = 256 * 1024
+
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+_executor = None
+
+
+def parse_codec(codec):
+    """回傳 (compress_type, compresslevel)，不認得的 codec 丟出 ValueError"""
+    if codec == "store":
+        return zipfile.ZIP_STORED, None
+    if codec == "lzma":
+        return zipfile.ZIP_LZMA, None
+    if codec.startswith("deflate-") and codec[len("deflate-"):] in [str(i) for i in range(1, 10)]:
+        return zipfile.ZIP_DEFLATED, int(codec[len("deflate-"):])
+    raise ValueError(f"Unknown archive codec: {codec}")
+
+def read_codec(zip_path):
+    """zip 是用哪個 codec 打包的 (舊的壓縮檔沒有記錄，回傳 None)"""
+    with zipfile.ZipFile(zip_path, 'r') as zf:
+        try:
+            return json.loads(zf.comment.decode('utf-8')).get("codec")
+        except (UnicodeDecodeError, json.JSONDecodeError, AttributeError):
+            return None
+
+def get_executor(max_workers=None):
+    """Server 共用的壓縮 process pool (第一次用到才建立)"""
+    global _executor
+    if _executor is None:
+        # Server 有很多執行緒，fork 出來的子 process 可能帶著別人鎖住的鎖，一律用 spawn
+        _executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _compress_member(file_path, arcname, compress_type, compresslevel, tmp_dir):
+    """
+    (在 worker process 執行) 把一個檔案壓縮成只有一個成員的暫存 zip
+    回傳 (暫存檔路徑, 壓縮資料的起點, CRC, 壓縮後大小, 原始大小, flag_bits)
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix=".member.tmp", dir=tmp_dir)
+    os.close(fd)
+    with zipfile.ZipFile(tmp_path, 'w', compress_type, compresslevel=compresslevel) as zf:
+        zf.write(file_path, arcname)
+        info = zf.infolist()[0]
+    with open(tmp_path, 'rb') as f:
+        fields = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+    name_len, extra_len = fields[-2], fields[-1]
+    return tmp_path, _LOCAL_HEADER.size + name_len + extra_len, info.CRC, info.compress_size, info.file_size, info.flag_bits
+
+def _append_compressed(zf, file_path, arcname, compress_type, result):
+    """把 worker 壓好的資料原封不動搬進 zf (zipfile 沒有公開的 API 可以寫入已壓縮的資料)"""
+    tmp_path, data_offset, crc, compress_size, file_size, flag_bits = result
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    zinfo.compress_type = compress_type
+    zinfo.CRC = crc
+    zinfo.compress_size = compress_size
+    zinfo.file_size = file_size
+    zinfo.flag_bits = flag_bits
+    zinfo.header_offset = zf.fp.tell()
+    zf.fp.write(zinfo.FileHeader())
+    with open(tmp_path, 'rb') as src:
+        src.seek(data_offset)
+        remaining = compress_size
+        while remaining > 0:
+            chunk = src.read(min(1024 * 1024, remaining))
+            if not chunk:
+                raise EOFError(f"Compressed data of {arcname} is truncated")
+            zf.fp.write(chunk)
+            remaining -= len(chunk)
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+    zf.start_dir = zf.fp.tell()
+
+
+def write_archive(output_zip_name, entries, codec=DEFAULT_CODEC, executor=None, max_workers=None):
+    """
+    entries: [(檔案路徑, zip 裡的名稱), ...]
+    executor: 共用的 process pool；沒給就這次自己開一個，做完關掉 (開發者端)
+    回傳 output_zip_name
+    """
+    compress_type, compresslevel = parse_codec(codec)
+    tmp_dir = os.path.dirname(os.path.abspath(output_zip_name))
+    own_executor = None
+    pending = []
+    try:
+        with zipfile.ZipFile(output_zip_name, 'w', compress_type, compresslevel=compresslevel) as zf:
+            zf.comment = json.dumps({"codec": codec}).encode('utf-8')
+            for file_path, arcname in entries:
+                if (compress_type == zipfile.ZIP_STORED
+                        or os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS):
+                    zf.write(file_path, arcname, compress_type=zipfile.ZIP_STORED)
+                elif os.path.getsize(file_path) < PARALLEL_MIN_SIZE:
+                    zf.write(file_path, arcname)
+                else:
+                    if executor is None:
+                        executor = own_executor = ProcessPoolExecutor(
+                            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+                    future = executor.submit(_compress_member, file_path, arcname, compress_type, compresslevel, tmp_dir)
+                    pending.append((file_path, arcname, future))
+
+            # 依送出的順序寫入 (後面的檔案通常也已經壓好了，等待的時間會跟前面重疊)
+            for file_path, arcname, future in pending:
+                result = future.result()
+                try:
+                    _append_compressed(zf, file_path, arcname, compress_type, result)
+                finally:
+                    os.remove(result[0])
+    finally:
+        # 中途失敗時，還沒搬進 zip 的暫存檔也要清掉
+        for _, _, future in pending:
+            if future.cancel():
+                continue
+            try:
+                tmp_path = future.result()[0]
+            except Exception:
+                continue
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if own_executor is not None:
+            own_executor.shutdown()
+    return output_zip_name
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import register_listener, busy_reply
+from framing import HEADER, MAX_FRAME_SIZE
+
+# asyncio 版的連線模型:
+# 閒置的連線只是一個等待中的 coroutine，不佔執行緒；收到完整的指令後才丟給有上限的執行緒池處理
+# (handler 與資料庫都是同步的程式碼，不能直接在 event loop 上跑)
+# 傳檔的指令 (transfer_commands) 整段傳輸都佔著執行緒，另外交給自己的執行緒池，慢的下載不會卡住登入、列表這些指令
+
+class AsyncConnection:
+    """
+    把 asyncio 的 StreamReader / StreamWriter 包成 socket 的樣子
+    讓原本的 send_json / recv_json / send_file / recv_file 可以在執行緒池裡直接使用
+    """
+    def __init__(self, loop, reader, writer):
+        self._loop = loop
+        self._reader = reader
+        self._writer = writer
+
+    def _call(self, coro):
+        # 只能從執行緒池呼叫；在 event loop 執行緒上呼叫會卡死
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _send(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+
+    def sendall(self, data):
+        self._call(self._send(bytes(data)))
+
+    def recv(self, n):
+        return self._call(self._reader.read(n))
+
+    def recv_into(self, buffer, nbytes=0):
+        data = self._call(self._reader.read(nbytes or len(buffer)))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._writer.close)
+
+    def getpeername(self):
+        return self._writer.get_extra_info('peername')
+
+
+async def read_frame(reader):
+    """讀一個 4 bytes 長度 + JSON 的封包，連線中斷或格式錯誤回傳 None"""
+    try:
+        header = await reader.readexactly(HEADER.size)
+        msg_len = HEADER.unpack(header)[0]
+        if msg_len > MAX_FRAME_SIZE:
+            print(f"[Error] Frame of {msg_len} bytes exceeds limit of {MAX_FRAME_SIZE} bytes")
+            return None
+        body = await reader.readexactly(msg_len)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    try:
+        return json.loads(body.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        print("[Error] Received invalid JSON")
+        return None
+
+
+class AsyncService:
+    """
+    一個 Port 的服務，handler 介面跟執行緒版共用:
+    open_session(conn, addr) -> session
+    handle_request(session, req) -> True 繼續 / False 關閉連線
+    close_session(session)
+    transfer_commands: 交給 transfer_executor 的指令
+    """
+    def __init__(self, port, open_session, handle_request, close_session, service_name, transfer_commands,
+                 executor, transfer_executor, max_connections, backlog):
+        self.port = port
+        self.open_session = open_session
+        self.handle_request = handle_request
+        self.close_session = close_session
+        self.service_name = service_name
+        self.transfer_commands = transfer_commands
+        self.executor = executor
+        self.transfer_executor = transfer_executor
+        self.backlog = backlog
+        self.stats = register_listener(service_name, max_connections)
+
+    async def _handle_connection(self, reader, writer):
+        if not self.stats.try_admit():
+            await self._reject_busy(writer)
+            return
+        try:
+            await self._serve(reader, writer)
+        finally:
+            self.stats.release()
+
+    async def _reject_busy(self, writer):
+        body = json.dumps(busy_reply()).encode('utf-8')
+        try:
+            writer.write(HEADER.pack(len(body)) + body)
+            await asyncio.wait_for(writer.drain(), timeout=1.0)
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        addr = writer.get_extra_info('peername')
+        conn = AsyncConnection(loop, reader, writer)
+        session = self.open_session(conn, addr)
+        try:
+            while True:
+                req = await read_frame(reader)
+                if not req:
+                    break
+                # 同一條連線一次只處理一個指令 (handler 可能在中途繼續收資料，例如上傳檔案)
+                executor = self.transfer_executor if req.get('cmd') in self.transfer_commands else self.executor
+                keep_open = await loop.run_in_executor(executor, self.handle_request, session, req)
+                if not keep_open:
+                    break
+        except Exception as e:
+            print(f"[{self.service_name} Error] {addr}: {e}")
+            traceback.print_exc()
+        finally:
+            # 斷線處理也會動到資料庫，一樣丟到執行緒池
+            await loop.run_in_executor(self.executor, self.close_session, session)
+
+    async def start(self):
+        server = await asyncio.start_server(self._handle_connection, '0.0.0.0', self.port, backlog=self.backlog)
+        print(f"[System] {self.service_name} listening on port {self.port} (asyncio)...")
+        return server
+
+
+async def _serve_all(services):
+    servers = [await service.start() for service in services]
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+def run_async_services(service_specs, max_workers, transfer_workers, max_connections, backlog):
+    """
+    service_specs: [(port, open_session, handle_request, close_session, service_name, transfer_commands), ...]
+    所有服務共用一個 event loop、一個處理指令的執行緒池與一個傳檔的執行緒池，直到 Ctrl+C 才返回
+    max_connections 為每個服務的連線上限
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="handler")
+    transfer_executor = ThreadPoolExecutor(max_workers=transfer_workers, thread_name_prefix="transfer")
+    services = [AsyncService(*spec, executor=executor, transfer_executor=transfer_executor,
+                             max_connections=max_connections, backlog=backlog)
+                for spec in service_specs]
+    try:
+        asyncio.run(_serve_all(services))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        transfer_executor.shutdown(wait=False, cancel_futures=True)
@@ -1,2 +1,72 @@
 LOBBY_PORT = 12002
-DEV_PORT = 12001
\ No newline at end of file
+DEV_PORT = 12001
+
+# 資料庫背景執行緒的檢查間隔 (秒)
+DB_FLUSH_INTERVAL = 1.0
+
+# 儲存後端: "json" (server_data/*.json) 或 "sqlite" (server_data/platform.db)
+DB_BACKEND = "json"
+
+# JSON 後端: journal 超過這個大小 (bytes) 就在背景壓縮成快照
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+# 每筆 journal 都 fsync (當機也不掉資料)；關掉則最多每 DB_FLUSH_INTERVAL 秒落地一次
+JOURNAL_FSYNC = True
+
+# 房間只存在記憶體；打開後關閉 Server 時會把當下的房間寫到 server_data/rooms.json 方便除錯
+ROOM_DEBUG_DUMP = False
+
+# 連線模型: "thread" (一條連線一個執行緒) 或 "asyncio" (閒置連線不佔執行緒，指令交給有上限的執行緒池)
+SERVER_ENGINE = "thread"
+# asyncio 模式下處理指令 / 存取資料庫的執行緒數量上限
+ASYNC_WORKERS = 32
+# asyncio 模式下傳檔指令 (下載 / 上傳遊戲) 另外用的執行緒數量上限；傳檔整段時間都佔著一條執行緒，不能跟一般指令搶
+ASYNC_TRANSFER_WORKERS = 16
+
+# --- 連線管理 ---
+# listen() 的 backlog (瞬間大量連線時，排隊等 accept 的上限)
+LISTEN_BACKLOG = 128
+# 遊戲 Server 用的 Port 範圍 (見 services/port_pool.py)；要在系統分配 ephemeral port 的範圍 (Linux 預設 32768 起) 以下
+GAME_PORT_RANGE = (20000, 29999)
+# thread 模式: 每個服務預先開好、閒置時保留的 worker 執行緒數量 (一個 worker 同時只服務一條連線)
+# 玩家登入後整段時間都佔著一條連線 (Client 還可能多一條背景連線)，worker 不夠時會再多開，不受這個數字限制
+WORKER_THREADS = 200
+# 每個服務同時連線上限 (thread / asyncio)，超過就回覆 server_busy 並關閉連線
+# thread 模式一條連線一個執行緒，大部分時間都停在 recv，所以上限要照同時在線的人數抓，不是照 worker 數
+MAX_CONNECTIONS = 2000
+ASYNC_MAX_CONNECTIONS = 20000
+# server_busy 時建議 Client 等多久再重試 (毫秒)
+BUSY_RETRY_AFTER_MS = 1000
+# 每隔幾秒印一次各服務的連線統計 (0 = 不印，只在關閉時印)
+STATS_LOG_INTERVAL = 60
+
+# 遊戲檔案存放: 每個遊戲保留最近上傳的幾個版本 (含目前版本)，更舊的版本上傳新版時刪除
+MAX_KEPT_VERSIONS = 3
+
+# --- 上傳 ---
+# 每個上傳各自在 UPLOAD_STAGING_DIR 底下開一個暫存資料夾 (要跟 games/ 在同一個磁碟，才能直接改名搬過去)
+UPLOAD_STAGING_DIR = "upload_staging"
+# 同時處理的上傳數量上限，超過就回覆 server_busy
+MAX_CONCURRENT_UPLOADS = 4
+# 一個上傳解壓縮後的總大小上限 (bytes)
+MAX_UPLOAD_EXTRACTED_BYTES = 4 * 1024 * 1024 * 1024
+
+# --- 玩家下載用的壓縮檔 ---
+# "store"、"deflate-1" ~ "deflate-9" 或 "lzma" (level 越高越小、越慢；lzma 最小也最慢)
+ARCHIVE_CODEC = "deflate-6"
+# 平行壓縮的 process 數量 (None = CPU 核心數)
+ARCHIVE_WORKERS = None
+
+# --- 遊戲 Server ---
+# 每個遊戲預先啟動幾個閒置的遊戲 Server (已經 import 好、綁好 Port)，開始遊戲時直接拿來用；0 = 每場都冷啟動
+GAME_POOL_SIZE = 1
+# 支援多房間的遊戲 (manifest 的 "multi_room": true) 每個遊戲最多開幾個 host process，房間平均分配上去；0 = 一律一場一個 process
+GAME_HOST_PROCESSES = 2
+# 一場比賽最長幾秒、幾秒完全沒有收發資料就強制結束，房間改回 Waiting (0 = 不限制)
+# 遊戲可以在 manifest.json 用 "max_duration" / "idle_timeout" 各自設定
+GAME_MAX_DURATION = 60 * 60
+GAME_IDLE_TIMEOUT = 10 * 60
+# 監督執行緒多久檢查一次所有遊戲 Server (秒)
+GAME_SUPERVISOR_INTERVAL = 1.0
+# 控制通道 (見 services/game_supervisor.py): 要等 ready 的遊戲 Server 幾秒內沒 ready、送過 heartbeat 的遊戲 Server 幾秒沒再送，就當作掛掉
+GAME_READY_TIMEOUT = 15
+GAME_HEARTBEAT_TIMEOUT = 20
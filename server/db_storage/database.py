@@ -1,429 +1,222 @@
-import json
 import threading
 import os
 import time
 import shutil
+import uuid
 
-# 檔案路徑
-USER_DB_FILE = "server_data/users.json"
-GAME_DB_FILE = "server_data/games.json"
-ROOM_DB_FILE = "server_data/rooms.json"
+from config import DB_BACKEND
+from db_storage import json_store, sqlite_store
 
-# 鎖 (分別鎖定，提升效能)
-user_lock = threading.Lock()
-game_lock = threading.Lock()
-room_lock = threading.Lock()
+# 可選的儲存後端 (使用者、遊戲、評論、遊戲紀錄)
+# 房間是暫時性資料，由 room_registry.py 放在記憶體管理
+BACKENDS = {
+    "json": json_store,
+    "sqlite": sqlite_store,
+}
+_backend = json_store
+
+game_lock = threading.Lock()  # 刪除遊戲檔案時使用
+
+# 商城目錄 (list_games) 的精簡欄位，路徑、執行檔、簡介等細節改用 get_game_info 查
+CATALOG_FIELDS = ["game_id", "uploader", "version", "average_rating", "status", "min_players", "max_players"]
+
+# 目錄版本 = 本次啟動的隨機 ID + 遊戲異動次數，Server 重開後舊版本號一定對不上
+_catalog_lock = threading.Lock()
+_catalog_boot_id = uuid.uuid4().hex[:8]
+_catalog_counter = 0
+_catalog_cache = None  # (version, games)，遊戲有異動時清掉
 
 # --- 初始化 ---
-def init_db():
+def init_db(backend=DB_BACKEND):
+    global _backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown database backend: {backend}")
     if not os.path.exists("server_data"):
         os.makedirs("server_data")
-        
-    if not os.path.exists(USER_DB_FILE):
-        with open(USER_DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump({"developers": {}, "players": {}}, f)
-    else:
-        #讓玩家都離線
-        with open(USER_DB_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        for role in ['developers', 'players']:
-            for username in data[role]:
-                data[role][username]['status'] = 'offline'
-        with open(USER_DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-
-    if not os.path.exists(GAME_DB_FILE):
-        with open(GAME_DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump({}, f) # 一開始是空的字典
-
-    with open(ROOM_DB_FILE, 'w', encoding='utf-8') as f:
-        json.dump({}, f)
+
+    _backend = BACKENDS[backend]
+    _backend.open_store()
+    #讓玩家都離線
+    _backend.reset_online_status()
+    print(f"[DB] Using '{backend}' storage backend.")
+
+def flush_db():
+    _backend.flush()
+
+def shutdown_db():
+    """關閉 Server 前呼叫：強制寫回所有資料並關閉後端"""
+    _backend.close_store()
+    print("[DB] All data flushed to disk.")
+
 # --- 遊戲相關功能 ---
 
+def _bump_catalog():
+    """遊戲目錄有異動 (上架、更新、下架、狀態、評分) 時呼叫"""
+    global _catalog_counter, _catalog_cache
+    with _catalog_lock:
+        _catalog_counter += 1
+        _catalog_cache = None
+
+def _project_game(game):
+    return {field: game.get(field) for field in CATALOG_FIELDS}
+
+def get_catalog():
+    """
+    回傳 (目錄版本, 精簡後的遊戲列表)
+    同一個版本只會組一次列表，之後直接回傳快取
+    """
+    global _catalog_cache
+    with _catalog_lock:
+        if _catalog_cache is not None:
+            return _catalog_cache
+        version = f"{_catalog_boot_id}-{_catalog_counter}"
+    games = [_project_game(g) for g in _backend.get_all_games().values()]
+    with _catalog_lock:
+        # 組列表期間沒有新的異動才寫入快取
+        if version == f"{_catalog_boot_id}-{_catalog_counter}":
+            _catalog_cache = (version, games)
+    return version, games
+
+def get_game_info(game_id):
+    """單一遊戲的詳細資訊 (給商城詳細頁)，不含伺服器上的路徑與執行檔"""
+    game = _backend.get_game(game_id)
+    if not game:
+        return None
+    for field in ("path", "server_exe", "client_exe"):
+        game.pop(field, None)
+    return game
+
 def get_all_games():
-    """回傳所有遊戲列表 (包含評分)"""
-    with game_lock:
-        with open(GAME_DB_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
+    """回傳所有遊戲列表 (包含評分統計，評論請用 list_reviews 分頁取得)"""
+    return _backend.get_all_games()
 
 def add_or_update_game(game_id, manifest_data, relative_path, uploader_name):
     """
     當開發者上傳成功後，呼叫此函式更新資料庫
-    """
-    with game_lock:
-        # 1. 讀取舊資料
-        with open(GAME_DB_FILE, 'r', encoding='utf-8') as f:
-            games = json.load(f)
-        
-        # 2. 準備新資料
-        # 如果遊戲已存在，保留舊的評論；如果是新遊戲，初始化評論列表
-        if game_id in games:
-            old_data = games[game_id]
-            reviews = old_data.get("reviews", [])
-            avg_rating = old_data.get("average_rating", 0.0)
-        else:
-            reviews = []
-            avg_rating = 0.0
-
-        # 更新欄位 (版本、路徑可能變了)
-        games[game_id] = {
-            "game_id": game_id,
-            "version": manifest_data.get("version", "1.0"),
-            "description": manifest_data.get("description", ""),
-            "min_players": manifest_data.get("min_players", 1),
-            "max_players": manifest_data.get("max_players", 4),
-            "server_exe": manifest_data.get("server_exe"), # 重要：啟動時需要
-            "client_exe": manifest_data.get("client_exe"), # 重要：下載時需要
-            "update_patch": manifest_data.get("update_patch", ""),
-            "type": manifest_data.get("type", ""),
-            # 系統維護欄位
-            "status": "available", # 可用/不可用
-            "uploader": uploader_name,
-            "path": relative_path, # 存例如: games/snake/1.0
-            "upload_time": time.strftime("%Y-%m-%d %H:%M:%S"),
-            
-            # 保留評分數據
-            "reviews": reviews,
-            "average_rating": avg_rating
-        }
-        
-        # 3. 寫回檔案
-        with open(GAME_DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(games, f, indent=4, ensure_ascii=False)
-            
+    如果遊戲已存在，後端會保留舊的評論與評分
+    """
+    # 更新欄位 (版本、路徑可能變了)
+    _backend.add_or_update_game(game_id, {
+        "game_id": game_id,
+        "version": manifest_data.get("version", "1.0"),
+        "description": manifest_data.get("description", ""),
+        "min_players": manifest_data.get("min_players", 1),
+        "max_players": manifest_data.get("max_players", 4),
+        "server_exe": manifest_data.get("server_exe"), # 重要：啟動時需要
+        "client_exe": manifest_data.get("client_exe"), # 重要：下載時需要
+        "update_patch": manifest_data.get("update_patch", ""),
+        "type": manifest_data.get("type", ""),
+        # 系統維護欄位
+        "status": "available", # 可用/不可用
+        "uploader": uploader_name,
+        "path": relative_path, # 存例如: games/snake/1.0
+        "upload_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+    _bump_catalog()
+
     print(f"[DB] Game '{game_id}' updated in database.")
 
 def add_review(game_id, player_name, score, comment):
     """
     玩家評分與留言
     """
-    with game_lock:
-        with open(GAME_DB_FILE, 'r', encoding='utf-8') as f:
-            games = json.load(f)
-            
-        if game_id not in games:
-            return False # 遊戲不存在
-            
-        # 新增評論
-        new_review = {
-            "user": player_name,
-            "score": score,
-            "comment": comment,
-            "time": time.strftime("%Y-%m-%d %H:%M:%S")
-        }
-        games[game_id]["reviews"].append(new_review)
-        
-        # 重新計算平均分數
-        reviews = games[game_id]["reviews"]
-        total_score = sum(r["score"] for r in reviews)
-        games[game_id]["average_rating"] = round(total_score / len(reviews), 1)
-        
-        with open(GAME_DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(games, f, indent=4, ensure_ascii=False)
-            
-        return True
+    new_review = {
+        "user": player_name,
+        "score": score,
+        "comment": comment,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+    success = _backend.add_review(game_id, new_review)
+    if success:
+        _bump_catalog() # 平均分數變了
+    return success
 
-def register_user(username, password, role="player"):
+def list_reviews(game_id, cursor=None, limit=5):
     """
-    role: 'player' or 'developer'
-    回傳: True (成功), False (帳號已存在)
+    由新到舊分頁列出遊戲評論
+    cursor: 上一頁回傳的 next_cursor (第一頁給 None)
+    回傳: (評論列表, next_cursor)，沒有下一頁時 next_cursor 為 None
     """
-    with user_lock: # 鎖定
-        with open(USER_DB_FILE, 'r') as f:
-            data = json.load(f)
-        
-        # 決定要存哪區
-        group = "players" if role == "player" else "developers"
-        
-        # 檢查重複
-        if username in data[group]:
-            return False 
-        
-        # 寫入
-        if role == "player":
-            data[group][username] = {
-                "password": password,
-                "game_records": [],  # 紀錄玩家的遊戲結果
-                "status": "offline"  # 玩家狀態
-            }
-        else:
-            data[group][username] = {
-                "password": password,
-                "status": "offline"  # 開發者狀態
-            }
-        
-        with open(USER_DB_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-        return True
+    return _backend.list_reviews(game_id, cursor, limit)
 
-def verify_login(username, password, role="player"):
-    with user_lock:
-        with open(USER_DB_FILE, 'r') as f:
-            data = json.load(f)
-            
-        group = "players" if role == "player" else "developers"
-        
-        # 檢查帳密
-        if username in data[group] and isinstance(data[group][username], dict):
-            if data[group][username].get("password") == password:
-                if data[group][username].get("status") != "online":
-                    data[group][username]["status"] = "online"
-                    with open(USER_DB_FILE, 'w') as f:
-                        json.dump(data, f, indent=4)
-                    return True
-        return False
-    
-def player_exit(username, role="player"):
-    with user_lock:
-        with open(USER_DB_FILE, 'r') as f:
-            data = json.load(f)
-        
-        # 尋找目前在線的玩家或開發者，並設為離線
-        group = "players" if role == "player" else "developers"
-        if username in data[group]:
-            data[group][username]["status"] = "offline"
-        
-        with open(USER_DB_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-
-def create_room_in_db(room_id, game_id, host_name, max_players):
-    with room_lock:
-        with open(ROOM_DB_FILE, 'r') as f:
-            rooms = json.load(f)
-        
-        rooms[str(room_id)] = {
-            "id": room_id,
-            "game_id": game_id,
-            "host": host_name,
-            "status": "Waiting",
-            "max_players": max_players,
-            "players": [host_name], # 只存名字 (String)，不存 Socket
-            "ready_players": []
-        }
-        
-        with open(ROOM_DB_FILE, 'w') as f:
-            json.dump(rooms, f, indent=4)
-
-def get_room_info(room_id):
-    with room_lock:
-        with open(ROOM_DB_FILE, 'r') as f:
-            rooms = json.load(f)
-        return rooms.get(str(room_id))
-
-def get_all_rooms():
-    with room_lock:
-        with open(ROOM_DB_FILE, 'r') as f:
-            return json.load(f)
-
-def join_room_in_db(room_id, player_name):
-    """
-    回傳: (Success: bool, Message: str)
-    """
-    with room_lock:
-        with open(ROOM_DB_FILE, 'r') as f:
-            rooms = json.load(f)
-        
-        rid = str(room_id)
-        if rid not in rooms:
-            return False, "Room not found"
-        
-        room = rooms[rid]
-        if len(room['players']) >= room['max_players']:
-            return False, "Room is full"
-        if room['status'] != "Waiting":
-            return False, "Game already started"
-        if player_name in room['players']:
-            return False, "Already in room"
-
-        # 加入玩家
-        room['players'].append(player_name)
-        
-        with open(ROOM_DB_FILE, 'w') as f:
-            json.dump(rooms, f, indent=4)
-            
-        return True, "Joined successfully"
-    
-def update_room_status(room_id, status, game_port=None):
-    with room_lock:
-        with open(ROOM_DB_FILE, 'r') as f:
-            rooms = json.load(f)
-        
-        rid = str(room_id)
-        if rid in rooms:
-            rooms[rid]['status'] = status
-            if game_port:
-                rooms[rid]['port'] = game_port
-            
-            with open(ROOM_DB_FILE, 'w') as f:
-                json.dump(rooms, f, indent=4)
-
-def remove_player_from_room(room_id, player_name):
-    """
-    玩家離開或斷線。如果房主離開更換房主，回傳 'player_left'
-    """
-    with room_lock:
-        with open(ROOM_DB_FILE, 'r') as f:
-            rooms = json.load(f)
-        
-        rid = str(room_id)
-        if rid not in rooms:
-            return "not_found"
-            
-        room = rooms[rid]
-        
-        if player_name in room['players']:
-            room['players'].remove(player_name)
-        
-        result = "player_left"
-        
-        if room['host'] == player_name:
-            # 房主離開，指定新房主
-            if room['players']:
-                room['host'] = room['players'][0] # 指定第一個玩家為新房主
-                result = "host_changed"
-                
-        # 檢查: 如果沒人了，或房主離開 -> 刪除房間
-        if not room['players']:
-            del rooms[rid]
-            result = "room_closed"
-        else:
-            # 寫回更新後的房間資料
-             pass # Python 的 dict 是 reference，只要最後 dump rooms 即可
-             
-        with open(ROOM_DB_FILE, 'w') as f:
-            json.dump(rooms, f, indent=4)
-            
-        return result
-    
 def remove_game(game_id, uploader_name):
     """
     刪除遊戲資料與檔案
     回傳: True (成功), False (失敗)
     """
     with game_lock:
-        with open(GAME_DB_FILE, 'r', encoding='utf-8') as f:
-            games = json.load(f)
-        
-        if game_id not in games:
+        game = _backend.get_game(game_id)
+        if not game:
             return False
-        
-        game = games[game_id]
-        
+
         # 確認是上傳者在刪除
         if game['uploader'] != uploader_name:
             return False
-        
+
         # 刪除遊戲檔案
         if not os.path.exists(game['path']):
             print(f"[Warning] Game path '{game_id}' does not exist.")
             return False
-        
+
         version_path = game['path']
-        parts = version_path.split("\\")
-        game_path = "\\".join(parts[:2])  # 遊戲主目錄
-        
+        game_path = os.path.dirname(os.path.normpath(version_path))  # 遊戲主目錄 (含下載檔快取)
+
         if os.path.exists(game_path):
             shutil.rmtree(game_path)
         else:
             print(f"[Warning] Game directory '{game_id}' does not exist.")
             return False
-        
+
         # 刪除資料庫中的遊戲記錄
-        del games[game_id]
-        
-        with open(GAME_DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(games, f, indent=4, ensure_ascii=False)
-        
-        print(f"[DB] Game '{game_id}' removed from database.")
-        return True
-
-def add_player_ready(room_id, player_name):
-    with room_lock:
-        with open(ROOM_DB_FILE, 'r') as f:
-            rooms = json.load(f)
-        
-        rid = str(room_id)
-        if rid in rooms:
-            room = rooms[rid]
-            if 'ready_players' not in room:
-                room['ready_players'] = []
-            if player_name not in room['ready_players']:
-                room['ready_players'].append(player_name)
-            
-            with open(ROOM_DB_FILE, 'w') as f:
-                json.dump(rooms, f, indent=4)
-
-def remove_player_ready(room_id):
-    with room_lock:
-        with open(ROOM_DB_FILE, 'r') as f:
-            rooms = json.load(f)
-        
-        rid = str(room_id)
-        if rid in rooms:
-            room = rooms[rid]
-            #移除所有玩家準備狀態
-            if 'ready_players' in room:
-                room['ready_players'] = []
-            
-            with open(ROOM_DB_FILE, 'w') as f:
-                json.dump(rooms, f, indent=4)
+        _backend.delete_game(game_id)
+        _bump_catalog()
+
+    print(f"[DB] Game '{game_id}' removed from database.")
+    return True
+
+def change_game_status(game_id, new_status):
+    """
+    更改遊戲的狀態 (例如: 可用/不可用)
+    """
+    success = _backend.change_game_status(game_id, new_status)
+    if success:
+        _bump_catalog()
+    return success
+
+# --- 使用者相關功能 ---
+
+def register_user(username, password, role="player"):
+    """
+    role: 'player' or 'developer'
+    回傳: True (成功), False (帳號已存在)
+    """
+    # 決定要存哪區
+    group = "players" if role == "player" else "developers"
+    return _backend.register_user(username, password, group)
+
+def verify_login(username, password, role="player"):
+    group = "players" if role == "player" else "developers"
+    return _backend.verify_login(username, password, group)
+
+def player_exit(username, role="player"):
+    # 尋找目前在線的玩家或開發者，並設為離線
+    group = "players" if role == "player" else "developers"
+    _backend.set_offline(username, group)
 
 def record_player_game_record(player_name, game_id, result):
     """
     紀錄玩家的遊戲結果
     result: 'win' or 'lose' or 'draw'
     """
-    with user_lock:
-        with open(USER_DB_FILE, 'r') as f:
-            data = json.load(f)
-        
-        if player_name not in data['players']:
-            return False
-        
-        player_data = data['players'][player_name]
-        if 'game_records' not in player_data:
-            player_data['game_records'] = []
-        
-        record = {
-            "game_id": game_id,
-            "result": result,
-            "time": time.strftime("%Y-%m-%d %H:%M:%S")
-        }
-        player_data['game_records'].append(record)
-        
-        with open(USER_DB_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-        
-        return True
+    record = {
+        "game_id": game_id,
+        "result": result,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+    return _backend.record_player_game_record(player_name, record)
 
 def get_player_game_records(player_name):
     """
     取得玩家的遊戲紀錄列表
     """
-    with user_lock:
-        with open(USER_DB_FILE, 'r') as f:
-            data = json.load(f)
-        
-        if player_name not in data['players']:
-            return []
-        
-        player_data = data['players'][player_name]
-        return player_data.get('game_records', [])
-
-def change_game_status(game_id, new_status):
-    """
-    更改遊戲的狀態 (例如: 可用/不可用)
-    """
-    with game_lock:
-        with open(GAME_DB_FILE, 'r', encoding='utf-8') as f:
-            games = json.load(f)
-        
-        if game_id not in games:
-            return False
-        
-        games[game_id]['status'] = new_status
-        
-        with open(GAME_DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(games, f, indent=4, ensure_ascii=False)
-        
-        return True
\ No newline at end of file
+    return _backend.get_player_game_records(player_name)
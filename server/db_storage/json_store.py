@@ -0,0 +1,396 @@
+import json
+import threading
+import os
+import shutil
+import bisect
+
+from config import DB_FLUSH_INTERVAL, JOURNAL_COMPACT_BYTES, JOURNAL_FSYNC
+
+# JSON 檔案後端：資料常駐記憶體
+# 每次異動只在 journal.log 後面追加一行小紀錄 (寫入成本只跟這次改動有關)，
+# 累積超過 JOURNAL_COMPACT_BYTES 後由背景執行緒把記憶體內容寫成快照 (users.json / games.json / reviews.json) 並清空 journal
+# 啟動時: 讀快照 -> 重播 journal 裡比快照新的紀錄
+
+# 檔案路徑
+USER_DB_FILE = "server_data/users.json"
+GAME_DB_FILE = "server_data/games.json"
+REVIEW_DB_FILE = "server_data/reviews.json" # 評論跟遊戲目錄分開存，game_id -> [review, ...] (依 id 遞增)
+JOURNAL_FILE = "server_data/journal.log"
+OLD_JOURNAL_FILE = JOURNAL_FILE + ".old" # 壓縮進行中，尚未被快照吸收的舊 journal
+
+# 快照裡記錄「已包含到第幾號 journal 紀錄」的欄位，讀檔時會移除
+SEQ_KEY = "__journal_seq__"
+
+# 鎖 (分別鎖定，提升效能)
+# 上鎖順序固定為 user_lock -> game_lock -> _journal_lock，避免死結
+user_lock = threading.Lock()
+game_lock = threading.Lock()  # 遊戲與評論共用
+_journal_lock = threading.Lock()
+_compact_lock = threading.Lock()
+
+_users = {"developers": {}, "players": {}}
+_games = {}
+_reviews = {}
+_next_review_id = 1
+
+_journal = None       # 目前 journal 的檔案物件
+_journal_seq = 0      # 最後一筆紀錄的編號
+_journal_unsynced = False
+
+_stop_compactor = threading.Event()
+_compactor = None
+
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def load_snapshot(path, default):
+    """讀快照，回傳 (資料, 快照對應的 journal 編號)"""
+    data = load_json(path, default)
+    seq = data.pop(SEQ_KEY, 0)
+    return data, seq
+
+def _atomic_write(path, text):
+    # 先寫暫存檔再 rename，避免寫到一半當機留下壞掉的 JSON
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# --- journal ---
+
+def _append(record):
+    """
+    追加一筆 journal 紀錄，呼叫端必須持有該集合的鎖
+    這樣同一個集合的紀錄順序會跟記憶體套用的順序一致
+    """
+    global _journal_seq, _journal_unsynced
+    with _journal_lock:
+        _journal_seq += 1
+        record["seq"] = _journal_seq
+        _journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        _journal.flush()
+        if JOURNAL_FSYNC:
+            os.fsync(_journal.fileno())
+        else:
+            _journal_unsynced = True
+
+# 每種紀錄會動到哪些集合 (重播時跟各集合快照的編號比較)
+_OP_COLLECTIONS = {
+    "register": {"users"}, "game_record": {"users"},
+    "upsert_game": {"games"}, "game_status": {"games"},
+    "review": {"games", "reviews"}, "delete_game": {"games", "reviews"},
+}
+
+def _apply(state, record, skip=()):
+    """
+    把一筆紀錄套用到記憶體中的資料 (寫入與重播共用)
+    state: {"users": ..., "games": ..., "reviews": ...}
+    skip: 重播時快照已經包含這筆紀錄的集合
+    """
+    users, games, reviews = state["users"], state["games"], state["reviews"]
+    op = record["op"]
+    if _OP_COLLECTIONS[op].issubset(skip):
+        return
+    if op == "register":
+        users[record["group"]][record["username"]] = record["user"]
+    elif op == "game_record":
+        player = users["players"].get(record["player"])
+        if player is not None:
+            player.setdefault("game_records", []).append(record["record"])
+    elif op == "upsert_game":
+        game = dict(record["game"])
+        # 如果遊戲已存在，保留舊的評分統計；如果是新遊戲，從 0 開始
+        old_data = games.get(game["game_id"], {})
+        game["rating_sum"] = old_data.get("rating_sum", 0)
+        game["rating_count"] = old_data.get("rating_count", 0)
+        game["average_rating"] = old_data.get("average_rating", 0.0)
+        games[game["game_id"]] = game
+    elif op == "review":
+        review = record["review"]
+        game = games.get(record["game_id"])
+        if game is not None and "games" not in skip:
+            # 只累加，不必每次重新加總所有評論
+            game["rating_sum"] += review["score"]
+            game["rating_count"] += 1
+            game["average_rating"] = round(game["rating_sum"] / game["rating_count"], 1)
+        if "reviews" not in skip:
+            reviews.setdefault(record["game_id"], []).append(review)
+    elif op == "game_status":
+        if record["game_id"] in games:
+            games[record["game_id"]]["status"] = record["status"]
+    elif op == "delete_game":
+        if "games" not in skip:
+            games.pop(record["game_id"], None)
+        if "reviews" not in skip:
+            reviews.pop(record["game_id"], None)
+
+def _replay(path, state, snapshot_seq):
+    """重播 journal，回傳最後一筆紀錄的編號"""
+    last_seq = 0
+    if not os.path.exists(path):
+        return last_seq
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 當機時寫到一半的最後一行，直接忽略
+                print(f"[DB Warning] Skipping torn journal record in {path}")
+                break
+            last_seq = max(last_seq, record["seq"])
+            skip = {name for name, seq in snapshot_seq.items() if record["seq"] <= seq}
+            if not _OP_COLLECTIONS[record["op"]].issubset(skip):
+                if record["op"] == "review" and "id" not in record["review"]:
+                    # 舊版 journal 的評論沒有編號，接在目前最大的編號後面
+                    record["review"]["id"] = _max_review_id(state["reviews"]) + 1
+                _apply(state, record, skip)
+    return last_seq
+
+def _max_review_id(reviews):
+    return max((rs[-1]["id"] for rs in reviews.values() if rs), default=0)
+
+def _split_legacy_reviews(games, reviews, move_reviews):
+    """
+    舊版 games.json 把評論存在遊戲底下：補上評分統計，並在還沒有 reviews.json 時把評論搬到獨立的評論表
+    (reviews.json 已存在代表搬過了，只是 games.json 還沒來得及改寫)
+    """
+    next_id = _max_review_id(reviews) + 1
+    for game_id, game in games.items():
+        legacy = game.pop("reviews", None)
+        if legacy is None:
+            continue
+        scores = [r["score"] for r in legacy]
+        game["rating_sum"] = sum(scores)
+        game["rating_count"] = len(scores)
+        game["average_rating"] = round(sum(scores) / len(scores), 1) if scores else 0.0
+        if move_reviews:
+            for review in legacy:
+                reviews.setdefault(game_id, []).append(dict(review, id=next_id))
+                next_id += 1
+
+def load_state():
+    """讀快照並重播 journal，回傳目前完整的 (state, 最後紀錄編號)"""
+    users, users_seq = load_snapshot(USER_DB_FILE, {"developers": {}, "players": {}})
+    games, games_seq = load_snapshot(GAME_DB_FILE, {})
+    reviews, reviews_seq = load_snapshot(REVIEW_DB_FILE, {})
+    has_review_file = os.path.exists(REVIEW_DB_FILE)
+    if not has_review_file:
+        # 還沒有 reviews.json 代表是舊格式，評論全部都在 games.json 裡
+        reviews_seq = games_seq
+    _split_legacy_reviews(games, reviews, move_reviews=not has_review_file)
+    state = {"users": users, "games": games, "reviews": reviews}
+    snapshot_seq = {"users": users_seq, "games": games_seq, "reviews": reviews_seq}
+    last_seq = max(snapshot_seq.values())
+    for path in (OLD_JOURNAL_FILE, JOURNAL_FILE):
+        last_seq = max(last_seq, _replay(path, state, snapshot_seq))
+    return state, last_seq
+
+def _state():
+    return {"users": _users, "games": _games, "reviews": _reviews}
+
+# --- 快照壓縮 ---
+
+def compact():
+    """把目前記憶體內容寫成快照，並丟掉已被快照吸收的 journal"""
+    global _journal
+    with _compact_lock:
+        with user_lock, game_lock, _journal_lock:
+            seq = _journal_seq
+            users_text = json.dumps(dict(_users, **{SEQ_KEY: seq}), indent=4, ensure_ascii=False)
+            games_text = json.dumps(dict(_games, **{SEQ_KEY: seq}), indent=4, ensure_ascii=False)
+            reviews_text = json.dumps(dict(_reviews, **{SEQ_KEY: seq}), indent=4, ensure_ascii=False)
+            # 換一個新的 journal，之後的寫入不必等快照寫完
+            _journal.close()
+            if os.path.exists(OLD_JOURNAL_FILE):
+                # 上次壓縮失敗留下的舊 journal 還沒被快照吸收，接在後面而不是覆蓋
+                with open(JOURNAL_FILE, 'rb') as src, open(OLD_JOURNAL_FILE, 'ab') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(JOURNAL_FILE)
+            else:
+                os.replace(JOURNAL_FILE, OLD_JOURNAL_FILE)
+            _journal = open(JOURNAL_FILE, 'a', encoding='utf-8')
+
+        _atomic_write(USER_DB_FILE, users_text)
+        # 先寫評論再寫遊戲：從舊格式升級時，games.json 改寫前 reviews.json 一定已經存在
+        _atomic_write(REVIEW_DB_FILE, reviews_text)
+        _atomic_write(GAME_DB_FILE, games_text)
+        os.remove(OLD_JOURNAL_FILE)
+    print(f"[DB] Journal compacted into snapshot (seq={seq}).")
+
+def _compact_loop():
+    global _journal_unsynced
+    while not _stop_compactor.wait(DB_FLUSH_INTERVAL):
+        try:
+            # 沒有每筆 fsync 時，最多每 DB_FLUSH_INTERVAL 秒落地一次
+            with _journal_lock:
+                if _journal_unsynced:
+                    os.fsync(_journal.fileno())
+                    _journal_unsynced = False
+                journal_size = _journal.tell()
+            if journal_size > JOURNAL_COMPACT_BYTES:
+                compact()
+        except Exception as e:
+            print(f"[DB Error] Journal compaction failed: {e}")
+
+def open_store():
+    global _users, _games, _reviews, _next_review_id, _journal, _journal_seq, _compactor
+    with user_lock, game_lock, _journal_lock:
+        state, _journal_seq = load_state()
+        _users, _games, _reviews = state["users"], state["games"], state["reviews"]
+        _next_review_id = _max_review_id(_reviews) + 1
+        _journal = open(JOURNAL_FILE, 'a', encoding='utf-8')
+    # 啟動時先壓縮一次，讓 journal 從空的開始
+    compact()
+
+    if _compactor is None:
+        _stop_compactor.clear()
+        _compactor = threading.Thread(target=_compact_loop, daemon=True)
+        _compactor.start()
+
+def flush():
+    global _journal_unsynced
+    with _journal_lock:
+        if _journal is not None:
+            _journal.flush()
+            os.fsync(_journal.fileno())
+            _journal_unsynced = False
+
+def close_store():
+    """停止背景執行緒，寫一份最新快照後關閉 journal"""
+    global _compactor, _journal
+    _stop_compactor.set()
+    if _compactor is not None:
+        _compactor.join()
+        _compactor = None
+    compact()
+    with _journal_lock:
+        _journal.close()
+        _journal = None
+
+def reset_online_status():
+    # 上線狀態每次啟動都會重設，所以只改記憶體，不寫 journal
+    with user_lock:
+        for role in ['developers', 'players']:
+            for username in _users[role]:
+                _users[role][username]['status'] = 'offline'
+
+# --- 遊戲相關功能 ---
+
+def get_all_games():
+    # 目錄只有遊戲本身與評分統計，不含評論，dict 複製一層就夠了
+    with game_lock:
+        return {gid: dict(g) for gid, g in _games.items()}
+
+def get_game(game_id):
+    with game_lock:
+        game = _games.get(game_id)
+        return dict(game) if game else None
+
+def add_or_update_game(game_id, game_data):
+    record = {"op": "upsert_game", "game": game_data}
+    with game_lock:
+        _apply(_state(), record)
+        _append(record)
+
+def add_review(game_id, review):
+    global _next_review_id
+    with game_lock:
+        if game_id not in _games:
+            return False # 遊戲不存在
+        review = dict(review, id=_next_review_id)
+        _next_review_id += 1
+        record = {"op": "review", "game_id": game_id, "review": review}
+        _apply(_state(), record)
+        _append(record)
+    return True
+
+def list_reviews(game_id, cursor=None, limit=5):
+    """
+    由新到舊列出評論，cursor 為上一頁最後一則的 id (不含)
+    回傳: (評論列表, 下一頁的 cursor 或 None)
+    """
+    with game_lock:
+        reviews = _reviews.get(game_id, [])
+        # 評論依 id 遞增排列，用二分搜尋找到 cursor 的位置
+        end = len(reviews) if cursor is None else bisect.bisect_left(reviews, cursor, key=lambda r: r["id"])
+        page = reviews[max(0, end - limit):end][::-1]
+    next_cursor = page[-1]["id"] if page and end > limit else None
+    return [dict(r) for r in page], next_cursor
+
+def delete_game(game_id):
+    record = {"op": "delete_game", "game_id": game_id}
+    with game_lock:
+        if game_id not in _games:
+            return False
+        _apply(_state(), record)
+        _append(record)
+    return True
+
+def change_game_status(game_id, new_status):
+    record = {"op": "game_status", "game_id": game_id, "status": new_status}
+    with game_lock:
+        if game_id not in _games:
+            return False
+        _apply(_state(), record)
+        _append(record)
+    return True
+
+# --- 使用者相關功能 ---
+
+def register_user(username, password, group):
+    if group == "players":
+        user = {
+            "password": password,
+            "game_records": [],  # 紀錄玩家的遊戲結果
+            "status": "offline"  # 玩家狀態
+        }
+    else:
+        user = {
+            "password": password,
+            "status": "offline"  # 開發者狀態
+        }
+    record = {"op": "register", "group": group, "username": username, "user": user}
+    with user_lock:
+        # 檢查重複
+        if username in _users[group]:
+            return False
+        _apply(_state(), record)
+        _append(record)
+    return True
+
+def verify_login(username, password, group):
+    with user_lock:
+        # 檢查帳密
+        if username in _users[group] and isinstance(_users[group][username], dict):
+            if _users[group][username].get("password") == password:
+                if _users[group][username].get("status") != "online":
+                    _users[group][username]["status"] = "online"
+                    return True
+        return False
+
+def set_offline(username, group):
+    with user_lock:
+        if username in _users[group]:
+            _users[group][username]["status"] = "offline"
+
+def record_player_game_record(player_name, record):
+    journal_record = {"op": "game_record", "player": player_name, "record": record}
+    with user_lock:
+        if player_name not in _users['players']:
+            return False
+        _apply(_state(), journal_record)
+        _append(journal_record)
+    return True
+
+def get_player_game_records(player_name):
+    with user_lock:
+        if player_name not in _users['players']:
+            return []
+
+        player_data = _users['players'][player_name]
+        return list(player_data.get('game_records', []))
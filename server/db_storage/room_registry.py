@@ -0,0 +1,159 @@
+import json
+import threading
+
+# 房間是暫時性的資料 (Server 重開就沒了)，所以直接放在記憶體，不經過檔案
+# 上鎖順序: 只會在持有 room.lock 時去拿 registry 的鎖，反過來不行，避免死結
+
+class Room:
+    def __init__(self, room_id, game_id, host_name, max_players):
+        self.id = room_id
+        self.game_id = game_id
+        self.host = host_name
+        self.status = "Waiting"
+        self.max_players = max_players
+        self.players = [host_name] # 只存名字 (String)，不存 Socket
+        self.ready_players = []
+        self.port = None
+        self.closed = False        # 已被刪除 (最後一人離開)
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        """回傳跟以前 rooms.json 相同格式的副本"""
+        with self.lock:
+            info = {
+                "id": self.id,
+                "game_id": self.game_id,
+                "host": self.host,
+                "status": self.status,
+                "max_players": self.max_players,
+                "players": list(self.players),
+                "ready_players": list(self.ready_players)
+            }
+            if self.port:
+                info["port"] = self.port
+            return info
+
+
+class RoomRegistry:
+    def __init__(self):
+        self._rooms = {}  # room_id (str) -> Room
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def get(self, room_id):
+        """O(1) 查房間物件，找不到回傳 None"""
+        return self._rooms.get(str(room_id))
+
+    def create(self, game_id, host_name, max_players):
+        """建立房間並回傳新的房間 ID"""
+        with self._lock:
+            room_id = str(self._next_id)
+            self._next_id += 1
+            self._rooms[room_id] = Room(room_id, game_id, host_name, max_players)
+        return room_id
+
+    def info(self, room_id):
+        room = self.get(room_id)
+        return room.to_dict() if room else None
+
+    def list_info(self):
+        with self._lock:
+            rooms = list(self._rooms.values())
+        return [room.to_dict() for room in rooms]
+
+    def player_names(self, room_id):
+        room = self.get(room_id)
+        if not room:
+            return []
+        with room.lock:
+            return list(room.players)
+
+    def has_game(self, game_id):
+        """是否有房間正在使用這個遊戲"""
+        with self._lock:
+            return any(room.game_id == game_id for room in self._rooms.values())
+
+    def join(self, room_id, player_name):
+        """
+        回傳: (Success: bool, Message: str)
+        """
+        room = self.get(room_id)
+        if not room:
+            return False, "Room not found"
+        with room.lock:
+            if room.closed:
+                return False, "Room not found"
+            if len(room.players) >= room.max_players:
+                return False, "Room is full"
+            if room.status != "Waiting":
+                return False, "Game already started"
+            if player_name in room.players:
+                return False, "Already in room"
+
+            # 加入玩家
+            room.players.append(player_name)
+        return True, "Joined successfully"
+
+    def set_status(self, room_id, status, game_port=None):
+        room = self.get(room_id)
+        if room:
+            with room.lock:
+                room.status = status
+                if game_port:
+                    room.port = game_port
+
+    def leave(self, room_id, player_name):
+        """
+        玩家離開或斷線。回傳 'player_left' / 'host_changed' / 'room_closed' / 'not_found'
+        """
+        room = self.get(room_id)
+        if not room:
+            return "not_found"
+        with room.lock:
+            if room.closed:
+                return "not_found"
+
+            if player_name in room.players:
+                room.players.remove(player_name)
+            if player_name in room.ready_players:
+                room.ready_players.remove(player_name)
+
+            result = "player_left"
+
+            if room.host == player_name:
+                # 房主離開，指定新房主
+                if room.players:
+                    room.host = room.players[0] # 指定第一個玩家為新房主
+                    result = "host_changed"
+
+            # 檢查: 如果沒人了 -> 刪除房間
+            if not room.players:
+                room.closed = True
+                with self._lock:
+                    self._rooms.pop(room.id, None)
+                result = "room_closed"
+        return result
+
+    def add_ready(self, room_id, player_name):
+        room = self.get(room_id)
+        if room:
+            with room.lock:
+                if player_name not in room.ready_players:
+                    room.ready_players.append(player_name)
+
+    def clear_ready(self, room_id):
+        room = self.get(room_id)
+        if room:
+            with room.lock:
+                #移除所有玩家準備狀態
+                room.ready_players = []
+
+    def dump_snapshot(self, path):
+        """除錯用：把目前所有房間寫成 JSON (格式同以前的 rooms.json)"""
+        snapshot = {room["id"]: room for room in self.list_info()}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, indent=4, ensure_ascii=False)
+
+
+# 整個 Server 共用的房間表
+room_registry = RoomRegistry()
@@ -0,0 +1,254 @@
+import sqlite3
+import threading
+import os
+
+from db_storage.json_store import USER_DB_FILE, GAME_DB_FILE, JOURNAL_FILE, load_state
+
+# SQLite 後端：每筆異動只改動相關的列，不必整份重寫
+SQLITE_DB_FILE = "server_data/platform.db"
+
+_local = threading.local()       # 每個執行緒各自一條連線
+_connections = []                # [(執行緒, 連線)]，關閉時由呼叫 close_store 的執行緒一起收掉
+_connections_lock = threading.Lock()
+_generation = 0                  # close_store 後加一，各執行緒手上的舊連線就不再使用
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    status   TEXT NOT NULL DEFAULT 'offline'
+);
+CREATE TABLE IF NOT EXISTS developers (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    status   TEXT NOT NULL DEFAULT 'offline'
+);
+CREATE TABLE IF NOT EXISTS games (
+    game_id        TEXT PRIMARY KEY,
+    version        TEXT,
+    description    TEXT,
+    min_players    INTEGER,
+    max_players    INTEGER,
+    server_exe     TEXT,
+    client_exe     TEXT,
+    update_patch   TEXT,
+    type           TEXT,
+    status         TEXT,
+    uploader       TEXT,
+    path           TEXT,
+    upload_time    TEXT,
+    rating_sum     INTEGER NOT NULL DEFAULT 0,
+    rating_count   INTEGER NOT NULL DEFAULT 0,
+    average_rating REAL NOT NULL DEFAULT 0.0
+);
+CREATE INDEX IF NOT EXISTS idx_games_uploader ON games(uploader);
+CREATE TABLE IF NOT EXISTS reviews (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_id TEXT NOT NULL,
+    user    TEXT,
+    score   INTEGER,
+    comment TEXT,
+    time    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_reviews_game ON reviews(game_id, id);
+CREATE TABLE IF NOT EXISTS game_records (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    player  TEXT NOT NULL,
+    game_id TEXT,
+    result  TEXT,
+    time    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_game_records_player ON game_records(player, id);
+"""
+
+GAME_COLUMNS = ["game_id", "version", "description", "min_players", "max_players",
+                "server_exe", "client_exe", "update_patch", "type", "status",
+                "uploader", "path", "upload_time"]
+
+def _conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.generation != _generation:
+        # 連線只給建立它的執行緒用；關閉時可能由別的執行緒收掉，所以不檢查同一執行緒
+        conn = sqlite3.connect(SQLITE_DB_FILE, timeout=10.0, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _connections_lock:
+            # 工作執行緒會結束 (閒置太多時)，順便收掉已結束執行緒留下的連線
+            alive = []
+            for thread, old_conn in _connections:
+                if thread.is_alive():
+                    alive.append((thread, old_conn))
+                else:
+                    old_conn.close()
+            alive.append((threading.current_thread(), conn))
+            _connections[:] = alive
+            _local.conn = conn
+            _local.generation = _generation
+    return conn
+
+def _user_table(group):
+    # group 只會是 players / developers，不接受外部字串拼進 SQL
+    return "players" if group == "players" else "developers"
+
+def open_store():
+    is_new = not os.path.exists(SQLITE_DB_FILE)
+    conn = _conn()
+    conn.executescript(SCHEMA)
+    _upgrade_schema(conn)
+    if is_new and any(os.path.exists(p) for p in (USER_DB_FILE, GAME_DB_FILE, JOURNAL_FILE)):
+        migrate_from_json()
+
+def close_store():
+    global _generation
+    with _connections_lock:
+        for _, conn in _connections:
+            conn.close()
+        _connections.clear()
+        _generation += 1
+    _local.conn = None
+
+def flush():
+    # 每個操作都是自己的交易，commit 後就已落地
+    pass
+
+def _upgrade_schema(conn):
+    """舊版資料庫的 games 表沒有評分統計欄位，補上並從 reviews 表算一次"""
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(games)")}
+    if "rating_count" in columns:
+        return
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("ALTER TABLE games ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0")
+        conn.execute("ALTER TABLE games ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0")
+        conn.execute("UPDATE games SET "
+                     "rating_sum = (SELECT COALESCE(SUM(score), 0) FROM reviews WHERE reviews.game_id = games.game_id), "
+                     "rating_count = (SELECT COUNT(*) FROM reviews WHERE reviews.game_id = games.game_id)")
+        conn.execute("UPDATE games SET average_rating = ROUND(CAST(rating_sum AS REAL) / rating_count, 1) WHERE rating_count > 0")
+
+def migrate_from_json():
+    """一次性把舊的 server_data/*.json (快照 + journal) 匯入 SQLite"""
+    state, _ = load_state()
+    users, games, reviews = state["users"], state["games"], state["reviews"]
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN")
+        for group in ("players", "developers"):
+            for username, info in users.get(group, {}).items():
+                conn.execute(f"INSERT OR REPLACE INTO {_user_table(group)} (username, password, status) VALUES (?, ?, 'offline')",
+                             (username, info.get("password", "")))
+        for username, info in users.get("players", {}).items():
+            for record in info.get("game_records", []):
+                conn.execute("INSERT INTO game_records (player, game_id, result, time) VALUES (?, ?, ?, ?)",
+                             (username, record.get("game_id"), record.get("result"), record.get("time")))
+        for game_id, game in games.items():
+            values = [game.get(col) for col in GAME_COLUMNS]
+            values[0] = game_id
+            conn.execute(f"INSERT OR REPLACE INTO games ({', '.join(GAME_COLUMNS)}, rating_sum, rating_count, average_rating) "
+                         f"VALUES ({', '.join('?' * len(GAME_COLUMNS))}, ?, ?, ?)",
+                         values + [game.get("rating_sum", 0), game.get("rating_count", 0), game.get("average_rating", 0.0)])
+            for review in reviews.get(game_id, []):
+                conn.execute("INSERT INTO reviews (id, game_id, user, score, comment, time) VALUES (?, ?, ?, ?, ?, ?)",
+                             (review["id"], game_id, review.get("user"), review.get("score"), review.get("comment"), review.get("time")))
+    print(f"[DB] Migrated {sum(len(users.get(g, {})) for g in ('players', 'developers'))} users and {len(games)} games from JSON to SQLite.")
+
+def reset_online_status():
+    conn = _conn()
+    conn.execute("UPDATE players SET status = 'offline'")
+    conn.execute("UPDATE developers SET status = 'offline'")
+
+def _game_from_row(row):
+    game = {col: row[col] for col in GAME_COLUMNS}
+    game["rating_sum"] = row["rating_sum"]
+    game["rating_count"] = row["rating_count"]
+    game["average_rating"] = row["average_rating"]
+    return game
+
+def _review_from_row(row):
+    return {"id": row["id"], "user": row["user"], "score": row["score"], "comment": row["comment"], "time": row["time"]}
+
+# --- 遊戲相關功能 ---
+
+def get_all_games():
+    return {row["game_id"]: _game_from_row(row) for row in _conn().execute("SELECT * FROM games")}
+
+def get_game(game_id):
+    row = _conn().execute("SELECT * FROM games WHERE game_id = ?", (game_id,)).fetchone()
+    return _game_from_row(row) if row else None
+
+def add_or_update_game(game_id, game_data):
+    conn = _conn()
+    values = [game_data.get(col) for col in GAME_COLUMNS]
+    # 已存在的遊戲只更新版本資訊，評分與評論保留
+    updates = ", ".join(f"{col} = excluded.{col}" for col in GAME_COLUMNS[1:])
+    conn.execute(f"INSERT INTO games ({', '.join(GAME_COLUMNS)}) VALUES ({', '.join('?' * len(GAME_COLUMNS))}) "
+                 f"ON CONFLICT(game_id) DO UPDATE SET {updates}", values)
+
+def add_review(game_id, review):
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if not conn.execute("SELECT 1 FROM games WHERE game_id = ?", (game_id,)).fetchone():
+            return False # 遊戲不存在
+        conn.execute("INSERT INTO reviews (game_id, user, score, comment, time) VALUES (?, ?, ?, ?, ?)",
+                     (game_id, review["user"], review["score"], review["comment"], review["time"]))
+        # 只累加統計欄位，不必每次重新掃過所有評論
+        conn.execute("UPDATE games SET rating_sum = rating_sum + ?, rating_count = rating_count + 1, "
+                     "average_rating = ROUND(CAST(rating_sum + ? AS REAL) / (rating_count + 1), 1) WHERE game_id = ?",
+                     (review["score"], review["score"], game_id))
+    return True
+
+def list_reviews(game_id, cursor=None, limit=5):
+    conn = _conn()
+    if cursor is None:
+        rows = conn.execute("SELECT * FROM reviews WHERE game_id = ? ORDER BY id DESC LIMIT ?", (game_id, limit + 1))
+    else:
+        rows = conn.execute("SELECT * FROM reviews WHERE game_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                            (game_id, cursor, limit + 1))
+    page = [_review_from_row(r) for r in rows]
+    # 多拿一筆來判斷是否還有下一頁
+    next_cursor = page[limit - 1]["id"] if len(page) > limit else None
+    return page[:limit], next_cursor
+
+def delete_game(game_id):
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+        conn.execute("DELETE FROM reviews WHERE game_id = ?", (game_id,))
+    return cur.rowcount > 0
+
+def change_game_status(game_id, new_status):
+    cur = _conn().execute("UPDATE games SET status = ? WHERE game_id = ?", (new_status, game_id))
+    return cur.rowcount > 0
+
+# --- 使用者相關功能 ---
+
+def register_user(username, password, group):
+    try:
+        _conn().execute(f"INSERT INTO {_user_table(group)} (username, password, status) VALUES (?, ?, 'offline')",
+                        (username, password))
+        return True
+    except sqlite3.IntegrityError:
+        return False # 帳號已存在
+
+def verify_login(username, password, group):
+    # 比對帳密與設為上線在同一個 UPDATE 完成，不會有兩個連線同時登入成功
+    cur = _conn().execute(f"UPDATE {_user_table(group)} SET status = 'online' "
+                          "WHERE username = ? AND password = ? AND status != 'online'", (username, password))
+    return cur.rowcount == 1
+
+def set_offline(username, group):
+    _conn().execute(f"UPDATE {_user_table(group)} SET status = 'offline' WHERE username = ?", (username,))
+
+def record_player_game_record(player_name, record):
+    conn = _conn()
+    if not conn.execute("SELECT 1 FROM players WHERE username = ?", (player_name,)).fetchone():
+        return False
+    conn.execute("INSERT INTO game_records (player, game_id, result, time) VALUES (?, ?, ?, ?)",
+                 (player_name, record["game_id"], record["result"], record["time"]))
+    return True
+
+def get_player_game_records(player_name):
+    rows = _conn().execute("SELECT game_id, result, time FROM game_records WHERE player = ? ORDER BY id", (player_name,))
+    return [{"game_id": r["game_id"], "result": r["result"], "time": r["time"]} for r in rows]
@@ -0,0 +1,256 @@
+"""
+多房間的遊戲 Server (services/game_hosts.py 用)
+
+    python game_host.py --port <port> <server_exe>
+
+一個 process 同時服務同一個遊戲的很多房間，每場比賽只多幾個執行緒與 socket，不用每場一個 Python 直譯器
+遊戲要在 manifest.json 設定 "multi_room": true，server_exe 提供:
+
+    def run_room(clients, players):
+        # clients: 依連線順序排好的 socket (已經湊滿 players 個)
+        # 回傳要回報給 Lobby 的結果字串 (跟單房間模式 end_game 的 result 一樣)
+
+流程:
+- stdin (控制用的 pipe) 一行一個 JSON:
+  {"op": "open", "room_id", "token", "players"} 開房間 / {"op": "cancel", "room_id"} 取消房間
+  stdin 被關閉就不再接新連線，進行中的比賽打完才結束
+- 玩家連進來的第一個封包 (4 bytes 長度 + JSON) 是 {"room_token": ...}，依 token 分配到房間
+- 人數到齊就在新的執行緒跑 run_room，結果從控制通道 (環境變數 GAME_CONTROL_FD) 送回 Lobby:
+  開始 listen 送 {"type": "ready"}、比賽結束送 {"type": "result", "room_id", "result"}、run_room 丟出例外送 {"type": "error", "room_id", "reason"}
+  定期送 {"type": "heartbeat"} 與每個房間的 {"type": "heartbeat", "room_id", "idle"} (idle: 距離玩家上次送資料幾秒，還沒開始就從開房間算起)
+這個檔案在遊戲的資料夾裡執行，不 import 平台的模組 (避免跟遊戲自己的同名模組衝突)
+"""
+import argparse
+import importlib.util
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+# 連線後多久內要送出 room_token
+ROUTE_TIMEOUT = 10
+MAX_TOKEN_FRAME = 4096
+# 多久送一次 heartbeat (Lobby 那邊 GAME_HEARTBEAT_TIMEOUT 秒沒收到就當作 host 掛了)
+HEARTBEAT_INTERVAL = 5
+
+
+def send_json(sock, data):
+    msg = json.dumps(data).encode('utf-8')
+    sock.sendall(struct.pack('!I', len(msg)) + msg)
+
+def recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return bytes(buf)
+
+
+class Room:
+    def __init__(self, room_id, token, players):
+        self.room_id = room_id
+        self.token = token
+        self.players = players
+        self.clients = []
+        self.started = False
+        self.cancelled = False
+        self.last_input = time.monotonic()
+
+
+class TrackedSocket(socket.socket):
+    """交給 run_room 的玩家連線: 收到資料時記下房間最後有動作的時間 (heartbeat 的 idle)"""
+    def __init__(self, room, conn):
+        super().__init__(fileno=conn.detach())
+        self.room = room
+
+    def recv(self, *args):
+        data = super().recv(*args)
+        self.room.last_input = time.monotonic()
+        return data
+
+    def recv_into(self, *args):
+        n = super().recv_into(*args) # makefile() 讀資料也會走這裡
+        self.room.last_input = time.monotonic()
+        return n
+
+
+class ControlChannel:
+    """往 Lobby 的控制通道；不是從平台啟動的 (沒有 GAME_CONTROL_FD) 就只印出來"""
+    def __init__(self):
+        fd = os.environ.get("GAME_CONTROL_FD")
+        self.sock = socket.socket(fileno=int(fd)) if fd else None
+        self.lock = threading.Lock()
+
+    def send(self, msg):
+        if self.sock is None:
+            print(f"[GameHost] {msg}")
+            return
+        with self.lock:
+            try:
+                send_json(self.sock, msg)
+            except OSError:
+                pass # Lobby 關掉了
+
+
+class GameHost:
+    def __init__(self, module, control):
+        self.module = module
+        self.control = control
+        self.lock = threading.Lock()
+        self.rooms = {} # token -> Room
+        self.by_id = {} # room_id -> Room
+
+    def heartbeat_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            self.control.send({"type": "heartbeat"})
+            now = time.monotonic()
+            with self.lock:
+                idle = {room_id: round(now - room.last_input, 1) for room_id, room in self.by_id.items()}
+            for room_id, seconds in idle.items():
+                self.control.send({"type": "heartbeat", "room_id": room_id, "idle": seconds})
+
+    # --- 控制指令 ---
+
+    def open_room(self, room_id, token, players):
+        room = Room(room_id, token, players)
+        with self.lock:
+            self.rooms[token] = room
+            self.by_id[room_id] = room
+
+    def cancel_room(self, room_id):
+        with self.lock:
+            room = self.by_id.pop(room_id, None)
+            if room is None:
+                return
+            self.rooms.pop(room.token, None)
+            room.cancelled = True
+            clients = list(room.clients)
+        # 關掉連線，進行中的比賽會因為斷線自己結束
+        for conn in clients:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def read_control(self, listener):
+        for line in sys.stdin:
+            try:
+                msg = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if msg.get("op") == "open":
+                self.open_room(str(msg["room_id"]), msg["token"], int(msg["players"]))
+            elif msg.get("op") == "cancel":
+                self.cancel_room(str(msg["room_id"]))
+        # Lobby 關掉了 pipe: 不再接新連線 (只 close 叫不醒卡在 accept 的 main，要先 shutdown)
+        try:
+            listener.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        listener.close()
+
+    # --- 玩家連線 ---
+
+    def route(self, conn):
+        """讀第一個封包的 room_token，把連線分到對應的房間"""
+        try:
+            conn.settimeout(ROUTE_TIMEOUT)
+            header = recv_exact(conn, 4)
+            length = struct.unpack('!I', header)[0] if header else 0
+            body = recv_exact(conn, length) if 0 < length <= MAX_TOKEN_FRAME else None
+            token = json.loads(body.decode('utf-8')).get("room_token") if body else None
+            conn.settimeout(None)
+        except (OSError, ValueError, AttributeError):
+            token = None
+        with self.lock:
+            room = self.rooms.get(token)
+            if room is None or room.started or len(room.clients) >= room.players:
+                room = None
+            else:
+                conn = TrackedSocket(room, conn)
+                room.clients.append(conn)
+                room.last_input = time.monotonic()
+                ready = len(room.clients) == room.players
+                if ready:
+                    room.started = True
+        if room is None:
+            conn.close()
+            return
+        if ready:
+            # 比賽的執行緒不是 daemon: stdin 關掉之後也會等進行中的比賽打完
+            threading.Thread(target=self.play, args=(room,), name=f"room-{room.room_id}").start()
+
+    def play(self, room):
+        result = None
+        error = None
+        try:
+            result = self.module.run_room(list(room.clients), room.players)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"[GameHost] Room {room.room_id} error: {error}")
+        finally:
+            for conn in room.clients:
+                try:
+                    conn.close()
+                except OSError:
+                    pass
+            with self.lock:
+                self.rooms.pop(room.token, None)
+                self.by_id.pop(room.room_id, None)
+        if room.cancelled:
+            return
+        if error is not None:
+            # 不能當成平手記戰績，讓 Lobby 把這場當成異常結束
+            self.control.send({"type": "error", "room_id": room.room_id, "reason": error})
+            return
+        self.control.send({"type": "result", "room_id": room.room_id, "result": result or "Draw"})
+
+
+def load_game_module(server_exe):
+    script = os.path.abspath(server_exe)
+    # 遊戲自己的模組 (同資料夾的 .py) 要 import 得到
+    sys.path[0] = os.path.dirname(script)
+    spec = importlib.util.spec_from_file_location("hosted_game_server", script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module) # __name__ 不是 __main__，不會跑單房間的 main()
+    if not hasattr(module, "run_room"):
+        raise SystemExit(f"{server_exe} does not provide run_room(clients, players)")
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('server_exe')
+    args = parser.parse_args()
+
+    control = ControlChannel()
+    host = GameHost(load_game_module(args.server_exe), control)
+    listen_fd = os.environ.get("GAME_LISTEN_FD")
+    if listen_fd:
+        listener = socket.socket(fileno=int(listen_fd)) # Lobby 已經 bind + listen 好 (見 services/port_pool.py)
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('0.0.0.0', args.port))
+        listener.listen(128)
+    threading.Thread(target=host.read_control, args=(listener,), daemon=True).start()
+    threading.Thread(target=host.heartbeat_loop, daemon=True).start()
+    control.send({"type": "ready"})
+    print(f"[GameHost] {args.server_exe} hosting rooms on port {args.port}")
+
+    while True:
+        try:
+            conn, addr = listener.accept()
+        except OSError:
+            break # listener 被關閉
+        threading.Thread(target=host.route, args=(conn,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+預先啟動的遊戲 Server (services/game_pool.py 用)
+
+    python game_launcher.py --port <port> <server_exe>
+
+先做完冷啟動最花時間的部分，再停在 stdin 等房間參數:
+1. 佔住 --port，閒置期間別人拿不走這個 Port (Lobby 用 GAME_LISTEN_FD 傳了 listen 好的 socket 就用它，否則自己 bind)
+2. 編譯遊戲的 server 程式，並先 import 它最上層用到的模組
+3. 從 stdin 讀到一行 JSON {"argv": [...], "inherit_listener": bool} 後把遊戲當成 __main__ 執行
+   (跟直接 `python server_exe ...` 一樣，sys.argv / sys.path[0] / __file__ 都相同)
+   inherit_listener 是 true 就把 socket 原封不動留給遊戲 (GAME_LISTEN_FD)，否則放開 Port 讓遊戲自己 bind
+stdin 被關閉 (Server 關機、遊戲改版) 就直接結束
+"""
+import argparse
+import ast
+import importlib
+import json
+import os
+import socket
+import sys
+import types
+
+
+def _warm_imports(tree):
+    """import 遊戲最上層的 import 敘述用到的模組，之後真正執行時直接從 sys.modules 拿"""
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except Exception:
+                pass # 執行時會再 import 一次，錯誤留給那時候回報
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('server_exe')
+    args = parser.parse_args()
+
+    script = os.path.abspath(args.server_exe)
+    listen_fd = os.environ.get("GAME_LISTEN_FD")
+    if listen_fd:
+        placeholder = socket.socket(fileno=int(listen_fd))
+    else:
+        placeholder = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        placeholder.bind(('0.0.0.0', args.port))
+
+    # 讓遊戲自己的模組 (同資料夾的 .py) 也能先 import
+    sys.path[0] = os.path.dirname(script)
+    with open(script, 'rb') as f:
+        source = f.read()
+    tree = ast.parse(source, script)
+    code = compile(tree, script, 'exec')
+    _warm_imports(tree)
+
+    line = sys.stdin.readline()
+    if not line:
+        return
+    room = json.loads(line)
+    room_argv = room["argv"]
+
+    if room.get("inherit_listener") and listen_fd:
+        placeholder.detach() # fd 留著給遊戲用
+    else:
+        # 還沒有連線進來過的 socket 關掉後不會進 TIME_WAIT，遊戲可以馬上綁同一個 Port
+        placeholder.close()
+        os.environ.pop("GAME_LISTEN_FD", None)
+    sys.argv = [script] + room_argv
+    sys.stdin = open(os.devnull, 'r') # 遊戲不應該讀到控制用的 pipe
+    module = types.ModuleType("__main__")
+    module.__file__ = script
+    sys.modules["__main__"] = module
+    exec(code, module.__dict__)
+
+
+if __name__ == "__main__":
+    main()
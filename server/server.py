@@ -1,52 +1,139 @@
 import threading
 import socket
 import os
-from config import LOBBY_PORT, DEV_PORT
-from services.lobby_service import handle_lobby_client
-from services.dev_service import handle_dev_client
-from db_storage.database import init_db, player_exit
+import argparse
+import queue
+import traceback
+from config import LOBBY_PORT, DEV_PORT, DB_BACKEND, ROOM_DEBUG_DUMP, SERVER_ENGINE, ASYNC_WORKERS, ASYNC_TRANSFER_WORKERS
+from config import LISTEN_BACKLOG, WORKER_THREADS, MAX_CONNECTIONS, ASYNC_MAX_CONNECTIONS, STATS_LOG_INTERVAL
+from services.lobby_service import handle_lobby_client, open_lobby_session, handle_lobby_request, close_lobby_session
+from services.lobby_service import TRANSFER_COMMANDS as LOBBY_TRANSFER_COMMANDS
+from services.dev_service import handle_dev_client, open_dev_session, handle_dev_request, close_dev_session
+from services.dev_service import TRANSFER_COMMANDS as DEV_TRANSFER_COMMANDS
+from db_storage.database import init_db, player_exit, shutdown_db
+from db_storage.room_registry import room_registry
+from services import game_pool, game_hosts, game_supervisor
+from admission import register_listener, busy_reply, log_listener_stats, start_stats_logger
+from utils import send_json
+
+def reject_busy(conn):
+    """滿載時回覆 server_busy 後關閉，不能讓慢的 Client 卡住 accept 迴圈"""
+    try:
+        conn.settimeout(1.0)
+        send_json(conn, busy_reply())
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
 def start_service(port, handler_func, service_name):
     """
     通用的 Server 啟動函式
+    閒置的 worker 執行緒從佇列拿連線來服務；沒有閒置的 worker 就多開一個 (連線數有 MAX_CONNECTIONS 擋著)
+    連線結束後閒置的 worker 超過 WORKER_THREADS 個，多開的就結束；連線數超過上限就直接拒絕
     """
+    stats = register_listener(service_name, MAX_CONNECTIONS)
+    pending = queue.Queue()
+    idle_lock = threading.Lock()
+    idle = [WORKER_THREADS] # 閒置 (等在 pending 上) 的 worker 數量
+
+    def serve(conn, addr):
+        try:
+            handler_func(conn, addr)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            stats.release()
+
+    def worker(job=None):
+        while True:
+            serve(*(job or pending.get()))
+            job = None
+            with idle_lock:
+                if idle[0] >= WORKER_THREADS:
+                    return # 閒置的 worker 已經夠了，多開的這個結束
+                idle[0] += 1
+
+    def spawn(job=None):
+        # 設定為守護執行緒，主程式結束時會自動關閉
+        threading.Thread(target=worker, args=(job,), name=f"{service_name}-worker", daemon=True).start()
+
+    for i in range(WORKER_THREADS):
+        spawn()
+
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server.bind(('0.0.0.0', port))
-    server.listen(5)
-    print(f"[System] {service_name} listening on port {port}...")
+    server.listen(LISTEN_BACKLOG)
+    print(f"[System] {service_name} listening on port {port} ({WORKER_THREADS} idle workers, max {MAX_CONNECTIONS} connections)...")
 
     while True:
         conn, addr = server.accept()
-        # 為每個連線建立一個執行緒
-        t = threading.Thread(target=handler_func, args=(conn, addr))
-        t.daemon = True # 設定為守護執行緒，主程式結束時會自動關閉
-        t.start()
+        if not stats.try_admit():
+            reject_busy(conn)
+            continue
+        with idle_lock:
+            has_idle = idle[0] > 0
+            if has_idle:
+                idle[0] -= 1 # 這條連線交給一個閒置的 worker
+        if has_idle:
+            pending.put((conn, addr))
+        else:
+            spawn((conn, addr))
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db_backend', choices=['json', 'sqlite'], default=DB_BACKEND, help='資料儲存後端')
+    parser.add_argument('--engine', choices=['thread', 'asyncio'], default=SERVER_ENGINE, help='連線模型')
+    args = parser.parse_args()
+
     print("=== Game Platform Server Starting ===")
-    init_db()  # 初始化資料庫
+    init_db(args.db_backend)  # 初始化資料庫 (sqlite 第一次啟動時會自動匯入舊的 JSON 資料)
     
     if not os.path.exists("games"):
         os.makedirs("games")
-    # 啟動 Lobby Server (玩家用)
+    if STATS_LOG_INTERVAL > 0:
+        start_stats_logger(STATS_LOG_INTERVAL, [game_supervisor.log_stats])
     try:
-        t_lobby = threading.Thread(
-            target=start_service, 
-            args=(LOBBY_PORT, handle_lobby_client, "Lobby Server")
-        )
-        
-        # 啟動 Developer Server (開發者用)
-        t_dev = threading.Thread(
-            target=start_service, 
-            args=(DEV_PORT, handle_dev_client, "Developer Server")
-        )
-
-        t_lobby.start()
-        t_dev.start()
-
-        # 主執行緒等待 (防止程式直接結束)
-        t_lobby.join()
-        t_dev.join()
+        if args.engine == 'asyncio':
+            # 延遲載入，thread 模式不需要 asyncio
+            from async_engine import run_async_services
+            run_async_services([
+                (LOBBY_PORT, open_lobby_session, handle_lobby_request, close_lobby_session, "Lobby Server", LOBBY_TRANSFER_COMMANDS),
+                (DEV_PORT, open_dev_session, handle_dev_request, close_dev_session, "Developer Server", DEV_TRANSFER_COMMANDS),
+            ], max_workers=ASYNC_WORKERS, transfer_workers=ASYNC_TRANSFER_WORKERS,
+               max_connections=ASYNC_MAX_CONNECTIONS, backlog=LISTEN_BACKLOG)
+        else:
+            # 啟動 Lobby Server (玩家用)
+            t_lobby = threading.Thread(
+                target=start_service, 
+                args=(LOBBY_PORT, handle_lobby_client, "Lobby Server"),
+                daemon=True
+            )
+            
+            # 啟動 Developer Server (開發者用)
+            t_dev = threading.Thread(
+                target=start_service, 
+                args=(DEV_PORT, handle_dev_client, "Developer Server"),
+                daemon=True
+            )
+
+            t_lobby.start()
+            t_dev.start()
+
+            # 主執行緒等待 (防止程式直接結束)
+            t_lobby.join()
+            t_dev.join()
     except KeyboardInterrupt:
         print("\n[System] Shutting down servers...")
+    finally:
+        log_listener_stats()
+        game_supervisor.log_stats()
+        game_pool.shutdown()
+        game_hosts.shutdown()
+        game_supervisor.shutdown()
+        # 強制把記憶體中的資料寫回磁碟
+        shutdown_db()
 
+        if ROOM_DEBUG_DUMP:
+            room_registry.dump_snapshot("server_data/rooms.json")
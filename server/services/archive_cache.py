@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from utils import zip_game_folder_to_player
+from services.blob_store import load_manifest
+from archive_codec import write_archive, get_executor
+from config import ARCHIVE_CODEC, ARCHIVE_WORKERS
+
+# 玩家下載用的遊戲壓縮檔快取
+# 每個版本只打包一次，存成 games/{game_id}/_archives/{sha256}.zip (內容定址，檔案建好後不會再被改寫)
+# 所以任意數量的玩家可以同時讀同一個檔案下載
+# games/{game_id}/_archives/index.json 記錄版本 -> 壓縮檔 (含每個檔案的雜湊與差異更新檔)，Server 重開後可以沿用
+
+ARCHIVE_DIR_NAME = "_archives"
+INDEX_FILE_NAME = "index.json"
+
+_index = {}                 # game_id -> {version: {"digest", "size", "files", "deltas": {key: {"digest", "size"}}}}
+_index_lock = threading.Lock()
+_generation = {}            # game_id -> invalidate 的次數，打包途中被 invalidate 就不登記結果
+_build_locks = {}           # (game_id, version) -> Lock，同一版本同時只打包一次
+_build_locks_lock = threading.Lock()
+
+
+def _archive_dir(game_id):
+    return os.path.join("games", game_id, ARCHIVE_DIR_NAME)
+
+def _archive_path(game_id, digest):
+    return os.path.join(_archive_dir(game_id), f"{digest}.zip")
+
+def _load_index(game_id):
+    """呼叫端必須持有 _index_lock"""
+    if game_id not in _index:
+        index_path = os.path.join(_archive_dir(game_id), INDEX_FILE_NAME)
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                _index[game_id] = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            _index[game_id] = {}
+    return _index[game_id]
+
+def _save_index(game_id):
+    """呼叫端必須持有 _index_lock"""
+    index_path = os.path.join(_archive_dir(game_id), INDEX_FILE_NAME)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(_index[game_id], f, indent=4)
+    os.replace(tmp_path, index_path)
+
+def _build_lock(game_id, version):
+    with _build_locks_lock:
+        return _build_locks.setdefault((game_id, version), threading.Lock())
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _lookup(game_id, version):
+    with _index_lock:
+        entry = _load_index(game_id).get(version)
+    if entry and os.path.exists(_archive_path(game_id, entry["digest"])):
+        return dict(entry, path=_archive_path(game_id, entry["digest"]))
+    return None
+
+
+def _scan_player_files(game_id, version, version_dir):
+    """玩家拿到的檔案 (manifest.json + client/ 底下全部) -> {相對路徑: {"size", "sha256"}}"""
+    stored = load_manifest(game_id, version)
+    if stored is not None:
+        # blob store 上傳時已經算過雜湊
+        return {rel: {"size": info["size"], "sha256": info["sha256"]} for rel, info in stored.items()
+                if rel == 'manifest.json' or rel.startswith('client/')}
+    paths = [os.path.join(version_dir, 'manifest.json')]
+    for root, dirs, names in os.walk(os.path.join(version_dir, 'client')):
+        paths.extend(os.path.join(root, name) for name in names)
+    files = {}
+    for path in paths:
+        rel = os.path.relpath(path, version_dir).replace(os.sep, '/')
+        files[rel] = {"size": os.path.getsize(path), "sha256": _file_sha256(path)}
+    return files
+
+def _zip_player_files(version_dir, rel_paths, output_zip_name):
+    """只打包指定的檔案 (差異更新用)"""
+    try:
+        entries = [(os.path.join(version_dir, *rel.split('/')), rel) for rel in rel_paths]
+        return write_archive(output_zip_name, entries, codec=ARCHIVE_CODEC, executor=get_executor(ARCHIVE_WORKERS))
+    except OSError as e:
+        print(f"[Error] Failed to zip files: {e}")
+        return None
+
+def _pack(game_id, pack_func):
+    """
+    pack_func(tmp_path) 把檔案打包到暫存檔，成功回傳 True
+    打包完算雜湊後改名成 {sha256}.zip，回傳 (digest, size)，失敗回傳 None
+    """
+    archive_dir = _archive_dir(game_id)
+    os.makedirs(archive_dir, exist_ok=True)
+    # 先打包到唯一的暫存檔，算完雜湊再改名，其他人永遠看不到寫到一半的檔案
+    fd, tmp_path = tempfile.mkstemp(suffix=".zip.tmp", dir=archive_dir)
+    os.close(fd)
+    try:
+        if not pack_func(tmp_path):
+            return None
+        digest = _file_sha256(tmp_path)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, _archive_path(game_id, digest))
+        return digest, size
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def build_player_archive(game_id, version, version_dir):
+    """
+    打包某個版本給玩家下載 (上傳部署完成時呼叫，或第一次有人下載時)，同時記下每個檔案的雜湊
+    回傳: {"path", "digest", "size", "files"}，失敗回傳 None
+    """
+    with _build_lock(game_id, version):
+        # 等鎖的期間可能已經有別人打包好了
+        cached = _lookup(game_id, version)
+        if cached:
+            return cached
+
+        with _index_lock:
+            generation = _generation.get(game_id, 0)
+        packed = _pack(game_id, lambda tmp_path: zip_game_folder_to_player(version_dir, output_zip_name=tmp_path))
+        if not packed:
+            return None
+        digest, size = packed
+        entry = {"digest": digest, "size": size, "files": _scan_player_files(game_id, version, version_dir), "deltas": {}}
+
+        with _index_lock:
+            if _generation.get(game_id, 0) != generation:
+                # 打包期間遊戲被重新上傳或下架，這份檔案已經過期 (正在用的人讀完就沒事)
+                return dict(entry, path=_archive_path(game_id, digest))
+            _load_index(game_id)[version] = entry
+            _save_index(game_id)
+    print(f"[Archive] Built player archive for {game_id} v{version} ({digest[:12]}, {size} bytes)")
+    return dict(entry, path=_archive_path(game_id, digest))
+
+def get_player_archive(game_id, version, version_dir):
+    """取得某版本的下載檔，還沒打包過就現在打包"""
+    return _lookup(game_id, version) or build_player_archive(game_id, version, version_dir)
+
+def get_file_manifest(game_id, version, version_dir):
+    """某版本每個檔案的 {相對路徑: {"size", "sha256"}}，失敗回傳 None"""
+    archive = get_player_archive(game_id, version, version_dir)
+    if not archive:
+        return None
+    if "files" in archive:
+        return archive["files"]
+    # 舊的 index.json 沒有檔案清單，補算一次存回去
+    files = _scan_player_files(game_id, version, version_dir)
+    with _index_lock:
+        entry = _load_index(game_id).get(version)
+        if entry and entry["digest"] == archive["digest"]:
+            entry["files"] = files
+            entry.setdefault("deltas", {})
+            _save_index(game_id)
+    return files
+
+def get_delta_archive(game_id, version, version_dir, have):
+    """
+    差異更新: have 是玩家手上的 {相對路徑: sha256}
+    只打包新增 / 內容不同的檔案，回傳 {"path", "digest", "size", "changed", "deleted", "files"}，失敗回傳 None
+    同樣的舊版本升級到同樣的新版本，需要的檔案都一樣，所以打包結果以檔案清單的雜湊為 key 快取起來
+    """
+    files = get_file_manifest(game_id, version, version_dir)
+    if files is None:
+        return None
+    changed = sorted(rel for rel, info in files.items() if have.get(rel) != info["sha256"])
+    deleted = sorted(rel for rel in have if rel not in files)
+    key = hashlib.sha256("\n".join(changed).encode('utf-8')).hexdigest()
+    result = {"changed": changed, "deleted": deleted, "files": files}
+
+    with _build_lock(game_id, version):
+        with _index_lock:
+            generation = _generation.get(game_id, 0)
+            entry = _load_index(game_id).get(version)
+            delta = entry.get("deltas", {}).get(key) if entry else None
+        if delta and os.path.exists(_archive_path(game_id, delta["digest"])):
+            return dict(result, path=_archive_path(game_id, delta["digest"]), **delta)
+
+        packed = _pack(game_id, lambda tmp_path: _zip_player_files(version_dir, changed, tmp_path))
+        if not packed:
+            return None
+        digest, size = packed
+        with _index_lock:
+            entry = _load_index(game_id).get(version)
+            if _generation.get(game_id, 0) == generation and entry:
+                entry.setdefault("deltas", {})[key] = {"digest": digest, "size": size}
+                _save_index(game_id)
+    print(f"[Archive] Built delta archive for {game_id} v{version} ({len(changed)}/{len(files)} files, {size} bytes)")
+    return dict(result, path=_archive_path(game_id, digest), digest=digest, size=size)
+
+def invalidate(game_id):
+    """
+    丟掉某遊戲所有已打包的下載檔 (重新上傳、下架時呼叫)
+    正在下載的玩家已經開著舊檔案，刪除失敗 (Windows) 就留著，下次 invalidate 再清
+    """
+    with _index_lock:
+        _index[game_id] = {}
+        _generation[game_id] = _generation.get(game_id, 0) + 1
+        archive_dir = _archive_dir(game_id)
+        if not os.path.isdir(archive_dir):
+            return
+        for name in os.listdir(archive_dir):
+            if name.endswith(".tmp"):
+                continue # 打包中的暫存檔由打包的人自己清
+            try:
+                os.remove(os.path.join(archive_dir, name))
+            except OSError:
+                pass
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+# 遊戲檔案的內容定址儲存
+# 每個檔案依 sha256 只存一份在 game_blobs/{前兩碼}/{sha256}
+# games/{game_id}/{version}/ 底下的檔案都是指向 blob 的 hardlink (不支援 hardlink 的檔案系統才複製)
+# 所以同一個遊戲 20 個版本共用沒改過的素材，只佔一份空間
+# games/{game_id}/_manifests/{version}.json 記錄該版本 {相對路徑: {"sha256", "size"}}，GC 靠它判斷哪些 blob 還有人用
+# 注意: 版本資料夾裡的檔案跟其他版本共用，只能整個換掉，不能直接改寫內容
+
+BLOB_ROOT = "game_blobs"
+GAMES_ROOT_DIR = "games"
+MANIFEST_DIR_NAME = "_manifests"
+
+# 寫入 blob / 產生 manifest 與 GC 不能同時進行，否則 GC 可能刪掉剛放進來、manifest 還沒寫好的 blob
+_lock = threading.Lock()
+
+
+def _blob_path(digest):
+    return os.path.join(BLOB_ROOT, digest[:2], digest)
+
+def _manifest_path(game_id, version):
+    return os.path.join(GAMES_ROOT_DIR, game_id, MANIFEST_DIR_NAME, f"{version}.json")
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def has_blob(digest):
+    return os.path.exists(_blob_path(digest))
+
+
+def load_manifest(game_id, version):
+    """某版本的 {相對路徑: {"sha256", "size"}}，舊版上傳 (還沒有 blob store 時) 回傳 None"""
+    try:
+        with open(_manifest_path(game_id, version), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def store_version(src_dir, game_id, version, dest_dir, files=None):
+    """
+    把解壓縮好的 src_dir 收進 blob store，並在 dest_dir 用 hardlink 組出版本資料夾
+    src_dir 的檔案會被搬走或刪掉，dest_dir 必須還不存在
+    files: 已經算好的 {相對路徑: {"sha256", "size"}} (串流上傳時邊收邊算)，沒給就在這裡算
+    回傳: (檔案數, 新增的 blob 數)
+    """
+    if files is None:
+        # 先在鎖外面算雜湊 (大檔案很花時間)
+        files = {}
+        for root, dirs, names in os.walk(src_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, src_dir).replace(os.sep, '/')
+                files[rel] = {"sha256": _file_sha256(path), "size": os.path.getsize(path)}
+
+    new_blobs = 0
+    with _lock:
+        for rel, info in files.items():
+            src = os.path.join(src_dir, *rel.split('/'))
+            blob = _blob_path(info["sha256"])
+            if not os.path.exists(blob):
+                # 差異上傳沿用的檔案不在 src_dir，blob 也不見了 (上一版剛好被刪) 就會在這裡失敗
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(src, blob)
+                new_blobs += 1
+            dst = os.path.join(dest_dir, *rel.split('/'))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                os.link(blob, dst)
+            except OSError:
+                shutil.copy2(blob, dst) # 檔案系統不支援 hardlink，只能複製
+
+        manifest_path = _manifest_path(game_id, version)
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(files, f, indent=4)
+        os.replace(tmp_path, manifest_path)
+    # 空資料夾 (以及已經有 blob 的重複檔案) 留在 src_dir，由呼叫端清掉
+    print(f"[Blob] Stored {game_id} v{version}: {len(files)} files, {new_blobs} new blobs")
+    return len(files), new_blobs
+
+
+def remove_version(game_id, version):
+    """刪掉某版本的資料夾與 manifest (blob 等 GC 再清)"""
+    version_dir = os.path.join(GAMES_ROOT_DIR, game_id, version)
+    with _lock:
+        if os.path.exists(version_dir):
+            shutil.rmtree(version_dir)
+        manifest_path = _manifest_path(game_id, version)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+
+def prune_versions(game_id, current_version, keep):
+    """
+    只保留最近上傳的 keep 個版本 (目前版本一定保留)，刪掉更舊的版本後跑一次 GC
+    回傳被刪掉的版本清單
+    """
+    game_dir = os.path.join(GAMES_ROOT_DIR, game_id)
+    if not os.path.isdir(game_dir):
+        return []
+    versions = [name for name in os.listdir(game_dir)
+                if not name.startswith('_') and os.path.isdir(os.path.join(game_dir, name))]
+    # 依上傳時間 (資料夾建立時間) 由新到舊
+    versions.sort(key=lambda name: os.path.getmtime(os.path.join(game_dir, name)), reverse=True)
+    pruned = [v for v in versions if v != current_version][max(keep - 1, 0):]
+    for version in pruned:
+        remove_version(game_id, version)
+    if pruned:
+        print(f"[Blob] Pruned old versions of {game_id}: {', '.join(pruned)}")
+    collect_garbage()
+    return pruned
+
+
+def collect_garbage():
+    """
+    刪掉沒有任何版本 manifest 用到的 blob (下架遊戲、刪除舊版本、同版本重新上傳之後呼叫)
+    回傳: (刪掉的 blob 數, 釋放的 bytes)
+    """
+    with _lock:
+        referenced = set()
+        if os.path.isdir(GAMES_ROOT_DIR):
+            for game_id in os.listdir(GAMES_ROOT_DIR):
+                manifest_dir = os.path.join(GAMES_ROOT_DIR, game_id, MANIFEST_DIR_NAME)
+                if not os.path.isdir(manifest_dir):
+                    continue
+                for name in os.listdir(manifest_dir):
+                    if not name.endswith(".json"):
+                        continue
+                    manifest = load_manifest(game_id, name[:-len(".json")])
+                    if manifest is None:
+                        # 讀不到就不知道哪些 blob 還有人用，這次先不清
+                        print(f"[Blob] Skip GC: cannot read manifest {game_id}/{name}")
+                        return 0, 0
+                    referenced.update(info["sha256"] for info in manifest.values())
+
+        removed = 0
+        freed = 0
+        if os.path.isdir(BLOB_ROOT):
+            for prefix in os.listdir(BLOB_ROOT):
+                prefix_dir = os.path.join(BLOB_ROOT, prefix)
+                for digest in os.listdir(prefix_dir):
+                    if digest in referenced:
+                        continue
+                    path = os.path.join(prefix_dir, digest)
+                    try:
+                        size = os.path.getsize(path)
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    removed += 1
+                    freed += size
+                if not os.listdir(prefix_dir):
+                    os.rmdir(prefix_dir)
+    if removed:
+        print(f"[Blob] GC removed {removed} blobs ({freed} bytes)")
+    return removed, freed
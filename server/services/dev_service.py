@@ -1,87 +1,143 @@
 import os
 import shutil
-import zipfile
+import tempfile
+import hashlib
 import json
 import threading
+import time
+from contextlib import contextmanager
 
 # 引用我們之前定義好的工具
-from utils import recv_json, send_json, recv_file
-from db_storage.database import register_user, verify_login, add_or_update_game, get_all_games, remove_game, player_exit, get_all_rooms,change_game_status
+from utils import recv_json, send_json, recv_file, extract_zip_safely, safe_join
+from framing import recv_file_body
+from db_storage.database import register_user, verify_login, add_or_update_game, get_all_games, remove_game, player_exit, change_game_status
+from db_storage.room_registry import room_registry
+from services import archive_cache, blob_store, game_pool, game_hosts
+from admission import busy_reply
+from config import MAX_KEPT_VERSIONS, UPLOAD_STAGING_DIR, MAX_CONCURRENT_UPLOADS, MAX_UPLOAD_EXTRACTED_BYTES
 
 # 設定遊戲儲存根目錄
 GAMES_ROOT_DIR = "games"
+# 會傳檔、佔住執行緒很久的指令 (asyncio 模式交給另一個執行緒池，見 async_engine.py)
+TRANSFER_COMMANDS = {'upload_game', 'upload_game_stream', 'upload_game_delta'}
 
-def handle_dev_client(conn, addr):
+# 同時上傳數量上限
+_upload_slots = threading.BoundedSemaphore(MAX_CONCURRENT_UPLOADS)
+# 換上新版本資料夾 / 更新資料庫 / 打包，同一個遊戲一次只做一個
+_publish_locks = {}
+_publish_locks_lock = threading.Lock()
+
+class DevSession:
+    """一條開發者連線的狀態"""
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.addr = addr
+        self.current_user = None # 記錄目前連線的開發者帳號
+
+def open_dev_session(conn, addr):
+    print(f"[Dev] {addr} connected.")
+    return DevSession(conn, addr)
+
+def handle_dev_request(session, req):
     """
     Developer Server 的主邏輯
     負責處理開發者的登入、上傳、管理遊戲指令
+    回傳: True (繼續等下一個指令), False (關閉連線)
     """
-    print(f"[Dev] {addr} connected.")
-    current_user = None # 記錄目前連線的開發者帳號
+    conn = session.conn
+    addr = session.addr
+    cmd = req.get('cmd')
+    print(f"[Dev] {addr} Request: {cmd}")
+
+    # --- 指令處理 ---
+
+    # === 1. 註冊登入處理 ===
+    if cmd == 'register':
+        username = req.get('username')
+        password = req.get('password')
+
+        # 呼叫 database.py 的註冊函式
+        if register_user(username, password, role="developer"):
+            send_json(conn, {"status": "ok", "msg": "Registration successful"})
+        else:
+            send_json(conn, {"status": "error", "msg": "Username already exists"})
+
+    elif cmd == 'login':
+        username = req.get('username')
+        password = req.get('password')
+
+        # 呼叫 database.py 的驗證函式
+        if verify_login(username, password, role="developer"):
+            session.current_user = username
+            send_json(conn, {"status": "ok", "msg": f"Welcome, {username}!"})
+        else:
+            send_json(conn, {"status": "error", "msg": "Wrong username or password or already online"})
+
+    # === 2. 檢查登入狀態 (Middleware check) ===
+    elif not session.current_user:
+        send_json(conn, {"status": "error", "msg": "Please login first."})
+        return True
+    # === 3. 上傳遊戲 ===
+    elif cmd == 'upload_game':
+        # 進入上傳處理專用函式
+        handle_upload_process(conn, session.current_user)
+    elif cmd == 'upload_game_stream':
+        # 串流上傳: 邊收邊寫進暫存區，不經過 zip
+        return handle_upload_stream(conn, session.current_user, req.get('manifest'))
+    elif cmd == 'upload_game_delta':
+        # 差異上傳: 只送新增 / 改過的檔案，其他沿用上一版
+        return handle_upload_stream(conn, session.current_user, req.get('manifest'),
+                                    base_version=req.get('base_version'), keep=req.get('keep'))
+    elif cmd == 'get_file_manifest':
+        # 差異上傳前，Client 先拿目前版本每個檔案的雜湊來比對
+        game_id = req.get('game_id')
+        game = get_all_games().get(game_id)
+        if not game or game.get('uploader') != session.current_user:
+            send_json(conn, {"status": "error", "msg": "Game not found or you do not have permission to update it."})
+            return True
+        files = blob_store.load_manifest(game_id, game['version'])
+        if files is None:
+            send_json(conn, {"status": "error", "msg": "No file list for this version, please upload the full game"})
+            return True
+        send_json(conn, {"status": "ok", "version": game['version'], "files": files})
+
+    # === 4. 列出我上傳的遊戲 (Optional) ===
+    elif cmd == 'my_games':
+        # 簡單過濾一下 database 裡的資料
+        all_games = get_all_games()
+        my_games = [
+            g for g in all_games.values() 
+            if g.get('uploader') == session.current_user
+        ]
+        send_json(conn, {"status": "ok", "games": my_games})
+    # === 5. 下架遊戲 ===
+    elif cmd == 'delete_game':
+        game_id = req.get('game_id')
+        if game_id:
+            delete_game_process(conn, session.current_user, game_id)
+        else:
+            send_json(conn, {"status": "error", "msg": "Missing game_id"})
+    # === 6. 未知指令 ===
+    else:
+        send_json(conn, {"status": "error", "msg": "Unknown command"})
+    return True
 
+def close_dev_session(session):
+    print(f"[Dev] {session.addr} disconnected.")
+    player_exit(session.current_user, role="developer")
+    session.conn.close()
+
+def handle_dev_client(conn, addr):
+    """一條連線一個執行緒的版本: 在這裡阻塞等待指令"""
+    session = open_dev_session(conn, addr)
     try:
         while True:
             # 1. 等待指令
             req = recv_json(conn)
             if not req:
                 break # 連線中斷
-            
-            cmd = req.get('cmd')
-            print(f"[Dev] {addr} Request: {cmd}")
-
-            # --- 指令處理 ---
-
-            # === 1. 註冊登入處理 ===
-            if cmd == 'register':
-                username = req.get('username')
-                password = req.get('password')
-                
-                # 呼叫 database.py 的註冊函式
-                if register_user(username, password, role="developer"):
-                    send_json(conn, {"status": "ok", "msg": "Registration successful"})
-                else:
-                    send_json(conn, {"status": "error", "msg": "Username already exists"})
-            
-            elif cmd == 'login':
-                username = req.get('username')
-                password = req.get('password')
-                
-                # 呼叫 database.py 的驗證函式
-                if verify_login(username, password, role="developer"):
-                    current_user = username
-                    send_json(conn, {"status": "ok", "msg": f"Welcome, {username}!"})
-                else:
-                    send_json(conn, {"status": "error", "msg": "Wrong username or password or already online"})
-
-            # === 2. 檢查登入狀態 (Middleware check) ===
-            elif not current_user:
-                send_json(conn, {"status": "error", "msg": "Please login first."})
-                continue
-
-            # === 3. 上傳遊戲 ===
-            elif cmd == 'upload_game':
-                # 進入上傳處理專用函式
-                handle_upload_process(conn, current_user)
-
-            # === 4. 列出我上傳的遊戲 (Optional) ===
-            elif cmd == 'my_games':
-                # 簡單過濾一下 database 裡的資料
-                all_games = get_all_games()
-                my_games = [
-                    g for g in all_games.values() 
-                    if g.get('uploader') == current_user
-                ]
-                send_json(conn, {"status": "ok", "games": my_games})
-            # === 5. 下架遊戲 ===
-            elif cmd == 'delete_game':
-                game_id = req.get('game_id')
-                if game_id:
-                    delete_game_process(conn, current_user, game_id)
-                else:
-                    send_json(conn, {"status": "error", "msg": "Missing game_id"})
-            # === 6. 未知指令 ===
-            else:
-                send_json(conn, {"status": "error", "msg": "Unknown command"})
+            if not handle_dev_request(session, req):
+                break
 
     except Exception as e:
         print(f"[Dev Error] {addr}: {e}")
@@ -89,73 +145,85 @@ def handle_dev_client(conn, addr):
         import traceback
         traceback.print_exc()
     finally:
-        print(f"[Dev] {addr} disconnected.")
-        player_exit(current_user, role="developer")
-        conn.close()
+        close_dev_session(session)
 
 
-def handle_upload_process(conn, uploader_name):
+def _is_safe_name(name):
+    """game_id / version 會變成資料夾名稱，只能是單一層、不能是隱藏或保留 (_ 開頭) 的名稱"""
+    return (isinstance(name, str) and name != '' and name not in ('.', '..')
+            and not name.startswith(('.', '_')) and os.path.basename(name) == name
+            and '/' not in name and '\\' not in name)
+
+def _publish_lock(game_id):
+    with _publish_locks_lock:
+        return _publish_locks.setdefault(game_id, threading.Lock())
+
+def _check_manifest(manifest):
+    """回傳 (game_id, version)，不合法丟出 Exception"""
+    game_id = manifest.get('game_id')
+    version = manifest.get('version')
+    if not game_id or not version:
+        raise Exception("Invalid manifest: missing game_id or version")
+    if not _is_safe_name(game_id) or not _is_safe_name(version):
+        raise Exception("Invalid manifest: game_id and version must be plain folder names")
+    return game_id, version
+
+def _read_manifest(extract_dir):
+    manifest_path = os.path.join(extract_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        raise Exception("Manifest not found in upload!")
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+@contextmanager
+def _upload_slot():
     """
-    處理具體的檔案接收與部署邏輯
+    佔一個上傳名額並開這次上傳專用的暫存資料夾，結束時整個刪掉
+    名額滿了 yield None (呼叫端回覆 server_busy)
     """
-    temp_zip = "temp_upload.zip"
-    temp_extract_folder = "temp_extract"
-
+    if not _upload_slots.acquire(blocking=False):
+        yield None
+        return
+    staging = None
     try:
-        # 1. 告訴 Client: "準備好了，請傳檔案"
-        # Client 端應該在收到這個訊號後呼叫 send_file
-        send_json(conn, {"status": "ready_to_receive"})
-
-        # 2. 接收檔案 (存到暫存區)
-        saved_path = recv_file(conn, save_dir=".")
-        if not saved_path:
-            raise Exception("File transfer failed")
-        
-        # 重新命名以便識別 (recv_file 可能存成 client 傳來的檔名)
-        if os.path.exists(temp_zip):
-            os.remove(temp_zip)
-        os.rename(saved_path, temp_zip)
-
-        # 3. 解壓縮
-        if os.path.exists(temp_extract_folder):
-            shutil.rmtree(temp_extract_folder)
-        
-        print(f"[System] Unzipping {temp_zip}...")
-        with zipfile.ZipFile(temp_zip, 'r') as zf:
-            zf.extractall(temp_extract_folder)
-
-        # 4. 讀取 Manifest 並驗證
-        manifest_path = os.path.join(temp_extract_folder, "manifest.json")
-        if not os.path.exists(manifest_path):
-            raise Exception("Manifest not found in zip!")
-
-        with open(manifest_path, 'r', encoding='utf-8') as f:
-            manifest = json.load(f)
-
-        # 取得關鍵資訊
-        game_id = manifest.get('game_id')
-        version = manifest.get('version')
-        
-        if not game_id or not version:
-            raise Exception("Invalid manifest: missing game_id or version")
-        
-
-        # 5. 部署到最終目錄: games/{game_id}/{version}/
-        # 使用 os.path.join 確保跨平台相容
-        final_dir = os.path.join(GAMES_ROOT_DIR, game_id, version)
-
-        # 如果該版本已存在，先刪除舊的 (Overwrite)
-        if os.path.exists(final_dir):
-            shutil.rmtree(final_dir)
-        
-        # 移動資料夾
-        # 注意: shutil.move 的目標上層目錄必須存在
-        os.makedirs(os.path.dirname(final_dir), exist_ok=True)
-        shutil.move(temp_extract_folder, final_dir)
+        os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix="upload-", dir=UPLOAD_STAGING_DIR)
+        yield staging
+    finally:
+        # 清理這次上傳的暫存資料夾 (無論成功失敗都要做)
+        if staging and os.path.exists(staging):
+            shutil.rmtree(staging, ignore_errors=True)
+        _upload_slots.release()
+
+def _publish_upload(staging, extract_dir, uploader_name, files=None):
+    """
+    把暫存區裡收好的遊戲 (extract_dir) 上架，回傳 (game_id, version)
+    files: 已經算好的各檔案雜湊 (串流上傳)，沒給由 blob store 計算
+    """
+    # 讀取 Manifest 並驗證
+    manifest = _read_manifest(extract_dir)
+    game_id, version = _check_manifest(manifest)
 
+    # 檔案收進 blob store，在暫存區用 hardlink 組出版本資料夾 (沒改過的素材跟舊版本共用同一份)
+    tree_dir = os.path.join(staging, "tree")
+    blob_store.store_version(extract_dir, game_id, version, tree_dir, files=files)
+
+    # 部署到最終目錄: games/{game_id}/{version}/ (同一個遊戲一次只部署一個)
+    final_dir = os.path.join(GAMES_ROOT_DIR, game_id, version)
+    with _publish_lock(game_id):
+        # 舊的下載檔都過期了 (同版本重新上傳或換新版本)
+        archive_cache.invalidate(game_id)
+        os.makedirs(os.path.dirname(final_dir), exist_ok=True)
+        if os.path.exists(final_dir):
+            # 同版本重新上傳: 先把舊的搬進暫存區 (最後一起刪)，再把新的改名過去
+            os.rename(final_dir, os.path.join(staging, "old"))
+        os.rename(tree_dir, final_dir)
+        # 預先啟動的遊戲 Server 與多房間的 host 載入的是舊的檔案
+        game_pool.retire(game_id)
+        game_hosts.retire(game_id)
         print(f"[System] Game deployed at: {final_dir}")
 
-        # 6. 更新資料庫 (games.json)
+        # 更新資料庫 (games.json)
         # 這裡會保存評論數據，只更新版本資訊
         add_or_update_game(
             game_id=game_id,
@@ -164,39 +232,191 @@ def handle_upload_process(conn, uploader_name):
             uploader_name=uploader_name
         )
 
-        # 7. 回傳成功訊息
-        send_json(conn, {
-            "status": "ok", 
-            "msg": f"Game '{game_id}' (v{version}) uploaded successfully!"
-        })
+        # 先把玩家下載用的壓縮檔打包好，第一個下載的玩家不必等
+        archive_cache.build_player_archive(game_id, version, final_dir)
+
+        # 刪掉太舊的版本並回收沒人用的檔案 (有房間在玩就先不刪版本，下次上傳再處理)
+        if room_registry.has_game(game_id):
+            blob_store.collect_garbage()
+        else:
+            blob_store.prune_versions(game_id, version, MAX_KEPT_VERSIONS)
+    return game_id, version
+
+def handle_upload_process(conn, uploader_name):
+    """
+    處理具體的檔案接收與部署邏輯 (上傳整個 zip)
+    每個上傳有自己的暫存資料夾，多個開發者 (或 CI) 可以同時上傳
+    """
+    with _upload_slot() as staging:
+        # 同時上傳的數量有上限，滿了就請 Client 稍後再試
+        if staging is None:
+            send_json(conn, busy_reply())
+            return
+        try:
+            extract_dir = os.path.join(staging, "extract")
+
+            # 1. 告訴 Client: "準備好了，請傳檔案"
+            # Client 端應該在收到這個訊號後呼叫 send_file
+            send_json(conn, {"status": "ready_to_receive"})
+
+            # 2. 接收檔案 (存到這次上傳的暫存區)
+            saved_path = recv_file(conn, save_dir=staging, save_name="upload.zip")
+            if not saved_path:
+                raise Exception("File transfer failed")
+
+            # 3. 串流解壓縮 (檢查路徑與總大小)
+            print(f"[System] Unzipping {saved_path}...")
+            extract_zip_safely(saved_path, extract_dir, MAX_UPLOAD_EXTRACTED_BYTES)
+            os.remove(saved_path)
+
+            # 4. 驗證並上架
+            game_id, version = _publish_upload(staging, extract_dir, uploader_name)
 
+            # 5. 回傳成功訊息
+            send_json(conn, {
+                "status": "ok", 
+                "msg": f"Game '{game_id}' (v{version}) uploaded successfully!"
+            })
+
+        except Exception as e:
+            error_msg = str(e)
+            print(f"[Upload Error] {error_msg}")
+            send_json(conn, {"status": "error", "msg": error_msg})
+
+def _receive_stream(conn, extract_dir):
+    """
+    串流上傳的檔案: 每個檔案一個 JSON header {"path", "size"} 接著內容，最後 {"end": true, "files": 檔案數}
+    邊收邊寫進 extract_dir、邊算 sha256，回傳 {相對路徑: {"sha256", "size"}}
+    格式錯誤丟出 ValueError，斷線丟出 ConnectionError
+    """
+    files = {}
+    total = 0
+    while True:
+        header = recv_json(conn)
+        if header is None:
+            raise ConnectionResetError("Connection lost during upload")
+        if header.get('end'):
+            if header.get('files', len(files)) != len(files):
+                raise ValueError("File count mismatch")
+            return files
+
+        rel = header.get('path')
+        size = header.get('size')
+        if not isinstance(rel, str) or not isinstance(size, int) or size < 0:
+            raise ValueError("Invalid file entry")
+        target = safe_join(extract_dir, rel.replace('\\', '/'))
+        rel = os.path.relpath(target, os.path.abspath(extract_dir)).replace(os.sep, '/')
+        if rel in files:
+            raise ValueError(f"Duplicate file in upload: {rel}")
+        total += size
+        if total > MAX_UPLOAD_EXTRACTED_BYTES:
+            raise ValueError(f"Upload exceeds limit of {MAX_UPLOAD_EXTRACTED_BYTES} bytes")
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        hasher = hashlib.sha256()
+        with open(target, 'wb') as f:
+            received = recv_file_body(conn, f, size, hasher)
+        if received < size:
+            raise ConnectionResetError(f"Connection lost after {received}/{size} bytes of {rel}")
+        files[rel] = {"sha256": hasher.hexdigest(), "size": size}
+
+def _check_delta_base(game_id, uploader_name, base_version, keep):
+    """
+    差異上傳: keep 是要沿用上一版的 {相對路徑: sha256}
+    確認上一版還在、每個檔案的雜湊一致且 blob 還在，回傳 {相對路徑: {"sha256", "size"}}
+    """
+    game = get_all_games().get(game_id)
+    if not game or game.get('uploader') != uploader_name:
+        raise Exception("Game not found or you do not have permission to update it.")
+    base = blob_store.load_manifest(game_id, base_version) if _is_safe_name(base_version) else None
+    if base is None or not isinstance(keep, dict):
+        raise Exception("Base version is not available, please upload the full game")
+    kept = {}
+    for rel, digest in keep.items():
+        info = base.get(rel)
+        if not info or info["sha256"] != digest or not blob_store.has_blob(digest):
+            raise Exception("Base version has changed, please upload again")
+        kept[rel] = info
+    return kept
+
+def handle_upload_stream(conn, uploader_name, manifest, base_version=None, keep=None):
+    """
+    串流上傳: 先送 manifest 驗證，通過後 Client 一個一個檔案送過來，直接寫進暫存區
+    不必先存 zip 再解壓縮，每個 byte 只寫一次磁碟；雜湊邊收邊算，blob store 不必再讀一次
+    有給 base_version 時是差異上傳: keep 裡的檔案直接沿用上一版的 blob，Client 只送新增 / 改過的檔案
+    (沒列在 keep 也沒送過來的檔案就是刪掉了)
+    回傳 False 表示資料流已經對不上 (收到一半出錯)，要關閉連線
+    """
+    # 1. 先驗證 manifest，不合法就不用收檔案了
+    try:
+        if not isinstance(manifest, dict):
+            raise Exception("Missing manifest")
+        game_id, version = _check_manifest(manifest)
+        kept = _check_delta_base(game_id, uploader_name, base_version, keep) if base_version is not None else {}
     except Exception as e:
-        error_msg = str(e)
-        print(f"[Upload Error] {error_msg}")
-        send_json(conn, {"status": "error", "msg": error_msg})
-    
-    finally:
-        # 8. 清理垃圾 (無論成功失敗都要做)
-        if os.path.exists(temp_zip):
-            os.remove(temp_zip)
-        if os.path.exists(temp_extract_folder):
-            shutil.rmtree(temp_extract_folder)
+        send_json(conn, {"status": "error", "msg": str(e)})
+        return True
+
+    with _upload_slot() as staging:
+        if staging is None:
+            send_json(conn, busy_reply())
+            return True
+        start = time.perf_counter()
+        try:
+            extract_dir = os.path.join(staging, "extract")
+            os.makedirs(extract_dir)
+            send_json(conn, {"status": "ready_to_receive"})
+
+            # 2. 一邊收一邊寫檔、算雜湊
+            received = _receive_stream(conn, extract_dir)
+            total = sum(info["size"] for info in received.values())
+            print(f"[Upload] Received {len(received)} files ({total} bytes) for {game_id} v{version}"
+                  + (f", {len(kept)} kept from v{base_version}" if base_version is not None else ""))
+        except ConnectionError as e:
+            print(f"[Upload Error] {e}")
+            return False
+        except Exception as e:
+            # 資料流已經對不上，回覆錯誤後關閉連線
+            print(f"[Upload Error] {e}")
+            send_json(conn, {"status": "error", "msg": str(e)})
+            return False
+
+        try:
+            # 3. 收到的 manifest.json 要跟一開始驗證的一樣
+            published = _check_manifest(_read_manifest(extract_dir))
+            if published != (game_id, version):
+                raise Exception("manifest.json does not match the announced manifest")
+            # 沿用的檔案 blob 已經存在，store_version 直接 hardlink 過去
+            _publish_upload(staging, extract_dir, uploader_name, files={**kept, **received})
+            elapsed = time.perf_counter() - start
+            print(f"[Upload] {game_id} v{version} available after {elapsed:.2f}s")
+            send_json(conn, {
+                "status": "ok",
+                "msg": f"Game '{game_id}' (v{version}) uploaded successfully!"
+            })
+        except Exception as e:
+            error_msg = str(e)
+            print(f"[Upload Error] {error_msg}")
+            send_json(conn, {"status": "error", "msg": error_msg})
+    return True
 
 def delete_game_process(conn, uploader_name, game_id):
     """
     處理遊戲下架的邏輯
     """
     #先判斷有沒有房間
-    rooms = get_all_rooms()
-    for room in rooms.values():
-        if room['game_id'] == game_id:
-            send_json(conn, {"status": "error", "msg": "目前無法將遊戲下架，因為有玩家正在遊玩此遊戲的房間中，已將遊戲狀態調整為不可用" })
-            change_game_status(game_id, "unavailable")
-            return
+    if room_registry.has_game(game_id):
+        send_json(conn, {"status": "error", "msg": "目前無法將遊戲下架，因為有玩家正在遊玩此遊戲的房間中，已將遊戲狀態調整為不可用" })
+        change_game_status(game_id, "unavailable")
+        return
     #若沒有就直接下架遊戲
     try:
         # 呼叫 database.py 的刪除函式
         if remove_game(game_id, uploader_name):
+            archive_cache.invalidate(game_id)
+            game_pool.retire(game_id)
+            game_hosts.retire(game_id)
+            blob_store.collect_garbage()
             send_json(conn, {"status": "ok", "msg": f"Game '{game_id}' removed successfully."})
         else:
             send_json(conn, {"status": "error", "msg": "Game not found or you do not have permission to remove it."})
@@ -0,0 +1,134 @@
+import json
+import os
+import secrets
+import subprocess
+import threading
+
+from config import GAME_HOST_PROCESSES
+from utils import read_game_manifest
+from services import game_supervisor, port_pool
+
+# 多房間模式: 同一個遊戲的房間擠在最多 GAME_HOST_PROCESSES 個 game_host.py 裡 (見 game_host.py)
+# 每個房間發一個 room_token，玩家連進 host 時先送 token，host 依 token 分配房間
+# 開新房間時挑房間數最少的 host；每個 host 都有房間在跑、數量又還沒到上限才多開一個
+# 只有 manifest.json 設定 "multi_room": true 的 .py 遊戲才會用這個模式
+# 一個 host 一條控制通道 (見 services/game_supervisor.py)，所有房間共用；Lobby 往 host 的指令走 stdin
+# 遊戲重新上傳 (同版本也算) 或下架時要呼叫 retire()，host 已經 import 的是舊的程式
+
+HOST_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "game_host.py")
+
+_lock = threading.Lock()
+_hosts = {} # game_id -> {"exe": server_exe 的絕對路徑, "hosts": [_Host, ...]}
+
+
+def supports_multi_room(game_path):
+    return bool(read_game_manifest(game_path).get("multi_room"))
+
+
+class _Host:
+    def __init__(self, exe_path, cwd):
+        self.port, listener = port_pool.lease_listener()
+        self.proc, self.channel = game_supervisor.popen_with_channel(
+            ["python", HOST_SCRIPT, "--port", str(self.port), exe_path], cwd, self.port, listener, stdin=subprocess.PIPE)
+        self.rooms = set()
+        self._write_lock = threading.Lock()
+
+    def send(self, msg):
+        with self._write_lock:
+            self.proc.stdin.write((json.dumps(msg) + "\n").encode('utf-8'))
+            self.proc.stdin.flush()
+
+    def retire(self):
+        """不再分配新房間；host 打完進行中的比賽就自己結束"""
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        game_supervisor.reap(self.proc)
+
+
+class HostedRoom:
+    """
+    多房間模式下的一個房間，放進 lobby_service.room_processes 取代 Popen
+    terminate() 只結束這個房間，不影響同一個 host 的其他房間
+    """
+    def __init__(self, host, room_id):
+        self.host = host
+        self.room_id = room_id
+
+    def poll(self):
+        if self.room_id not in self.host.rooms:
+            return 0
+        return self.host.proc.poll()
+
+    def terminate(self):
+        with _lock:
+            if self.room_id not in self.host.rooms:
+                return
+            self.host.rooms.discard(self.room_id)
+        try:
+            self.host.send({"op": "cancel", "room_id": self.room_id})
+        except OSError:
+            pass # host 已經結束
+
+    kill = terminate # 跟 Popen 同樣的介面 (game_supervisor 會用到)，一樣只結束這個房間
+
+
+def _pick_host(game_id, exe_path, cwd):
+    """
+    在 _lock 裡呼叫，回傳 (host, 要退休的 host 清單)
+    退休 (retire / reap) 會拿 game_supervisor 的鎖，呼叫端要放開 _lock 之後再做 (見 game_supervisor._signal)
+    """
+    retired = []
+    entry = _hosts.get(game_id)
+    if entry and entry["exe"] != exe_path:
+        # 遊戲改版了，舊版本的 host 打完手上的比賽就結束
+        retired += entry["hosts"]
+        entry = None
+    if entry is None:
+        entry = _hosts[game_id] = {"exe": exe_path, "hosts": []}
+    # 已經結束的 host 也交給 supervisor 回收 (把 Port 還回去)
+    retired += [h for h in entry["hosts"] if h.proc.poll() is not None]
+    entry["hosts"] = [h for h in entry["hosts"] if h.proc.poll() is None]
+    hosts = entry["hosts"]
+    if len(hosts) < GAME_HOST_PROCESSES and all(h.rooms for h in hosts):
+        hosts.append(_Host(exe_path, cwd))
+    return min(hosts, key=lambda h: len(h.rooms)), retired
+
+
+def open_room(game_id, exe_path, cwd, room_id, players):
+    """
+    把房間分配到某個 host，回傳 (HostedRoom, port, room_token, host 的控制通道)
+    host 啟動失敗丟出 OSError
+    """
+    room_id = str(room_id)
+    token = secrets.token_hex(16)
+    with _lock:
+        host, retired = _pick_host(game_id, exe_path, cwd)
+        host.rooms.add(room_id)
+    for old in retired:
+        old.retire()
+    try:
+        host.send({"op": "open", "room_id": room_id, "token": token, "players": players})
+    except OSError:
+        with _lock:
+            host.rooms.discard(room_id)
+        raise
+    return HostedRoom(host, room_id), host.port, token, host.channel
+
+
+def retire(game_id):
+    """遊戲重新上傳或下架: 這個遊戲的 host 不再接新房間 (進行中的比賽打完)，下一個房間用新的檔案開新的 host"""
+    with _lock:
+        entry = _hosts.pop(game_id, None)
+    for host in (entry["hosts"] if entry else []):
+        host.retire()
+
+
+def shutdown():
+    """Server 關閉時讓所有 host 結束 (進行中的比賽打完)"""
+    with _lock:
+        hosts = [host for entry in _hosts.values() for host in entry["hosts"]]
+        _hosts.clear()
+    for host in hosts:
+        host.retire()
@@ -0,0 +1,131 @@
+import json
+import os
+import subprocess
+import threading
+
+from config import GAME_POOL_SIZE
+from services import game_supervisor, port_pool
+
+# 預先啟動的遊戲 Server 池
+# 冷啟動 (`python server_exe ...`) 每場都要等直譯器啟動、import 完才能讓玩家連線
+# 這裡替每個遊戲 (目前版本) 先開好 GAME_POOL_SIZE 個 game_launcher.py 等著:
+# 已經拿到 listen 好的 Port (見 services/port_pool.py)、編譯好程式、import 好模組，start_game 只要從 stdin (控制用的 pipe) 丟房間參數過去就開始跑
+# 用掉一個就在背景補一個；只有 .py 的 server_exe 才能預先啟動，其他執行檔照舊冷啟動
+# 遊戲重新上傳 (同版本也算) 或下架時要呼叫 retire()，閒置的 launcher 手上是舊的程式
+# 每個遊戲 Server (不管有沒有預先啟動) 都帶著一條控制通道 (見 services/game_supervisor.py)
+
+LAUNCHER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "game_launcher.py")
+
+_lock = threading.Lock()
+_pools = {} # game_id -> {"exe": server_exe 的絕對路徑, "cwd": 遊戲資料夾, "idle": [(proc, port, channel), ...]}
+_refilling = set() # 正在補充的 game_id
+
+
+def _retire(idle):
+    """關掉閒置的 launcher (stdin 一關，launcher 就自己結束)"""
+    for proc, _, channel in idle:
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        channel.close()
+        game_supervisor.reap(proc)
+
+
+def _spawn(exe_path, cwd):
+    port, listener = port_pool.lease_listener()
+    proc, channel = game_supervisor.popen_with_channel(
+        ["python", LAUNCHER, "--port", str(port), exe_path], cwd, port, listener, stdin=subprocess.PIPE)
+    return proc, port, channel
+
+
+def _refill(game_id):
+    try:
+        while True:
+            with _lock:
+                pool = _pools.get(game_id)
+                if not pool or len(pool["idle"]) >= GAME_POOL_SIZE:
+                    return
+                exe_path, cwd = pool["exe"], pool["cwd"]
+            try:
+                entry = _spawn(exe_path, cwd)
+            except OSError as e:
+                print(f"[Pool] Failed to pre-start {game_id}: {e}")
+                return
+            with _lock:
+                if _pools.get(game_id) is pool:
+                    pool["idle"].append(entry)
+                    continue
+            _retire([entry]) # 補的時候遊戲剛好改版或下架了
+    finally:
+        with _lock:
+            _refilling.discard(game_id)
+
+
+def _claim(game_id, exe_path, cwd):
+    """拿一個閒置的 launcher (沒有就回傳 None)，並在背景補滿"""
+    with _lock:
+        pool = _pools.get(game_id)
+        if pool and pool["exe"] != exe_path:
+            # 遊戲改版了，舊版本的 launcher 不能用
+            _retire(pool["idle"])
+            pool = None
+        if pool is None:
+            pool = _pools[game_id] = {"exe": exe_path, "cwd": cwd, "idle": []}
+        claimed = None
+        while pool["idle"] and claimed is None:
+            entry = pool["idle"].pop(0)
+            if entry[0].poll() is None:
+                claimed = entry
+            else:
+                entry[2].close()
+                game_supervisor.reap(entry[0])
+        if game_id not in _refilling:
+            _refilling.add(game_id)
+            threading.Thread(target=_refill, args=(game_id,), daemon=True).start()
+    return claimed
+
+
+def launch(game_id, exe_path, cwd, build_args, inherit_listener=False):
+    """
+    啟動一場遊戲的 Server，回傳 (proc, port, 控制通道)
+    build_args(port): exe 後面要接的參數 (--port、--room_id ...)
+    inherit_listener: 遊戲 Server 會用環境變數 GAME_LISTEN_FD 傳過去的 socket (不自己 bind)
+    """
+    if GAME_POOL_SIZE > 0 and exe_path.endswith('.py'):
+        claimed = _claim(game_id, exe_path, cwd)
+        if claimed:
+            proc, port, channel = claimed
+            try:
+                room = {"argv": build_args(port), "inherit_listener": inherit_listener}
+                proc.stdin.write((json.dumps(room) + "\n").encode('utf-8'))
+                proc.stdin.close()
+                return proc, port, channel
+            except OSError:
+                proc.kill() # launcher 剛好掛了，改用冷啟動
+                channel.close()
+                game_supervisor.reap(proc)
+
+    if inherit_listener:
+        port, listener = port_pool.lease_listener()
+    else:
+        port, listener = port_pool.lease(), None
+    cmd_list = (["python", exe_path] if exe_path.endswith('.py') else [exe_path]) + build_args(port)
+    proc, channel = game_supervisor.popen_with_channel(cmd_list, cwd, port, listener)
+    return proc, port, channel
+
+
+def retire(game_id):
+    """遊戲重新上傳或下架: 關掉這個遊戲所有閒置的 launcher，下次 start_game 再用新的檔案重新預先啟動"""
+    with _lock:
+        pool = _pools.pop(game_id, None)
+        if pool:
+            _retire(pool["idle"])
+
+
+def shutdown():
+    """Server 關閉時結束所有閒置的 launcher"""
+    with _lock:
+        for pool in _pools.values():
+            _retire(pool["idle"])
+        _pools.clear()
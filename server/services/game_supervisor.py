@@ -0,0 +1,422 @@
+import json
+import os
+import selectors
+import socket
+import subprocess
+import threading
+import time
+import traceback
+
+from config import GAME_SUPERVISOR_INTERVAL, GAME_READY_TIMEOUT, GAME_HEARTBEAT_TIMEOUT
+from framing import HEADER
+from services import port_pool
+
+# 監督所有遊戲 Server (一條背景執行緒，第一次 watch() 時啟動)
+# - 每 GAME_SUPERVISOR_INTERVAL 秒 poll() 一次每個 process (內部就是 waitpid(WNOHANG))，結束的 process 馬上被回收，不會留下 zombie
+# - 比賽超過 max_duration 秒，或 idle_timeout 秒內完全沒有動靜 (見 _activity_counter / heartbeat) 就強制結束
+# - 還沒回報結果就結束 (當掉) 或逾時的比賽，呼叫 watch() 時給的 on_abnormal 把房間改回 Waiting
+# Lobby 收到舊版的 end_game 連線、取消比賽時呼叫 release()，之後這裡只負責把 process 收掉
+#
+# 控制通道: 每個遊戲 Server 啟動時繼承一個 AF_UNIX socket (fd 編號放在環境變數 GAME_CONTROL_FD)
+# 遊戲 Server 用一樣的封包格式 (4 bytes 長度 + JSON) 往 Lobby 送:
+#   {"type": "ready"}                                   開始 listen，玩家可以連線了
+#   {"type": "heartbeat", "idle": 秒}                   還活著；idle = 距離玩家上次有動作幾秒 (省略就不檢查閒置)
+#   {"type": "result", "result": ..., "players": {...}} 比賽結束 (players 可省略: 各玩家的結果)
+#   {"type": "error", "reason": ...}                    比賽出錯 (不記戰績，跟當掉一樣處理)
+#   {"type": "telemetry", "data": {...}}                任意統計數字，比賽結束時印出來
+# 多房間的 host 共用一條通道，跟房間有關的訊息多帶 "room_id"
+# 所有通道都在這條執行緒用 selector 一起等，收到結果直接呼叫 on_result，不用再連回 Lobby 的 Port
+# 另外可以繼承一個已經 listen 好的 socket (fd 編號放在環境變數 GAME_LISTEN_FD，見 services/port_pool.py)，直接 accept 就好
+
+CONTROL_FD_ENV = "GAME_CONTROL_FD"
+LISTEN_FD_ENV = "GAME_LISTEN_FD"
+# 控制封包的大小上限
+MAX_CONTROL_FRAME = 64 * 1024
+
+# terminate 之後多久還沒結束就 kill
+KILL_GRACE = 5
+# process 結束後等 end_game 回報的時間 (遊戲 Server 通常是送完 end_game 才結束，Lobby 可能還沒處理到)
+EXIT_GRACE = 3
+
+_lock = threading.Lock()
+_matches = {} # proc -> _Match
+_reaping = [] # [(proc, 還沒結束就 kill 的時間 或 None)]: 已經不屬於任何比賽、等著回收的 process
+_counts = {"finished": 0, "crashed": 0, "timed_out": 0}
+_channels = {} # Lobby 這端的 socket -> _Channel
+_selector = selectors.DefaultSelector()
+_stop = threading.Event()
+_thread = None
+
+
+def popen_with_channel(cmd_list, cwd, port, listener=None, **kwargs):
+    """
+    subprocess.Popen，並讓子程序繼承一條控制通道 (fd 編號放在環境變數 GAME_CONTROL_FD)
+    port: 從 port_pool 借來的 Port，process 被回收時自動還回去
+    listener: port_pool.lease_listener() 準備好的 socket，子程序從環境變數 GAME_LISTEN_FD 拿來直接 accept
+    回傳 (proc, Lobby 這端的通道)，通道交給 watch()，不用了要自己 close()
+    """
+    channel, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    channel.setblocking(False)
+    env = dict(os.environ, **{CONTROL_FD_ENV: str(child.fileno())})
+    pass_fds = [child.fileno()]
+    if listener is not None:
+        env[LISTEN_FD_ENV] = str(listener.fileno())
+        pass_fds.append(listener.fileno())
+    try:
+        proc = subprocess.Popen(cmd_list, cwd=cwd, pass_fds=pass_fds, env=env, **kwargs)
+    except OSError:
+        channel.close()
+        port_pool.release(port)
+        raise
+    finally:
+        child.close()
+        if listener is not None:
+            listener.close() # Lobby 這邊不需要，子程序有自己的一份
+    port_pool.assign(proc, port)
+    return proc, channel
+
+
+class _Channel:
+    def __init__(self, sock, shared):
+        self.sock = sock
+        self.shared = shared # 多房間 host 的通道: 房間都結束了也不關
+        self.buffer = bytearray()
+        self.ready = False
+        self.rooms = {} # room_id -> _Match
+
+
+def _activity_counter(proc):
+    """
+    process 所有執行緒的 context switch 次數總和；拿不到 (不是 Linux、不是真的 process) 回傳 None
+    卡在 accept / recv 或 sleep 的執行緒不會增加，收到玩家封包被叫醒就會 (/proc/<pid>/io 不算 socket 的收發，不能用)
+    """
+    pid = getattr(proc, "pid", None)
+    if pid is None:
+        return None
+    total = 0
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            try:
+                with open(f"/proc/{pid}/task/{tid}/status", 'r') as f:
+                    for line in f:
+                        name, _, value = line.partition(":")
+                        if name.endswith("ctxt_switches"): # voluntary_ / nonvoluntary_
+                            total += int(value)
+            except FileNotFoundError:
+                pass # 執行緒剛好結束
+    except (OSError, ValueError):
+        return None
+    return total
+
+
+class _Match:
+    def __init__(self, room_id, proc, max_duration, idle_timeout, on_abnormal, channel, on_ready, on_result):
+        self.room_id = room_id
+        self.proc = proc
+        self.max_duration = max_duration
+        self.idle_timeout = idle_timeout
+        self.on_abnormal = on_abnormal
+        self.channel = channel
+        self.on_ready = on_ready
+        self.on_result = on_result
+        self.started = self.last_active = time.monotonic()
+        self.activity = _activity_counter(proc)
+        self.exited_at = None
+        self.ready = False
+        self.last_heartbeat = None # 送過 heartbeat 之後，存活與閒置都改看 heartbeat
+        self.reports_idle = False # heartbeat 有帶 idle 才檢查閒置
+        self.telemetry = {}
+
+    def check(self, now):
+        """回傳 (類別, 原因)；還沒出事回傳 None"""
+        code = self.proc.poll()
+        if code is not None:
+            if self.exited_at is None:
+                self.exited_at = now
+            if now - self.exited_at < EXIT_GRACE:
+                return None
+            return "crashed", f"遊戲 Server 沒有回報結果就結束了 (exit code {code})"
+        if self.max_duration and now - self.started > self.max_duration:
+            return "timed_out", f"遊戲超過 {self.max_duration} 秒，已強制結束"
+        if self.on_ready and not self.ready and now - self.started > GAME_READY_TIMEOUT:
+            return "timed_out", f"遊戲 Server {GAME_READY_TIMEOUT} 秒內沒有準備好"
+        if self.last_heartbeat is not None:
+            if now - self.last_heartbeat > GAME_HEARTBEAT_TIMEOUT:
+                return "timed_out", f"遊戲 Server {GAME_HEARTBEAT_TIMEOUT} 秒沒有回應"
+            if self.reports_idle and self.idle_timeout and now - self.last_active > self.idle_timeout:
+                return "timed_out", f"遊戲 {self.idle_timeout} 秒沒有任何動作，已強制結束"
+            return None
+        activity = _activity_counter(self.proc)
+        if activity is not None and activity != self.activity:
+            self.activity = activity
+            self.last_active = now
+        elif self.activity is not None and self.idle_timeout and now - self.last_active > self.idle_timeout:
+            return "timed_out", f"遊戲 {self.idle_timeout} 秒沒有任何動作，已強制結束"
+        return None
+
+
+def watch(room_id, proc, max_duration, idle_timeout, on_abnormal,
+          channel=None, shared_channel=False, on_ready=None, on_result=None):
+    """
+    開始監督一場比賽的遊戲 Server
+    max_duration / idle_timeout: 秒 (0 = 不限制)
+    on_abnormal(room_id, proc, reason): 當掉或逾時時在監督執行緒呼叫 (process 已經被收掉)
+    channel: popen_with_channel() 回傳的通道 (shared_channel: 多房間 host 共用的通道)
+    on_ready(room_id, proc): 遊戲 Server 送出 ready 時呼叫；有給的話 GAME_READY_TIMEOUT 秒內沒 ready 算逾時
+    on_result(room_id, proc, result, players): 從控制通道收到比賽結果時呼叫 (process 已經交給 release() 收掉)
+    以上 callback 都在監督執行緒呼叫
+    """
+    global _thread
+    ready_now = False
+    with _lock:
+        match = _Match(room_id, proc, max_duration, idle_timeout, on_abnormal, channel, on_ready, on_result)
+        _matches[proc] = match
+        if channel is not None:
+            ch = _channels.get(channel)
+            if ch is None:
+                ch = _channels[channel] = _Channel(channel, shared_channel)
+                _selector.register(channel, selectors.EVENT_READ)
+            ch.rooms[str(room_id)] = match
+            # host 之前就送過 ready 了，新房間不用再等
+            ready_now = match.ready = ch.ready
+        if _thread is None:
+            _stop.clear()
+            _thread = threading.Thread(target=_run, name="game-supervisor", daemon=True)
+            _thread.start()
+    if ready_now and on_ready:
+        on_ready(room_id, proc)
+
+
+def uses_channel(proc):
+    """遊戲 Server 有沒有在控制通道上送過 ready / heartbeat (有的話結果只認控制通道)"""
+    with _lock:
+        match = _matches.get(proc)
+        return match is not None and (match.ready or match.last_heartbeat is not None)
+
+
+def release(proc):
+    """比賽正常結束或被取消: 結束遊戲 Server (已經結束也沒關係)，之後在背景回收"""
+    with _lock:
+        match = _matches.pop(proc, None)
+        if match is not None:
+            _counts["finished"] += 1
+            _detach(match)
+        _terminate(proc, time.monotonic())
+    _signal(proc)
+
+
+def _detach(match):
+    """比賽不再使用控制通道；不是共用的通道就關掉"""
+    ch = _channels.get(match.channel)
+    if ch is None:
+        return
+    ch.rooms.pop(str(match.room_id), None)
+    if not ch.rooms and not ch.shared:
+        _close_channel(ch)
+
+
+def _close_channel(ch):
+    _channels.pop(ch.sock, None)
+    try:
+        _selector.unregister(ch.sock)
+    except (KeyError, ValueError):
+        pass
+    ch.sock.close()
+
+
+def reap(proc):
+    """不屬於任何比賽、會自己結束的 process (閒置的預先啟動 Server、退休的 host)，結束後回收"""
+    with _lock:
+        _reaping.append((proc, None))
+
+
+def _terminate(proc, now):
+    """排進回收清單 (KILL_GRACE 秒後還沒結束就 kill)；呼叫端離開 _lock 之後要自己 _signal(proc)"""
+    _reaping.append((proc, now + KILL_GRACE))
+
+
+def _signal(proc, kill=False):
+    """
+    terminate / kill 一定要在 _lock 外面呼叫:
+    HostedRoom 的 terminate 會拿 game_hosts 的鎖，而 game_hosts 拿著自己的鎖時會呼叫 reap()
+    """
+    if proc.poll() is not None:
+        return
+    try:
+        if kill:
+            proc.kill()
+        else:
+            proc.terminate()
+    except OSError:
+        pass
+
+
+def _still_running(proc, kill_at, now, to_kill):
+    if proc.poll() is not None:
+        port_pool.release_owner(proc)
+        return False
+    if kill_at is not None and now > kill_at:
+        to_kill.append(proc)
+    return True
+
+
+def _check():
+    now = time.monotonic()
+    aborted = []
+    to_kill = []
+    with _lock:
+        for proc, match in list(_matches.items()):
+            problem = match.check(now)
+            if problem is None:
+                continue
+            kind, reason = problem
+            del _matches[proc]
+            _counts[kind] += 1
+            _detach(match)
+            _terminate(proc, now)
+            aborted.append((match, reason))
+        _reaping[:] = [(p, kill_at) for p, kill_at in _reaping if _still_running(p, kill_at, now, to_kill)]
+
+    for match, _ in aborted:
+        _signal(match.proc)
+    for proc in to_kill:
+        _signal(proc, kill=True)
+    for match, reason in aborted:
+        print(f"[Supervisor] Room {match.room_id}: {reason}")
+        try:
+            match.on_abnormal(match.room_id, match.proc, reason)
+        except Exception:
+            traceback.print_exc()
+
+
+def _read_channel(ch):
+    """把通道上收到的封包都拆出來，回傳 [msg, ...]；對方關閉或亂傳就關掉通道"""
+    try:
+        data = ch.sock.recv(MAX_CONTROL_FRAME)
+    except BlockingIOError:
+        return []
+    except OSError:
+        data = b""
+    if not data:
+        _close_channel(ch) # 遊戲 Server 結束了；比賽本身由 poll() 判斷
+        return []
+    ch.buffer += data
+    messages = []
+    while len(ch.buffer) >= HEADER.size:
+        length = HEADER.unpack_from(ch.buffer)[0]
+        if length > MAX_CONTROL_FRAME:
+            _close_channel(ch)
+            return messages
+        if len(ch.buffer) < HEADER.size + length:
+            break
+        body = bytes(ch.buffer[HEADER.size:HEADER.size + length])
+        del ch.buffer[:HEADER.size + length]
+        try:
+            msg = json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            continue
+        if isinstance(msg, dict):
+            messages.append(msg)
+    return messages
+
+
+def _handle_message(ch, msg, now):
+    """處理一個控制封包，回傳要在鎖外面呼叫的 callback [(func, args), ...]"""
+    kind = msg.get("type")
+    if "room_id" in msg:
+        match = ch.rooms.get(str(msg["room_id"]))
+        targets = [match] if match else []
+    else:
+        targets = list(ch.rooms.values())
+    calls = []
+    if kind == "ready":
+        if not msg.get("room_id"):
+            ch.ready = True
+        for match in targets:
+            if not match.ready:
+                match.ready = True
+                if match.on_ready:
+                    calls.append((match.on_ready, (match.room_id, match.proc)))
+    elif kind == "heartbeat":
+        for match in targets:
+            match.last_heartbeat = now
+            # 沒帶 idle (例如 host 整個 process 的 heartbeat) 只代表還活著
+            if "idle" not in msg:
+                continue
+            try:
+                match.last_active = now - float(msg["idle"])
+                match.reports_idle = True
+            except (TypeError, ValueError):
+                pass
+    elif kind == "telemetry" and isinstance(msg.get("data"), dict):
+        for match in targets:
+            match.telemetry.update(msg["data"])
+    elif kind == "error":
+        reason = f"遊戲 Server 發生錯誤: {msg.get('reason')}"
+        for match in targets:
+            if _matches.pop(match.proc, None) is None:
+                continue
+            _counts["crashed"] += 1
+            _detach(match)
+            _terminate(match.proc, now)
+            calls.append((_signal, (match.proc,)))
+            print(f"[Supervisor] Room {match.room_id}: {reason}")
+            calls.append((match.on_abnormal, (match.room_id, match.proc, reason)))
+    elif kind == "result":
+        for match in targets:
+            if _matches.pop(match.proc, None) is None:
+                continue
+            _counts["finished"] += 1
+            _detach(match)
+            _terminate(match.proc, now)
+            calls.append((_signal, (match.proc,)))
+            summary = f" telemetry={match.telemetry}" if match.telemetry else ""
+            print(f"[Supervisor] Room {match.room_id}: finished in {now - match.started:.1f}s{summary}")
+            if match.on_result:
+                calls.append((match.on_result, (match.room_id, match.proc, msg.get("result"), msg.get("players"))))
+    return calls
+
+
+def _poll_channels(timeout):
+    calls = []
+    for key, _ in _selector.select(timeout):
+        with _lock:
+            ch = _channels.get(key.fileobj)
+            if ch is None:
+                continue
+            now = time.monotonic()
+            for msg in _read_channel(ch):
+                calls += _handle_message(ch, msg, now)
+    for func, args in calls:
+        try:
+            func(*args)
+        except Exception:
+            traceback.print_exc()
+
+
+def _run():
+    next_check = time.monotonic() + GAME_SUPERVISOR_INTERVAL
+    while not _stop.is_set():
+        _poll_channels(max(0, next_check - time.monotonic()))
+        if time.monotonic() >= next_check:
+            _check()
+            next_check = time.monotonic() + GAME_SUPERVISOR_INTERVAL
+
+
+def stats():
+    """{"live": 進行中的比賽, "finished": 正常結束, "crashed": 當掉, "timed_out": 逾時被結束} (後三個是累計數量)"""
+    with _lock:
+        return dict(_counts, live=len(_matches))
+
+
+def log_stats():
+    s = stats()
+    print(f"[Stats] Games: live={s['live']} finished={s['finished']} crashed={s['crashed']} timed_out={s['timed_out']}")
+
+
+def shutdown():
+    """Server 關閉時停止監督 (不結束進行中的比賽)"""
+    global _thread
+    _stop.set()
+    with _lock:
+        _thread = None
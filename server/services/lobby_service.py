@@ -1,40 +1,38 @@
-import socket
 import threading
-import subprocess
 import os
 import time
 import json
+import secrets
+import ipaddress
 
 # 引用工具與資料庫
-from utils import recv_json, send_json, zip_game_folder_to_player, send_file, compare_versions_player
-from db_storage.database import verify_login, register_user, get_all_games, create_room_in_db, get_all_rooms, join_room_in_db, update_room_status, remove_player_from_room, get_room_info, add_player_ready, remove_player_ready, record_player_game_record, get_player_game_records, add_review, player_exit
-from config import LOBBY_PORT
+from utils import recv_json, send_json, send_file, compare_versions_player, read_game_manifest
+from services.archive_cache import get_player_archive, get_file_manifest, get_delta_archive
+from services import game_pool, game_hosts, game_supervisor
+from db_storage.database import verify_login, register_user, get_all_games, get_catalog, get_game_info, record_player_game_record, get_player_game_records, add_review, list_reviews, player_exit
+from db_storage.room_registry import room_registry
+from config import LOBBY_PORT, GAME_HOST_PROCESSES, GAME_MAX_DURATION, GAME_IDLE_TIMEOUT
 # --- 全域變數 ---
 online_users = {} # username -> conn
-room_processes = {} # room_id -> subprocess.Popen
-room_id_counter = 1
+room_processes = {} # room_id (str) -> subprocess.Popen
+pending_starts = {} # room_id (str) -> 等遊戲 Server 送出 ready 才廣播的 game_start 訊息
 online_users_lock = threading.Lock()
-
-# --- 輔助函式: 尋找閒置 Port ---
-def find_free_port():
-    """
-    找一個目前沒被佔用的 Port 給遊戲 Server 使用
-    範圍: 10000 ~ 20000 (避免撞到系統 Port)
-    """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind(('', 0)) # OS 自動分配
-        return s.getsockname()[1]
+session_tokens = {} # session_token -> username (登入時發給 Client，讓背景連線用 attach_session 接上同一個帳號)
+# attach_session 接上的背景連線只能做這些事 (查詢與下載)，房間相關的操作一律走主連線
+ATTACHED_COMMANDS = {'list_games', 'get_game_info', 'list_rooms', 'compare_version',
+                     'download_game', 'get_file_manifest', 'download_delta', 'played_game_list'}
+MAX_REVIEW_PAGE = 50 # list_reviews 一次最多回傳幾則
+# 會傳檔、佔住執行緒很久的指令 (asyncio 模式交給另一個執行緒池，見 async_engine.py)
+TRANSFER_COMMANDS = {'download_game', 'download_delta'}
 
 # --- 廣播函式 ---
 def broadcast_to_room(room_id, message_dict):
     """
     將訊息傳送給房間內的所有人
     """
-    room_info = get_room_info(room_id)
-    if not room_info:
+    player_names = room_registry.player_names(room_id)
+    if not player_names:
         return
-    
-    player_names = room_info['players']
 
     with online_users_lock:
         for pname in player_names:
@@ -45,386 +43,536 @@ def broadcast_to_room(room_id, message_dict):
                 except:
                     print(f"[Error] Failed to send message to {pname}")
 
+# --- 遊戲 Server 的事件 (game_supervisor 在監督執行緒呼叫) ---
+def announce_game_start(room_id, proc):
+    """遊戲 Server 送出 ready: 這時才叫房間內的玩家連線"""
+    msg = pending_starts.pop(room_id, None)
+    if msg and room_processes.get(room_id) is proc:
+        broadcast_to_room(room_id, msg)
+
+def finish_room_game(room_id, proc, result, players=None):
+    """
+    比賽結束 (控制通道送來的 result，或舊版遊戲 Server 的 end_game)
+    記錄戰績、房間改回 Waiting，並通知房間內的玩家 (players: 各玩家的結果，遊戲有給才有)
+    """
+    room = room_registry.info(room_id)
+    if not room or room_processes.get(room_id) is not proc:
+        return # 房間已經結束這場比賽 (或換了一場)
+    room_processes.pop(room_id, None)
+    pending_starts.pop(room_id, None)
+    result = str(result or "Draw") # Win/Lose/Draw
+    for p in room['players']:
+        record_player_game_record(p, room['game_id'], result.lower())
+    #移除房間中準備的人數
+    room_registry.clear_ready(room_id)
+    room_registry.set_status(room_id, "Waiting", None)
+    msg = {"cmd": "game_ended", "result": result}
+    if players:
+        msg["players"] = players
+    broadcast_to_room(room_id, msg)
+
+def abort_room_game(room_id, proc, reason):
+    """
+    遊戲 Server 沒回報結果就結束、或逾時被強制結束
+    房間改回 Waiting，並通知房間內的玩家
+    """
+    if room_processes.get(room_id) is not proc:
+        return # 房間已經結束這場比賽 (或換了一場)
+    room_processes.pop(room_id, None)
+    room_registry.clear_ready(room_id)
+    room_registry.set_status(room_id, "Waiting", None)
+    if pending_starts.pop(room_id, None):
+        # 玩家還沒收到 game_start
+        broadcast_to_room(room_id, {"cmd": "game_start_failed", "msg": f"遊戲 Server 啟動失敗: {reason}"})
+    else:
+        broadcast_to_room(room_id, {"cmd": "game_ended", "result": None, "msg": reason})
+
+# --- 傳送打包好的遊戲檔 (download_game / download_delta 共用) ---
+def send_archive(conn, archive, **extra):
+    """
+    1. 回覆大小與 sha256 (Client 用它找之前沒下載完的檔案並在最後驗證)，extra 一併放進回覆
+    2. 等 Client 回 ready_to_receive，resume_from = Client 手上已經有的 bytes 數
+    3. 從 resume_from 開始傳檔 (壓縮檔是內容定址的，同一個 digest 的內容不會變，可以直接從中間接著送)
+    4. 等待最終確認
+    回傳 False 表示要關閉連線
+    """
+    try:
+        print("[Upload] 正在請求上傳...")
+        send_json(conn, {"status": "ok", "file_size": archive['size'], "digest": archive['digest'], **extra})
+
+        res = recv_json(conn)
+        if not res or res.get('status') != 'ready_to_receive':
+            print(f"[Error] Client 拒絕上傳: {res.get('msg') if res else 'disconnected'}")
+            return False
+        resume_from = res.get('resume_from', 0)
+        if not isinstance(resume_from, int) or not 0 <= resume_from <= archive['size']:
+            resume_from = 0
+        print("[Upload] 開始傳輸檔案...")
+        send_file(conn, archive['path'], offset=resume_from)
+
+        final_res = recv_json(conn)
+        if final_res and final_res['status'] == 'ok':
+            print(f"\n>>> {final_res['msg']} <<<")
+        else:
+            print(f"[Error] 上傳失敗: {final_res.get('msg') if final_res else 'disconnected'}")
+    except Exception as e:
+        print(f"[Error]連線異常: {e}")
+    return True
+
 # --- 主邏輯 ---
-def handle_lobby_client(conn, addr):
-    global room_id_counter
+class LobbySession:
+    """一條玩家連線的狀態 (不論是哪種連線模型都共用)"""
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.addr = addr
+        self.current_user = None
+        self.current_room_id = None
+        self.attached = False # 是不是用 attach_session 接上的背景連線
+
+def open_lobby_session(conn, addr):
     print(f"[Lobby] {addr} connected.")
-    
-    current_user = None
-    current_room_id = None
+    return LobbySession(conn, addr)
 
+def handle_lobby_request(session, req):
+    """
+    處理一個指令
+    回傳: True (繼續等下一個指令), False (關閉連線)
+    """
+    conn = session.conn
+    addr = session.addr
+    cmd = req.get('cmd')
+    print(f"[Lobby] {addr} User: {session.current_user} | Cmd: {cmd}")
+
+    if session.attached and cmd not in ATTACHED_COMMANDS:
+        send_json(conn, {"status": "error", "msg": "Command not allowed on attached session"})
+        return True
+
+    # === 1. 註冊 (Register) ===
+    if cmd == 'register':
+        username = req.get('username')
+        password = req.get('password')
+        if register_user(username, password, role="player"):
+            send_json(conn, {"status": "ok", "msg": "Register success"})
+        else:
+            send_json(conn, {"status": "error", "msg": "Username exists"})
+
+    # === 2. 登入 (Login) ===
+    elif cmd == 'login':
+        username = req.get('username')
+        password = req.get('password')
+        if verify_login(username, password, role="player"):
+            session.current_user = username
+
+            token = secrets.token_hex(16)
+            with online_users_lock:
+                online_users[username] = conn
+                session_tokens[token] = username
+
+            send_json(conn, {"status": "ok", "msg": f"Welcome {username}", "session_token": token})
+        else:
+            send_json(conn, {"status": "error", "msg": "Wrong username or password or already online"})
+
+    # === 背景連線 (例如 Client 的預先下載) 接上已登入的帳號，不算重複登入 ===
+    elif cmd == 'attach_session':
+        if session.current_user:
+            send_json(conn, {"status": "error", "msg": "Already logged in"})
+            return True
+        with online_users_lock:
+            username = session_tokens.get(req.get('session_token'))
+        if not username:
+            send_json(conn, {"status": "error", "msg": "Invalid or expired session"})
+            return True
+        session.current_user = username
+        session.attached = True
+        send_json(conn, {"status": "ok", "msg": f"Attached to {username}"})
+
+    elif cmd == 'end_game':
+        # 舊版遊戲 Server 連回來回報結果 (新的遊戲 Server 走控制通道，見 finish_room_game)
+        # 遊戲 Server 跑在 Lobby 這台機器上: 只接受本機連線，而且只給沒在用控制通道的遊戲 Server 用
+        room_id = str(req.get('room_id'))
+        proc = room_processes.get(room_id)
+        if not ipaddress.ip_address(addr[0]).is_loopback or proc is None or game_supervisor.uses_channel(proc):
+            send_json(conn, {"status": "error", "msg": "end_game not allowed"})
+            return True
+        finish_room_game(room_id, proc, req.get('result'))
+        game_supervisor.release(proc)
+    # === Middleware: 以下指令都需要登入 ===
+    elif not session.current_user:
+        send_json(conn, {"status": "error", "msg": "Please login first"})
+        return True
+    # === 3. 列出所有遊戲 (List Games) ===
+    elif cmd == 'list_games':
+        # 精簡版遊戲目錄；Client 帶著上次拿到的版本號來，沒變就不用再傳一次
+        version, game_list = get_catalog()
+        if req.get('if_none_match') == version:
+            send_json(conn, {"status": "ok", "not_modified": True, "version": version})
+        else:
+            send_json(conn, {"status": "ok", "version": version, "games": game_list})
+
+    elif cmd == 'get_game_info':
+        game_info = get_game_info(req.get('game_id'))
+        if not game_info:
+            send_json(conn, {"status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
+        else:
+            send_json(conn, {"status": "ok", "game": game_info})
+
+    # === 4. 列出房間 (List Rooms) ===
+    elif cmd == 'list_rooms':
+        room_list = []
+        for rdata in room_registry.list_info():
+            game_name = rdata['game_id']
+            room_list.append({
+                "id": rdata['id'],
+                "game_id": game_name,
+                "host": rdata['host'],
+                "status": rdata['status'],
+                "cur_players": len(rdata['players']),
+                "max_players": rdata['max_players']
+            })
+        send_json(conn, {"status": "ok", "rooms": room_list})
+
+    elif cmd == 'get_host':
+        if not session.current_room_id:
+            send_json(conn, {"status": "error", "msg": "Not in a room"})
+            return True
+        room_info = room_registry.info(session.current_room_id)
+        if not room_info:
+            send_json(conn, {"status": "error", "msg": "Room not found"})
+            return True
+        host_name = room_info['host']
+        flag = (host_name == session.current_user)
+        send_json(conn, {"status": "ok", "host": flag})
+
+    # === 5. 建立房間 (Create Room) ===
+    elif cmd == 'create_room':
+        game_id = req.get('game_id')
+        all_games = get_all_games()
+
+        if game_id not in all_games:
+            send_json(conn, {"status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
+            return True
+        #檢查遊戲是否為不可用狀態
+        if all_games[game_id]['status'] == "unavailable":
+            send_json(conn, {"status": "error", "msg": "遊戲目前不可用，請聯絡開發者"})
+            return True
+        max_p = all_games[game_id].get('max_players', 4)
+        rid = room_registry.create(game_id, session.current_user, max_p)
+        session.current_room_id = rid
+
+        send_json(conn, { "status": "ok", "room_id": rid, "msg": "Room created"})
+        broadcast_to_room(rid, {"cmd": "player_joined", "username": session.current_user})
+
+    # === 6. 加入房間 (Join Room) ===
+    elif cmd == 'join_room':
+        target_rid = str(req.get('room_id'))
+
+        # 判斷是否可加入
+        room_info = room_registry.info(target_rid)
+        if not room_info:
+            send_json(conn, {"status": "error", "msg": "Room not found"})
+            return True
+        games = get_all_games()
+        if room_info['game_id'] not in games:
+            send_json(conn, {"status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
+            return True
+        if games[room_info['game_id']]['status'] == "unavailable":
+            send_json(conn, {"status": "error", "msg": "遊戲目前不可用，請聯絡開發者"})
+            return True
+        success, msg = room_registry.join(target_rid, session.current_user)
+        if success:
+            session.current_room_id = target_rid
+            send_json(conn, {"status": "ok", "msg": msg})
+
+            broadcast_to_room(target_rid, {
+                "cmd": "player_joined", "username": session.current_user
+            })
+        else:
+            send_json(conn, {"status": "error", "msg": msg})
+
+    # === 7. 開始遊戲 (Start Game) - 核心難點 ===
+    elif cmd == 'start_game':
+        if not session.current_room_id:
+            send_json(conn, {"cmd": "start_game_error", "status": "error", "msg": "Not in a room"})
+            return True
+        room_info = room_registry.info(session.current_room_id)
+        if not room_info:
+            send_json(conn, {"cmd": "start_game_error", "status": "error", "msg": "Room not found"})
+            return True
+        if room_info['host'] != session.current_user:
+            #讓非房主進行準備
+            room_registry.add_ready(session.current_room_id, session.current_user)
+            send_json(conn, {"cmd": "player_ready", "msg": "You are ready"})
+            return True
+        if room_info['host'] == session.current_user:
+            #先檢查遊戲被下架了沒
+            all_games = get_all_games()
+            if room_info['game_id'] not in all_games:
+                broadcast_to_room(session.current_room_id, {"cmd": "start_game_error", "status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
+                room_registry.clear_ready(session.current_room_id)
+                return True
+            #檢查遊戲是否為不可用狀態
+            if all_games[room_info['game_id']]['status'] == "unavailable":
+                broadcast_to_room(session.current_room_id, {"cmd": "start_game_error", "status": "error", "msg": "遊戲目前不可用，請聯絡開發者"})
+                room_registry.clear_ready(session.current_room_id)
+                return True
+            #確認有沒有滿足最少玩家數
+            if len(room_info['players']) < all_games[room_info['game_id']].get('min_players', 2):
+                send_json(conn, {"cmd": "start_game_error", "status": "error", "msg": "Not enough players to start the game"})
+                return True
+            #確認除了自己 大家都準備好就開始
+            all_ready = all(player in room_info.get('ready_players', []) for player in room_info['players'] if player != session.current_user)
+            if not all_ready:
+                send_json(conn, {"cmd": "start_game_error", "status": "error", "msg": "Not all players are ready"})
+                return True
+            room_registry.add_ready(session.current_room_id, session.current_user)
+        # 1~2. 找 Port 並啟動 Process (有預先啟動好的就直接拿來用，見 services/game_pool.py)
+        #      支援多房間的遊戲則是分配到共用的 host process (見 services/game_hosts.py)
+        game_id = room_info['game_id']
+        all_games = get_all_games()
+        game_path = all_games[game_id]['path']
+        server_exe = all_games[game_id]['server_exe']
+        client_exe = all_games[game_id]['client_exe']
+        client_args = all_games[game_id].get('client_args', "")
+        full_exe_path = os.path.abspath(os.path.join(game_path, server_exe))
+        player_num = len(room_info['players'])
+        room_id = session.current_room_id
+        server_args = all_games[game_id].get('server_args', "").split()
+
+        def build_args(port):
+            return ["--port", str(port), "--lobby_ip", "127.0.0.1", "--lobby_port", str(LOBBY_PORT),
+                    "--room_id", str(room_id), "--players", str(player_num)] + server_args
+        room_token = None
+        manifest = read_game_manifest(game_path)
+        try:
+            if GAME_HOST_PROCESSES > 0 and full_exe_path.endswith('.py') and game_hosts.supports_multi_room(game_path):
+                proc, game_port, room_token, channel = game_hosts.open_room(
+                    game_id, full_exe_path, os.path.abspath(game_path), room_id, player_num)
+            else:
+                # 有控制通道的遊戲也認得 GAME_LISTEN_FD，直接用 Lobby listen 好的 socket
+                proc, game_port, channel = game_pool.launch(game_id, full_exe_path, os.path.abspath(game_path), build_args,
+                                                            inherit_listener=bool(manifest.get("control_channel")))
+            room_processes[session.current_room_id] = proc
+            start_msg = {
+                "cmd": "game_start", 
+                "ip": "140.113.17.11", 
+                "port": game_port,
+                "client_args": client_args,
+                "game_path": game_path,
+                "client_exe": client_exe,
+                "room_id": session.current_room_id,
+                "room_token": room_token # 多房間模式: Client 連上 host 後要先送這個
+            }
+            # 會送 ready 的遊戲 Server (manifest 的 "control_channel": true；多房間的 host 一定會) 等它準備好才叫玩家連線
+            wait_ready = room_token is not None or bool(manifest.get("control_channel"))
+            if wait_ready:
+                pending_starts[session.current_room_id] = start_msg
+            # 3. 更新 DB 狀態
+            room_registry.set_status(session.current_room_id, "Playing", game_port)
+
+            # 結果、當掉、逾時都由 game_supervisor 從控制通道 / process 狀態通知 (見上面的 finish_room_game 等)
+            game_supervisor.watch(room_id, proc,
+                                  manifest.get("max_duration", GAME_MAX_DURATION),
+                                  manifest.get("idle_timeout", GAME_IDLE_TIMEOUT),
+                                  abort_room_game,
+                                  channel=channel, shared_channel=room_token is not None,
+                                  on_ready=announce_game_start if wait_ready else None,
+                                  on_result=finish_room_game)
+
+            # 4. 廣播
+            if not wait_ready:
+                broadcast_to_room(session.current_room_id, start_msg)
+
+        except Exception as e:
+            pending_starts.pop(session.current_room_id, None)
+            proc = room_processes.pop(session.current_room_id, None)
+            if proc:
+                game_supervisor.release(proc)
+            broadcast_to_room(session.current_room_id, {"cmd": "game_start_failed", "msg": "有玩家啟動遊戲失敗，遊戲已中止"})
+            room_registry.clear_ready(session.current_room_id)
+            room_registry.set_status(session.current_room_id, "Waiting", None)
+
+    elif cmd == 'client_start_failed':
+        # 玩家端無法啟動遊戲的回報
+        room_id = str(req.get('room_id'))
+        pending_starts.pop(room_id, None)
+        proc = room_processes.pop(room_id, None)
+        if proc:
+            game_supervisor.release(proc)
+            print(f"[System] 已關閉房間 {room_id} 的遊戲進程")
+            room_registry.clear_ready(room_id)
+            room_registry.set_status(room_id, "Waiting", None)
+            broadcast_to_room(room_id, {"cmd": "game_start_failed", "msg": "有玩家啟動遊戲失敗，遊戲已中止"})
+
+    elif cmd == 'leave_room':
+        if not session.current_room_id:
+            send_json(conn, {"status": "error", "msg": "Not in a room"})
+            return True
+        #紀錄房主以外的人 來告訴他們房間關閉了
+
+        result = room_registry.leave(session.current_room_id, session.current_user)
+        room_info = room_registry.info(session.current_room_id)
+        host_name = room_info['host'] if room_info else None
+        if result == "player_left":
+            broadcast_to_room(session.current_room_id, {
+                "cmd": "player_left", "username": session.current_user
+            })
+        elif result == "host_changed":
+            broadcast_to_room(session.current_room_id, {
+                "cmd": "host_changed", "msg": f"Host left, new host {host_name} assigned."
+            })
+        elif result == "room_closed":
+            broadcast_to_room(session.current_room_id, {
+                "cmd": "room_closed", "msg": "Host left, room closed."
+            })
+
+        session.current_room_id = None
+        send_json(conn, {"status": "ok", "msg": "Left the room"})
+
+    # === 8. 下載遊戲 (Download) ===
+    elif cmd == 'compare_version':
+        game_id = req.get('game_id')
+        current_version = req.get('current_version')
+
+        all_games = get_all_games()
+        if game_id not in all_games:
+            send_json(conn, {"status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
+            return True
+        latest_version = all_games[game_id]['version']
+        if latest_version == current_version:
+            send_json(conn, {"status": "ok", "up_to_date": True, "msg": "You have the latest version."})
+        else:
+            send_json(conn, {"status": "ok", "up_to_date": False, "latest_version": latest_version, "msg": "A new version is available."})
+
+    # === 9. 下載遊戲 (Download) ===
+    elif cmd == 'download_game':
+        # 這是給 Client 下載 ZIP 用的
+        target_game_id = req.get('game_id')
+        all_games = get_all_games()
+        if target_game_id not in all_games:
+            send_json(conn, {"status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
+            return True
+        game_info = all_games[target_game_id]
+        game_path = game_info['path'] # e.g. "games/snake/1.0"
+
+        # 每個版本只打包一次 (上傳時或第一次下載時)，之後所有玩家共用同一個唯讀檔案
+        archive = get_player_archive(target_game_id, game_info['version'], game_path)
+        if not archive:
+            send_json(conn, {"status": "error", "msg": "Failed to create zip"})
+            return True
+        return send_archive(conn, archive)
+
+    # 差異更新用: 最新版每個檔案的雜湊
+    elif cmd == 'get_file_manifest':
+        target_game_id = req.get('game_id')
+        all_games = get_all_games()
+        if target_game_id not in all_games:
+            send_json(conn, {"status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
+            return True
+        game_info = all_games[target_game_id]
+        files = get_file_manifest(target_game_id, game_info['version'], game_info['path'])
+        if files is None:
+            send_json(conn, {"status": "error", "msg": "Failed to create zip"})
+            return True
+        send_json(conn, {"status": "ok", "version": game_info['version'], "files": files})
+
+    # 差異更新: Client 告訴我們它手上每個檔案的雜湊，只傳新增 / 改過的檔案 + 要刪除的清單
+    elif cmd == 'download_delta':
+        target_game_id = req.get('game_id')
+        have = req.get('have')
+        all_games = get_all_games()
+        if target_game_id not in all_games:
+            send_json(conn, {"status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
+            return True
+        if not isinstance(have, dict):
+            send_json(conn, {"status": "error", "msg": "Missing file list"})
+            return True
+        game_info = all_games[target_game_id]
+        delta = get_delta_archive(target_game_id, game_info['version'], game_info['path'], have)
+        if not delta:
+            send_json(conn, {"status": "error", "msg": "Failed to create zip"})
+            return True
+        return send_archive(conn, delta, version=game_info['version'], files=delta['files'],
+                            changed=delta['changed'], deleted=delta['deleted'])
+
+    # 評論
+    elif cmd == "played_game_list":
+        records = get_player_game_records(session.current_user)
+        unique_game_ids = set(record["game_id"] for record in records)
+        _, game_list = get_catalog()
+        # 轉成 List 回傳
+        filtered_games = [g for g in game_list if g["game_id"] in unique_game_ids]
+        send_json(conn, {"status": "ok", "played_games": filtered_games})
+
+    elif cmd == 'list_reviews':
+        # 評論分頁 (由新到舊)，cursor 帶上一頁回傳的 next_cursor
+        game_id = req.get('game_id')
+        cursor = req.get('cursor')
+        try:
+            limit = min(max(int(req.get('limit', 5)), 1), MAX_REVIEW_PAGE)
+            cursor = int(cursor) if cursor is not None else None
+        except (TypeError, ValueError):
+            send_json(conn, {"status": "error", "msg": "Invalid cursor or limit"})
+            return True
+        reviews, next_cursor = list_reviews(game_id, cursor, limit)
+        send_json(conn, {"status": "ok", "reviews": reviews, "next_cursor": next_cursor})
+
+    elif cmd == 'submit_review':
+        game_id = req.get('game_id')
+        rating = req.get('rating')
+        comment = req.get('comment')
+        add_review(
+            game_id=game_id,
+            player_name=session.current_user,
+            score=rating,
+            comment=comment)
+        send_json(conn, {"status": "ok", "msg": "Review submitted successfully."})
+    else:
+        send_json(conn, {"status": "error", "msg": "Unknown command"})
+    return True
+
+def close_lobby_session(session):
+    conn = session.conn
+    addr = session.addr
+    if session.attached:
+        # 背景連線不影響登入狀態與房間
+        conn.close()
+        print(f"[Lobby] {addr} (attached) disconnected.")
+        return
+    # === 斷線處理 (Cleanup) ===
+    # 如果玩家斷線，要從房間移除。如果他是房主，解散房間。
+    if session.current_user:
+        with online_users_lock:
+            if session.current_user in online_users:
+                del online_users[session.current_user]
+            # 主連線斷了，這次登入發出的 token 跟著失效 (背景連線之後的指令照常處理，但無法再接上)
+            for token in [t for t, user in session_tokens.items() if user == session.current_user]:
+                del session_tokens[token]
+        if session.current_room_id:
+            result = room_registry.leave(session.current_room_id, session.current_user)
+            if result == "player_left":
+                broadcast_to_room(session.current_room_id, {
+                    "cmd": "player_left", "username": session.current_user
+                })
+            elif result == "room_closed":
+                broadcast_to_room(session.current_room_id, {
+                    "cmd": "room_closed", "msg": "Host left, room closed."
+                })
+    player_exit(session.current_user, role="player")
+    conn.close()
+    print(f"[Lobby] {addr} disconnected.")
+
+def handle_lobby_client(conn, addr):
+    """一條連線一個執行緒的版本: 在這裡阻塞等待指令"""
+    session = open_lobby_session(conn, addr)
     try:
         while True:
             req = recv_json(conn)
             if not req: break
-            
-            cmd = req.get('cmd')
-            print(f"[Lobby] {addr} User: {current_user} | Cmd: {cmd}")
-
-            # === 1. 註冊 (Register) ===
-            if cmd == 'register':
-                username = req.get('username')
-                password = req.get('password')
-                if register_user(username, password, role="player"):
-                    send_json(conn, {"status": "ok", "msg": "Register success"})
-                else:
-                    send_json(conn, {"status": "error", "msg": "Username exists"})
-
-            # === 2. 登入 (Login) ===
-            elif cmd == 'login':
-                username = req.get('username')
-                password = req.get('password')
-                if verify_login(username, password, role="player"):
-                    current_user = username
-
-                    with online_users_lock:
-                        online_users[username] = conn
-
-                    send_json(conn, {"status": "ok", "msg": f"Welcome {username}"})
-                else:
-                    send_json(conn, {"status": "error", "msg": "Wrong username or password or already online"})
-
-            elif cmd == 'end_game':
-                # 玩家遊戲結束後的回報 (可選)
-                room_id = req.get('room_id')
-                result = req.get('result')  # Win/Lose/Draw
-                # 這裡可以更新玩家的遊戲紀錄或評分
-                room = get_room_info(room_id)
-                player = room['players']
-                for p in player:
-                    record_player_game_record(p, room['game_id'], result.lower())
-                #移除房間中準備的人數
-                remove_player_ready(room_id)
-                update_room_status(room_id, "Waiting", None)
-                broadcast_to_room(room_id, {"cmd": "game_ended", "result": result})
-                proc = room_processes.get(room_id)
-                if proc:
-                    proc.terminate()
-                if room_id in room_processes:
-                    del room_processes[room_id]
-            # === Middleware: 以下指令都需要登入 ===
-            elif not current_user:
-                send_json(conn, {"status": "error", "msg": "Please login first"})
-                continue
-
-            # === 3. 列出所有遊戲 (List Games) ===
-            elif cmd == 'list_games':
-                # 從 DB 讀取遊戲列表 (包含評分)
-                games_data = get_all_games()
-                # 轉成 List 回傳
-                game_list = list(games_data.values())
-                send_json(conn, {"status": "ok", "games": game_list})
-
-            # === 4. 列出房間 (List Rooms) ===
-            elif cmd == 'list_rooms':
-                rooms_data = get_all_rooms()
-                room_list = []
-
-                all_games = get_all_games()
-                for rid, rdata in rooms_data.items():
-                    game_name = rdata['game_id']
-                    room_list.append({
-                        "id": rid,
-                        "game_id": game_name,
-                        "host": rdata['host'],
-                        "status": rdata['status'],
-                        "cur_players": len(rdata['players']),
-                        "max_players": rdata['max_players']
-                    })
-                send_json(conn, {"status": "ok", "rooms": room_list})
-
-            elif cmd == 'get_host':
-                if not current_room_id:
-                    send_json(conn, {"status": "error", "msg": "Not in a room"})
-                    continue
-                room_info = get_room_info(current_room_id)
-                if not room_info:
-                    send_json(conn, {"status": "error", "msg": "Room not found"})
-                    continue
-                host_name = room_info['host']
-                flag = (host_name == current_user)
-                send_json(conn, {"status": "ok", "host": flag})
-
-            # === 5. 建立房間 (Create Room) ===
-            elif cmd == 'create_room':
-                game_id = req.get('game_id')
-                all_games = get_all_games()
-                
-                if game_id not in all_games:
-                    send_json(conn, {"status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
-                    continue
-                #檢查遊戲是否為不可用狀態
-                if all_games[game_id]['status'] == "unavailable":
-                    send_json(conn, {"status": "error", "msg": "遊戲目前不可用，請聯絡開發者"})
-                    continue
-                max_p = all_games[game_id].get('max_players', 4)
-                rid = room_id_counter
-
-                create_room_in_db(rid, game_id, current_user, max_p)
-                current_room_id = rid
-                room_id_counter += 1
-
-                send_json(conn, { "status": "ok", "room_id": rid, "msg": "Room created"})
-                broadcast_to_room(rid, {"cmd": "player_joined", "username": current_user})
-                
-            # === 6. 加入房間 (Join Room) ===
-            elif cmd == 'join_room':
-                target_rid = req.get('room_id')
-
-                # 判斷是否可加入
-                room_info = get_room_info(target_rid)
-                if not room_info:
-                    send_json(conn, {"status": "error", "msg": "Room not found"})
-                    continue
-                games = get_all_games()
-                if room_info['game_id'] not in games:
-                    send_json(conn, {"status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
-                    continue
-                if games[room_info['game_id']]['status'] == "unavailable":
-                    send_json(conn, {"status": "error", "msg": "遊戲目前不可用，請聯絡開發者"})
-                    continue
-
-                success, msg = join_room_in_db(target_rid, current_user)
-                if success:
-                    current_room_id = target_rid
-                    send_json(conn, {"status": "ok", "msg": msg})
-
-                    broadcast_to_room(target_rid, {
-                        "cmd": "player_joined", "username": current_user
-                    })
-                else:
-                    send_json(conn, {"status": "error", "msg": msg})
-
-            # === 7. 開始遊戲 (Start Game) - 核心難點 ===
-            elif cmd == 'start_game':
-                if not current_room_id:
-                    send_json(conn, {"cmd": "start_game_error", "status": "error", "msg": "Not in a room"})
-                    continue
-                
-                room_info = get_room_info(current_room_id)
-                if not room_info:
-                    send_json(conn, {"cmd": "start_game_error", "status": "error", "msg": "Room not found"})
-                    continue
-                if room_info['host'] != current_user:
-                    #讓非房主進行準備
-                    add_player_ready(current_room_id, current_user)
-                    send_json(conn, {"cmd": "player_ready", "msg": "You are ready"})
-                    continue
-                
-                if room_info['host'] == current_user:
-                    #先檢查遊戲被下架了沒
-                    all_games = get_all_games()
-                    if room_info['game_id'] not in all_games:
-                        broadcast_to_room(current_room_id, {"cmd": "start_game_error", "status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
-                        remove_player_ready(current_room_id)
-                        continue
-                    #檢查遊戲是否為不可用狀態
-                    if all_games[room_info['game_id']]['status'] == "unavailable":
-                        broadcast_to_room(current_room_id, {"cmd": "start_game_error", "status": "error", "msg": "遊戲目前不可用，請聯絡開發者"})
-                        remove_player_ready(current_room_id)
-                        continue
-                    #確認有沒有滿足最少玩家數
-                    if len(room_info['players']) < all_games[room_info['game_id']].get('min_players', 2):
-                        send_json(conn, {"cmd": "start_game_error", "status": "error", "msg": "Not enough players to start the game"})
-                        continue
-                    #確認除了自己 大家都準備好就開始
-                    all_ready = all(player in room_info.get('ready_players', []) for player in room_info['players'] if player != current_user)
-                    if not all_ready:
-                        send_json(conn, {"cmd": "start_game_error", "status": "error", "msg": "Not all players are ready"})
-                        continue
-                    add_player_ready(current_room_id, current_user)
-                # 1. 找 Port
-                game_port = find_free_port()
-                
-                # 2. 啟動 Process (邏輯同前，略過細節)
-                game_id = room_info['game_id']
-                all_games = get_all_games()
-                game_path = all_games[game_id]['path']
-                server_exe = all_games[game_id]['server_exe']
-                client_exe = all_games[game_id]['client_exe']
-                client_args = all_games[game_id].get('client_args', "")
-                full_exe_path = os.path.abspath(os.path.join(game_path, server_exe))
-                player_num = len(room_info['players'])
-                try:
-                    cmd_list = ["python", full_exe_path, "--port", str(game_port), "--lobby_ip", "140.113.17.11", "--lobby_port", str(LOBBY_PORT), "--room_id", str(current_room_id), "--players", str(player_num)] + all_games[game_id].get('server_args', "").split() if full_exe_path.endswith('.py') else [full_exe_path, "--port", str(game_port), "--lobby_ip", "127.0.0.1", "--lobby_port", str(LOBBY_PORT), "--room_id", str(current_room_id), "--players", str(player_num)] + all_games[game_id].get('server_args', "").split()
-                    proc = subprocess.Popen(cmd_list, cwd=os.path.abspath(game_path))
-                    room_processes[current_room_id] = proc
-                    # 3. 更新 DB 狀態
-                    update_room_status(current_room_id, "Playing", game_port)
-                    
-                    # 4. 廣播
-                    broadcast_to_room(current_room_id, {
-                        "cmd": "game_start", 
-                        "ip": "140.113.17.11", 
-                        "port": game_port,
-                        "client_args": client_args,
-                        "game_path": game_path,
-                        "client_exe": client_exe,
-                        "room_id": current_room_id
-                    })
-                    
-                except Exception as e:
-                    if current_room_id in room_processes:
-                        proc = room_processes[current_room_id]
-                        if proc:
-                            proc.terminate()
-                        if current_room_id in room_processes:
-                            del room_processes[current_room_id]
-                    broadcast_to_room(current_room_id, {"cmd": "game_start_failed", "msg": "有玩家啟動遊戲失敗，遊戲已中止"})
-                    remove_player_ready(current_room_id)
-                    update_room_status(current_room_id, "Waiting", None)
-
-            elif cmd == 'client_start_failed':
-                # 玩家端無法啟動遊戲的回報
-                room_id = req.get('room_id')
-                proc = room_processes.get(room_id)
-                if proc:
-                    proc.terminate()
-                    print(f"[System] 已關閉房間 {room_id} 的遊戲進程")
-                if room_id in room_processes:
-                    del room_processes[room_id] 
-                    remove_player_ready(room_id)
-                    update_room_status(room_id, "Waiting", None)
-                    broadcast_to_room(room_id, {"cmd": "game_start_failed", "msg": "有玩家啟動遊戲失敗，遊戲已中止"})
-
-            elif cmd == 'leave_room':
-                if not current_room_id:
-                    send_json(conn, {"status": "error", "msg": "Not in a room"})
-                    continue
-                #紀錄房主以外的人 來告訴他們房間關閉了
-                
-                result = remove_player_from_room(current_room_id, current_user)
-                room_info = get_room_info(current_room_id)
-                host_name = room_info['host'] if room_info else None
-                if result == "player_left":
-                    broadcast_to_room(current_room_id, {
-                        "cmd": "player_left", "username": current_user
-                    })
-                elif result == "host_changed":
-                    broadcast_to_room(current_room_id, {
-                        "cmd": "host_changed", "msg": f"Host left, new host {host_name} assigned."
-                    })
-                elif result == "room_closed":
-                    broadcast_to_room(current_room_id, {
-                        "cmd": "room_closed", "msg": "Host left, room closed."
-                    })
-                
-                current_room_id = None
-                send_json(conn, {"status": "ok", "msg": "Left the room"})
-
-            # === 8. 下載遊戲 (Download) ===
-            elif cmd == 'compare_version':
-                game_id = req.get('game_id')
-                current_version = req.get('current_version')
-
-                all_games = get_all_games()
-                if game_id not in all_games:
-                    send_json(conn, {"status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
-                    continue
-
-                latest_version = all_games[game_id]['version']
-                if latest_version == current_version:
-                    send_json(conn, {"status": "ok", "up_to_date": True, "msg": "You have the latest version."})
-                else:
-                    send_json(conn, {"status": "ok", "up_to_date": False, "latest_version": latest_version, "msg": "A new version is available."})
-
-            # === 9. 下載遊戲 (Download) ===
-            elif cmd == 'download_game':
-                # 這是給 Client 下載 ZIP 用的
-                target_game_id = req.get('game_id')
-                all_games = get_all_games()
-                if target_game_id not in all_games:
-                    send_json(conn, {"status": "error", "msg": "遊戲不存在或者剛剛被下架了"})
-                    continue
-                
-                game_info = all_games[target_game_id]
-                game_path = game_info['path'] # e.g. "games/snake/1.0"
-                
-                # 我們需要把這個資料夾打包成 zip 傳給玩家
-                # 或是如果開發者上傳時留了 zip 備份，直接傳那個也可以
-                # 這裡示範: 即時打包 (或你可以回傳之前上傳暫存的 zip，看你設計)
-                
-                # 簡化版：假設我們不打包，請玩家自己去跟 Developer Server 下載 (不建議)
-                # 進階版：呼叫 utils 的 send_file 傳送
-                # 為了 Demo 方便，這裡先留白，或直接用 send_file 傳送 "games/{id}/{ver}/client" 資料夾
-                # (作業提示通常是讓 Client 下載整包)
-                zip_path = zip_game_folder_to_player(game_path)
-                if not zip_path:
-                    send_json(conn, {"status": "error", "msg": "Failed to create zip"})
-                    continue
-
-                try:
-                    # 2. 發送上傳請求
-                    print("[Upload] 正在請求上傳...")
-                    send_json(conn, {"status": "ok", "file_size": os.path.getsize(zip_path)})
-
-                    # 3. 等待 client 說 "Ready" (Handshake)
-                    # 這對應我們在 dev_service 寫的邏輯
-                    res = recv_json(conn)
-                    if not res or res.get('status') != 'ready_to_receive':
-                        print(f"[Error] Client 拒絕上傳: {res.get('msg')}")
-                        return
-
-                    # 4. 開始傳檔
-                    print("[Upload] 開始傳輸檔案...")
-                    send_file(conn, zip_path)
-
-                    # 5. 等待最終確認
-                    final_res = recv_json(conn)
-                    if final_res and final_res['status'] == 'ok':
-                        print(f"\n>>> {final_res['msg']} <<<")
-                    else:
-                        print(f"[Error] 上傳失敗: {final_res.get('msg')}")
-
-                except Exception as e:
-                    print(f"[Error]連線異常: {e}")
-                finally:
-                    # 清除暫存檔
-                    if os.path.exists(zip_path):
-                        os.remove(zip_path)
-            # 評論
-            elif cmd == "played_game_list":
-                records = get_player_game_records(current_user)
-                unique_game_ids = set(record["game_id"] for record in records)
-                games_data = get_all_games()
-                # 轉成 List 回傳
-                filtered_games = [games_data[gid] for gid in unique_game_ids if gid in games_data]
-                send_json(conn, {"status": "ok", "played_games": filtered_games})
-
-            elif cmd == 'submit_review':
-                game_id = req.get('game_id')
-                rating = req.get('rating')
-                comment = req.get('comment')
-                add_review(
-                    game_id=game_id,
-                    player_name=current_user,
-                    score=rating,
-                    comment=comment)
-                send_json(conn, {"status": "ok", "msg": "Review submitted successfully."})
-            else:
-                send_json(conn, {"status": "error", "msg": "Unknown command"})
-
+            if not handle_lobby_request(session, req):
+                break
     except Exception as e:
         print(f"[Lobby Error] {e}")
         import traceback
         traceback.print_exc()
     finally:
-        # === 斷線處理 (Cleanup) ===
-        # 如果玩家斷線，要從房間移除。如果他是房主，解散房間。
-        if current_user:
-            with online_users_lock:
-                if current_user in online_users:
-                    del online_users[current_user]
-            if current_room_id:
-                result = remove_player_from_room(current_room_id, current_user)
-                if result == "player_left":
-                    broadcast_to_room(current_room_id, {
-                        "cmd": "player_left", "username": current_user
-                    })
-                elif result == "room_closed":
-                    broadcast_to_room(current_room_id, {
-                        "cmd": "room_closed", "msg": "Host left, room closed."
-                    })
-        player_exit(current_user, role="player")
-        conn.close()
-        print(f"[Lobby] {addr} disconnected.")
\ No newline at end of file
+        close_lobby_session(session)
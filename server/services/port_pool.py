@@ -0,0 +1,72 @@
+import socket
+import threading
+import time
+from collections import deque
+
+from config import GAME_PORT_RANGE, LISTEN_BACKLOG
+from utils import find_free_port
+
+# 遊戲 Server 用的 Port 池
+# find_free_port() 每次都要 bind 一個暫時的 socket 再關掉，而且關掉之後到遊戲 Server bind 之前，別的程式可能先搶走
+# 這裡由 Lobby 自己管理 GAME_PORT_RANGE (要避開系統分配 ephemeral port 的範圍)，只在記憶體裡借還號碼:
+# - 開遊戲 Server 的 process 時 lease()，process 被 game_supervisor 回收時自動 release
+# - 平台自己的程式 (預先啟動的 launcher、多房間 host) 與使用控制通道的遊戲，Lobby 直接把 bind + listen 好的 socket 傳過去 (見 lease_listener)，完全沒有空窗
+# 池子用完 (或都還在冷卻) 時退回 find_free_port()
+
+# 還回來的 Port 至少隔這麼久才再借出去 (前一場的連線可能還在 TIME_WAIT，遊戲 Server 自己 bind 會失敗)
+PORT_REUSE_DELAY = 60
+# lease_listener() bind 失敗 (被池子外的程式佔走) 時最多換幾個 Port 重試
+MAX_BIND_ATTEMPTS = 5
+
+_lock = threading.Lock()
+_free = deque((port, float('-inf')) for port in range(GAME_PORT_RANGE[0], GAME_PORT_RANGE[1] + 1)) # [(port, 還回來的時間)]
+_owners = {} # proc -> port
+
+
+def _in_range(port):
+    return GAME_PORT_RANGE[0] <= port <= GAME_PORT_RANGE[1]
+
+
+def lease():
+    """借一個 Port 號碼 (不會 bind)"""
+    with _lock:
+        if _free and time.monotonic() - _free[0][1] >= PORT_REUSE_DELAY:
+            return _free.popleft()[0]
+    return find_free_port()
+
+
+def release(port):
+    if not _in_range(port):
+        return # find_free_port() 給的，不用還
+    with _lock:
+        _free.append((port, time.monotonic()))
+
+
+def lease_listener():
+    """借一個 Port 並 bind + listen 好，回傳 (port, socket)；要交給子程序繼承 (見 game_supervisor.popen_with_channel)"""
+    for _ in range(MAX_BIND_ATTEMPTS):
+        port = lease()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            # 上一場留下的 TIME_WAIT 不影響重新 bind
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('0.0.0.0', port))
+            sock.listen(LISTEN_BACKLOG)
+            return port, sock
+        except OSError:
+            sock.close()
+            release(port)
+    raise OSError("No free port for game server")
+
+
+def assign(proc, port):
+    """port 跟著 proc：proc 被回收時 (release_owner) 還回池子"""
+    with _lock:
+        _owners[proc] = port
+
+
+def release_owner(proc):
+    with _lock:
+        port = _owners.pop(proc, None)
+    if port is not None:
+        release(port)
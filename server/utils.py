@@ -1,25 +1,23 @@
 import json
+import time
 import os
-import struct
 import zipfile
 import shutil # 用來移動資料夾
+import socket
+from framing import send_frame, recv_frame, recv_exact, FrameTooLargeError
+from framing import send_file_body, recv_file_body, format_rate
+from archive_codec import write_archive, get_executor
+from config import ARCHIVE_CODEC, ARCHIVE_WORKERS
 
 def send_json(sock, data_dict):
     """
     將 Python Dict 轉為 JSON -> 加上長度 Header -> 發送
     """
     # 1. 序列化: Dict -> JSON String -> Bytes
-    json_str = json.dumps(data_dict)
-    msg_bytes = json_str.encode('utf-8')
-    
-    # 2. 計算長度: 取得 bytes 的長度
-    msg_len = len(msg_bytes)
-    
-    # 3. 打包 Header: '!I' 代表 Network byte order (Big-endian), Unsigned Int (4 bytes)
-    header = struct.pack('!I', msg_len)
-    
-    # 4. 發送: Header + Body
-    sock.sendall(header + msg_bytes)
+    msg_bytes = json.dumps(data_dict).encode('utf-8')
+
+    # 2. 發送: Header + Body (封包格式見 framing.py)
+    send_frame(sock, msg_bytes)
 
 
 def recv_json(sock):
@@ -27,24 +25,18 @@ def recv_json(sock):
     接收 4 bytes Header -> 讀取對應長度 Body -> 解析 JSON 回傳 Dict
     若連線中斷則回傳 None
     """
-    # 1. 先讀取 4 bytes (Header)
-    header = recvall(sock, 4)
-    if not header:
-        return None # 連線已關閉
-        
-    # 2. 解包 Header 取得內容長度
-    msg_len = struct.unpack('!I', header)[0]
-    
-    # 3. 根據長度讀取完整的 Body
-    body_bytes = recvall(sock, msg_len)
-    if not body_bytes:
-        return None # 讀取 Body 途中發生錯誤或斷線
-        
-    # 4. 反序列化: Bytes -> JSON String -> Dict
     try:
-        json_str = body_bytes.decode('utf-8')
-        return json.loads(json_str)
-    except json.JSONDecodeError:
+        body_bytes = recv_frame(sock)
+    except FrameTooLargeError as e:
+        print(f"[Error] {e}")
+        return None
+    if body_bytes is None:
+        return None # 連線已關閉或讀取途中斷線
+
+    # 反序列化: Bytes -> JSON String -> Dict
+    try:
+        return json.loads(body_bytes.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError):
         print("[Error] Received invalid JSON")
         return None
 
@@ -53,23 +45,14 @@ def recvall(sock, n):
     輔助函式: 確保一定讀滿 n 個 bytes 才會 return
     解決 TCP 斷包問題 (例如一次只收到半個 JSON 的情況)
     """
-    data = b''
-    while len(data) < n:
-        try:
-            packet = sock.recv(n - len(data))
-            if not packet:
-                return None # 對方關閉了連線
-            data += packet
-        except ConnectionResetError:
-            return None
-    return data
+    return recv_exact(sock, n)
 
-def send_file(sock, filepath):
+def send_file(sock, filepath, offset=0):
     """
     流程：
     1. 檢查檔案是否存在
-    2. 發送 JSON Header (包含檔名與大小)
-    3. 發送檔案內容 (Binary)
+    2. 發送 JSON Header (包含檔名、大小與起始位置)
+    3. 發送檔案內容 (Binary)，從 offset 開始 (續傳時只送對方還沒有的部分)
     """
     if not os.path.exists(filepath):
         # 告訴 Client 檔案找不到
@@ -79,34 +62,36 @@ def send_file(sock, filepath):
 
     filesize = os.path.getsize(filepath)
     filename = os.path.basename(filepath)
+    offset = min(max(offset, 0), filesize)
 
-    # 1. 先傳 Header
+    # 1. 先傳 Header (size 是整個檔案的大小，實際傳送 size - offset bytes)
     header = {
         "status": "ok",
         "cmd": "file_download_header",
         "filename": filename,
-        "size": filesize
+        "size": filesize,
+        "offset": offset
     }
     send_json(sock, header)
 
-    # 2. 再傳檔案內容 (分塊讀取，避免記憶體爆炸)
+    # 2. 再傳檔案內容 (能用 sendfile 就不經過 Python，否則大塊分段讀取，避免記憶體爆炸)
+    count = filesize - offset
+    start = time.perf_counter()
     with open(filepath, 'rb') as f:
-        while True:
-            # 每次讀 4096 bytes 傳送
-            chunk = f.read(4096)
-            if not chunk:
-                break
-            sock.sendall(chunk)
-    
-    print(f"[System] Sent file: {filename} ({filesize} bytes)")
+        f.seek(offset)
+        send_file_body(sock, f, count)
+    elapsed = time.perf_counter() - start
+
+    resumed = f", resumed at {offset}" if offset else ""
+    print(f"[System] Sent file: {filename} ({count} bytes{resumed}, {elapsed:.2f}s, {format_rate(count, elapsed)})")
 
-def recv_file(sock, save_dir):
+def recv_file(sock, save_dir, save_name=None):
     """
     流程：
     1. 接收 JSON Header
     2. 解析檔案大小
     3. 循環接收 Binary 直到收滿大小
-    4. 存檔
+    4. 存檔 (檔名用 save_name，沒給就用對方傳來的檔名，只取最後一段避免寫到 save_dir 外面)
     """
     # 1. 等待 Header
     header = recv_json(sock)
@@ -116,29 +101,57 @@ def recv_file(sock, save_dir):
 
     filename = header['filename']
     filesize = header['size']
-    save_path = os.path.join(save_dir, filename)
+    save_path = os.path.join(save_dir, save_name or os.path.basename(filename))
 
     print(f"[Download] Receiving {filename} ({filesize} bytes)...")
 
-    # 2. 接收檔案內容
-    received_size = 0
+    # 2. 接收檔案內容 (直接收進大緩衝區再寫檔)
+    start = time.perf_counter()
     with open(save_path, 'wb') as f:
-        while received_size < filesize:
-            # 計算還剩多少沒收
-            remaining = filesize - received_size
-            # 這次最多收 4096 或 剩下的量
-            chunk_size = 4096 if remaining > 4096 else remaining
-            
-            chunk = sock.recv(chunk_size)
-            if not chunk:
-                break # 斷線保護
-            
-            f.write(chunk)
-            received_size += len(chunk)
-
-    print(f"[Download] Saved to {save_path}")
+        received_size = recv_file_body(sock, f, filesize)
+    elapsed = time.perf_counter() - start
+
+    if received_size < filesize:
+        print(f"[Error] Connection lost after {received_size}/{filesize} bytes")
+        return None
+
+    print(f"[Download] Saved to {save_path} ({elapsed:.2f}s, {format_rate(filesize, elapsed)})")
     return save_path
 
+def safe_join(base, rel):
+    """把對方傳來的相對路徑接在 base 底下，跑出 base (絕對路徑、..) 時丟出 ValueError"""
+    base = os.path.abspath(base)
+    target = os.path.abspath(os.path.join(base, rel))
+    if os.path.commonpath([base, target]) != base or target == base:
+        raise ValueError(f"Unsafe path: {rel}")
+    return target
+
+def extract_zip_safely(zip_path, dest_dir, max_total_size):
+    """
+    一個一個檔案串流解壓縮 (每次 1 MiB，不會整個檔案讀進記憶體)
+    路徑跑出 dest_dir (絕對路徑、..) 或解壓後總大小超過 max_total_size 時丟出 ValueError
+    回傳解壓縮後的總 bytes 數
+    """
+    total = 0
+    with zipfile.ZipFile(zip_path, 'r') as zf:
+        for member in zf.infolist():
+            target = safe_join(dest_dir, member.filename)
+            if member.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zf.open(member) as src, open(target, 'wb') as dst:
+                while True:
+                    chunk = src.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    # 以實際解出來的大小計算，不相信 zip 裡記錄的大小 (zip bomb)
+                    total += len(chunk)
+                    if total > max_total_size:
+                        raise ValueError(f"Extracted size exceeds limit of {max_total_size} bytes")
+                    dst.write(chunk)
+    return total
+
 def validate_game_folder_to_client(folder_path):
     print(f"[Check] 正在檢查遊戲資料夾: {folder_path} ...")
 
@@ -197,18 +210,19 @@ def zip_game_folder_to_player(folder_path, output_zip_name="temp_game.zip", user
     print(f"[System] Zipping game files from '{folder_path}'...")
     
     try:
-        with zipfile.ZipFile(output_zip_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # 加入 manifest.json
-            manifest_path = os.path.join(folder_path, 'manifest.json')
-            zipf.write(manifest_path, arcname='manifest.json')
-            # 加入 client 資料夾下所有檔案
-            client_folder = os.path.join(folder_path, 'client')
-            for root, dirs, files in os.walk(client_folder):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, folder_path)  # 保留相對路徑
-                    zipf.write(file_path, arcname)
-        print(f"[System] Successfully packed into {output_zip_name}")
+        # 加入 manifest.json
+        manifest_path = os.path.join(folder_path, 'manifest.json')
+        entries = [(manifest_path, 'manifest.json')]
+        # 加入 client 資料夾下所有檔案
+        client_folder = os.path.join(folder_path, 'client')
+        for root, dirs, files in os.walk(client_folder):
+            for file in files:
+                file_path = os.path.join(root, file)
+                arcname = os.path.relpath(file_path, folder_path)  # 保留相對路徑
+                entries.append((file_path, arcname))
+        # 大檔案交給 process pool 平行壓縮
+        write_archive(output_zip_name, entries, codec=ARCHIVE_CODEC, executor=get_executor(ARCHIVE_WORKERS))
+        print(f"[System] Successfully packed into {output_zip_name} ({ARCHIVE_CODEC})")
         return output_zip_name
 
     except Exception as e:
@@ -230,4 +244,27 @@ def compare_versions_player(v1, v2):
             return v1
         elif a < b:
             return v2
-    return v1  # 相同則回傳 v2
\ No newline at end of file
+    return v1  # 相同則回傳 v2
+
+# --- 尋找閒置 Port ---
+def find_free_port():
+    """
+    找一個目前沒被佔用的 Port 給遊戲 Server 使用
+    範圍: 10000 ~ 20000 (避免撞到系統 Port)
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('', 0)) # OS 自動分配
+        return s.getsockname()[1]
+
+# --- 讀取已上架版本的 manifest.json ---
+def read_game_manifest(game_path):
+    """
+    回傳 games/<id>/<version>/manifest.json 的內容 (Dict)，讀不到就回傳空的 Dict
+    不快取: 同版本重新上傳會換掉整個版本資料夾
+    """
+    try:
+        with open(os.path.join(game_path, "manifest.json"), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}